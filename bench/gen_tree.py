@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+# gen_tree.py
+#
+# Generates a synthetic BF2_ModTools tree with N sides, M worlds and K textures per
+# side, with the xmunge scripts linked into data_<ID>/_BUILD and the stub toolchain from
+# stubs/fake_tool.py on hand.
+import os
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+FAKE_TOOL = Path(__file__).resolve().parent / "stubs" / "fake_tool.py"
+
+# The executables in ToolsFL/bin
+TOOLS = ["LevelPack", "MovieMunge"]
+TOOLS += [
+    f"{category}Munge"
+    for category in [
+        "Bin",
+        "Config",
+        "Font",
+        "Localize",
+        "Odf",
+        "PathPlanning",
+        "Script",
+        "Sprite",
+        "Terrain",
+        "World",
+    ]
+]
+TOOLS += [
+    f"{platform}_{category}Munge"
+    for platform in ["pc", "ps2", "xbox"]
+    for category in ["Model", "Shader", "Texture"]
+]
+
+SPRITES = [
+    "all_sprite_soldier_snow",
+    "all_sprite_pilot",
+    "all_sprite_soldier",
+    "all_sprite_soldierjungle",
+    "cis_sprite_bdroid",
+    "cis_sprite_sbdroid",
+    "cis_sprite_droideka",
+    "imp_sprite_officer",
+    "imp_sprite_tiepilot",
+    "imp_sprite_stormtroopersnow",
+    "imp_sprite_stormtrooper",
+    "imp_sprite_atatpilot",
+    "imp_sprite_scout",
+    "rep_sprite_trooper",
+]
+
+
+def _write(path: Path, contents: str = "", size: int = 0) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        file.write(contents)
+        if size:
+            file.write(f"{path.name}\n" * (size // (len(path.name) + 1)))
+
+
+def _req(entries: dict[str, list[str]]) -> str:
+    sections = "\n".join(
+        f'    REQN\n    {{\n        "{kind}"\n'
+        + "".join(f'        "{name}"\n' for name in names)
+        + "    }"
+        for kind, names in entries.items()
+    )
+    return f"ucft\n{{\n{sections}\n}}\n"
+
+
+def _gen_common(data_dir: Path, textures: int) -> None:
+    common = data_dir / "Common"
+    for i in range(4):
+        _write(common / "odf" / f"com_weap_{i}.odf", "[WeaponClass]\n")
+        _write(common / "effects" / f"com_sfx_{i}.fx", "Effect()\n")
+        _write(common / "MSHs" / f"com_msh_{i}.msh", size=2048)
+        _write(common / "effects" / f"com_fxmsh_{i}.msh", size=1024)
+    _write(common / "combos" / "com_combo.combo", "State()\n")
+    _write(common / "scripts" / "setup_teams.lua", "-- setup\n")
+    _write(common / "hud" / "hud.hud", "Hud()\n")
+    _write(common / "mcfg" / "com.mcfg", "Movie()\n")
+    _write(common / "sanm" / "com.sanm", "Anim()\n")
+    _write(common / "fonts" / "gamefont.fff", size=512)
+    for i in range(textures):
+        _write(common / "textures" / f"com_tex_{i}.tga", size=4096)
+    _write(common / "shaders" / "normal.xml", "<shader/>\n")
+    _write(common / "Sound" / "common.snd", "Sound()\n")
+    _write(common / "Localize" / "english.cfg", 'Scope("common") {}\n')
+    _write(common / "Localize" / "PC" / "english.cfg", 'Scope("pc") {}\n')
+    for sprite in SPRITES:
+        _write(
+            common / "sprites" / sprite / "output" / "packed" / f"{sprite}.tga",
+            size=1024,
+        )
+        # The sides the sprites are munged into, as in the stock data directory
+        (data_dir / "Sides" / sprite.split("_")[0].upper()).mkdir(
+            parents=True, exist_ok=True
+        )
+
+    core = [f"com_weap_{i}" for i in range(2)]
+    _write(common / "core.req", _req({"class": core, "script": ["setup_teams"]}))
+    _write(common / "common.req", _req({"model": [f"com_msh_{i}" for i in range(4)]}))
+    _write(
+        common / "ingame.req",
+        _req({"texture": [f"com_tex_{i}" for i in range(textures)]}),
+    )
+    _write(common / "inshell.req", _req({"config": ["hud"]}))
+    _write(common / "mission.req", _req({"lvl": ["bench_con"]}))
+    _write(common / "mission" / "bench_con.req", _req({"script": ["setup_teams"]}))
+    _write(common / "req" / "fpm" / "fpm.req", _req({"model": ["com_msh_0"]}))
+
+
+def _gen_side(data_dir: Path, side: str, textures: int) -> None:
+    side_dir = data_dir / "Sides" / side
+    prefix = side.lower()
+    units = [f"{prefix}_inf_unit{i}" for i in range(4)]
+    for unit in units:
+        _write(side_dir / "odf" / f"{unit}.odf", "[GameObjectClass]\n")
+        _write(side_dir / "msh" / f"{unit}.msh", size=8192)
+    _write(side_dir / "effects" / f"{prefix}_fx.fx", "Effect()\n")
+    _write(side_dir / "odf" / f"{prefix}.combo", "State()\n")
+    for i in range(textures):
+        _write(side_dir / "msh" / f"{prefix}_tex_{i}.tga", size=16384)
+    _write(side_dir / "Sound" / f"{prefix}.snd", "Sound()\n")
+    for unit in units:
+        _write(side_dir / "req" / f"{unit}.req", _req({"class": [unit]}))
+    _write(side_dir / f"{prefix}.req", _req({"lvl": units}))
+
+
+def _gen_world(data_dir: Path, world: str, textures: int) -> None:
+    world_dir = data_dir / "Worlds" / world
+    prefix = world.lower()
+    for i in range(4):
+        _write(world_dir / "odf" / f"{prefix}_prop_{i}.odf", "[GameObjectClass]\n")
+        _write(world_dir / "msh" / f"{prefix}_prop_{i}.msh", size=8192)
+    for i in range(textures):
+        _write(world_dir / "msh" / f"{prefix}_tex_{i}.tga", size=16384)
+    _write(world_dir / "world1" / f"{prefix}.ter", size=65536)
+    _write(world_dir / "world1" / f"{prefix}.wld", "World()\n")
+    _write(world_dir / "world1" / f"{prefix}_conquest.lyr", "Layer()\n")
+    _write(world_dir / "world1" / f"{prefix}.pth", "Path()\n")
+    _write(world_dir / "world1" / f"{prefix}.pln", "Planning()\n")
+    _write(world_dir / "world1" / f"{prefix}.sky", "Sky()\n")
+    _write(world_dir / "world1" / f"{prefix}.fx", "Effect()\n")
+    _write(world_dir / "world1" / f"{prefix}.lgt", "Light()\n")
+    _write(world_dir / "world1" / f"{prefix}.bnd", "Boundary()\n")
+    _write(world_dir / "world1" / f"{prefix}.prp", "Prop()\n")
+    _write(world_dir / "Sound" / f"{prefix}.snd", "Sound()\n")
+    _write(world_dir / "world1" / f"{prefix}.req", _req({"world": [prefix]}))
+    _write(
+        world_dir / "world1" / f"{prefix}_conquest.mrq",
+        _req({"world": [f"{prefix}_conquest"]}),
+    )
+    _write(world_dir / "sky" / "REQ" / f"{prefix}_sky.req", _req({"sky": [prefix]}))
+
+
+def generate_tree(
+    root: Path, sides: int, worlds: int, textures: int, mod_id: str = "BEN"
+) -> Path:
+    """
+    Generates a synthetic modtools tree
+    :param root: The directory to create BF2_ModTools in
+    :param sides: The number of sides to generate (besides Sides/Common)
+    :param worlds: The number of worlds to generate (besides Worlds/Common)
+    :param textures: The number of textures to generate per side and world
+    :param mod_id: The three-letter world ID, used to name data_<ID>
+    :return: The path of the data_<ID>/_BUILD directory to run xmunge from
+    """
+    modtools = root / "BF2_ModTools"
+    data_dir = modtools / f"data_{mod_id}"
+    build_dir = data_dir / "_BUILD"
+    build_dir.mkdir(parents=True, exist_ok=True)
+
+    # xmunge itself, linked rather than copied so that the benchmark always measures the
+    # working tree
+    for name in ["munge.py", "clean.py", "xm"]:
+        link = build_dir / name
+        if not link.exists():
+            link.symlink_to(REPO_DIR / name)
+
+    # The stub toolchain
+    bin_dir = modtools / "ToolsFL" / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    # Placeholders for the tools, which munge workers only agree to run if they exist
+    for tool in TOOLS:
+        (bin_dir / f"{tool}.exe").touch()
+    stub_dir = modtools / "stubbin"
+    stub_dir.mkdir(exist_ok=True)
+    for name in ["wine", "wineserver"]:
+        link = stub_dir / name
+        if not link.exists():
+            link.symlink_to(FAKE_TOOL)
+
+    gamedata = root / "GameData"
+    (gamedata / "addon").mkdir(parents=True, exist_ok=True)
+    with open(modtools / ".swbf2", "w") as swbf2_file:
+        swbf2_file.write(str(gamedata))
+
+    _gen_common(data_dir, textures)
+    _write(data_dir / "Shell" / "shell.req", _req({"script": ["shell_interface"]}))
+    _write(data_dir / "Shell" / "scripts" / "shell_interface.lua", "-- shell\n")
+    _write(data_dir / "Shell" / "effects" / "shell.fx", "Effect()\n")
+    _write(data_dir / "Load" / "load.cfg", "Load()\n")
+    for i in range(max(1, worlds)):
+        _write(data_dir / "Load" / "backdrops" / f"bd{i}" / f"bd{i}_a.tga", size=32768)
+    _write(data_dir / "addme" / "addme.lua", "-- addme\n")
+
+    for name in ["Common"] + [f"S{i:02d}" for i in range(sides)]:
+        _gen_side(data_dir, name, textures)
+    for name in ["Common"] + [f"W{i:02d}" for i in range(worlds)]:
+        _gen_world(data_dir, name, textures)
+
+    return build_dir
+
+
+def stub_env(build_dir: Path, stub_log: Path) -> dict:
+    """
+    Builds the environment for running xmunge against the stub toolchain
+    :param build_dir: The _BUILD directory returned by generate_tree
+    :param stub_log: The file the stubs should record their invocations in
+    :return: A copy of os.environ with the stubs first on the PATH
+    """
+    env = dict(os.environ)
+    stub_dir = build_dir.parent.parent / "stubbin"
+    env["PATH"] = f"{stub_dir}{os.pathsep}{env.get('PATH', '')}"
+    env["XMUNGE_STUB_LOG"] = str(stub_log)
+    # Keep the artifact cache inside the generated tree rather than in the user's cache
+    # directory
+    env["XMUNGE_CACHE_DIR"] = str(build_dir.parent.parent / "xmunge-cache")
+    return env
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate a synthetic BF2_ModTools tree")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--sides", type=int, default=4)
+    parser.add_argument("--worlds", type=int, default=2)
+    parser.add_argument("--textures", type=int, default=8)
+    args = parser.parse_args()
+
+    build = generate_tree(args.root.resolve(), args.sides, args.worlds, args.textures)
+    print(f"Generated {build}", file=sys.stderr)
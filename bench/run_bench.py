@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# run_bench.py
+#
+# Benchmarks xmunge's own orchestration overhead and scaling against the stub toolchain
+# in stubs/fake_tool.py. Each scenario runs the real munge.py/clean.py entry points (or
+# a munger from xm.mungers) in a synthetic tree and reports wall time, the number of
+# tool processes started, and the time during which no tool was running, i.e. the time
+# spent in xmunge itself.
+import json
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter, time
+from typing import Optional
+
+from gen_tree import generate_tree, stub_env
+
+IN_PROCESS_SIDE_MUNGE = """
+import sys
+from xm.mungers import SideMunger
+from xm.utils.logs import setup_logging
+setup_logging(platform="PC")
+SideMunger(sys.argv[1], "PC").run()
+"""
+
+
+class Result:
+    def __init__(
+        self,
+        scenario: str,
+        wall: float,
+        records: list[dict],
+        status: int,
+        stub_startup: float = 0.0,
+    ):
+        self.scenario = scenario
+        self.wall = wall
+        self.status = status
+        tools = [r for r in records if not r["tool"].startswith("wineserver")]
+        self.processes = len(tools)
+        # Each stub records its start once its own interpreter is up, so that startup is
+        # added back on here
+        self.tool_time = _union_length(
+            [(r["start"] - stub_startup, r["end"]) for r in tools]
+        )
+        self.overhead = max(0.0, wall - self.tool_time)
+
+    def as_dict(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "wall": round(self.wall, 3),
+            "processes": self.processes,
+            "tool_time": round(self.tool_time, 3),
+            "overhead": round(self.overhead, 3),
+            "status": self.status,
+        }
+
+
+def _union_length(intervals: list[tuple[float, float]]) -> float:
+    """
+    Computes the total time covered by at least one of the intervals
+    """
+    total = 0.0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def calibrate_stub(build_dir: Path, stub_log: Path, runs: int = 5) -> float:
+    """
+    Measures how long a stub process takes to start before it records its start time
+    :return: The mean startup time in seconds
+    """
+    env = stub_env(build_dir, stub_log)
+    stub_log.write_text("")
+    starts = []
+    for _ in range(runs):
+        start = time()
+        sp.run(["wineserver", "--calibrate"], env=env, cwd=build_dir)
+        starts.append(start)
+    records = [json.loads(line) for line in stub_log.read_text().splitlines() if line]
+    return sum(r["start"] - s for r, s in zip(records, starts)) / runs
+
+
+def _run(
+    scenario: str,
+    command: list[str],
+    build_dir: Path,
+    stub_log: Path,
+    stub_startup: float = 0.0,
+) -> Result:
+    stub_log.write_text("")
+    start = perf_counter()
+    result = sp.run(
+        command,
+        cwd=build_dir,
+        env=stub_env(build_dir, stub_log),
+        stdout=sp.DEVNULL,
+        stderr=sp.DEVNULL,
+    )
+    wall = perf_counter() - start
+    records = [json.loads(line) for line in stub_log.read_text().splitlines() if line]
+    return Result(scenario, wall, records, result.returncode, stub_startup)
+
+
+def run_scenarios(build_dir: Path, jobs: list[int], work_dir: Path) -> list[Result]:
+    stub_log = work_dir / "stub_calls.jsonl"
+    python = sys.executable
+    results = []
+
+    stub_startup = calibrate_stub(build_dir, stub_log)
+
+    def run(scenario: str, command: list[str]) -> Result:
+        return _run(scenario, command, build_dir, stub_log, stub_startup)
+
+    def munge(*args: str) -> list[str]:
+        return [python, "munge.py", *args]
+
+    clean = [python, "clean.py"]
+
+    cache_dir = Path(stub_env(build_dir, stub_log)["XMUNGE_CACHE_DIR"])
+    for job_count in jobs:
+        suffix = f"-j{job_count}"
+        run("reset", clean)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        results.append(run(f"full{suffix}", munge("-j", str(job_count))))
+        results.append(run(f"noop{suffix}", munge("-j", str(job_count))))
+
+    odf = next((build_dir.parent / "Sides" / "S00" / "odf").glob("*.odf"))
+    odf.write_text(odf.read_text() + "; touched\n")
+    results.append(run("one-odf-side", munge("--side", "S00")))
+
+    odf.write_text(odf.read_text() + "; touched again\n")
+    results.append(
+        run("side-munger-in-process", [python, "-c", IN_PROCESS_SIDE_MUNGE, "S00"])
+    )
+
+    results.append(run("clean", clean))
+    results.append(run(f"full-from-cache-j{jobs[-1]}", munge("-j", str(jobs[-1]))))
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = ArgumentParser(description="Benchmark xmunge against a stub toolchain")
+    parser.add_argument("--sides", type=int, default=4)
+    parser.add_argument("--worlds", type=int, default=2)
+    parser.add_argument("--textures", type=int, default=8)
+    parser.add_argument("-j", "--jobs", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--work-dir", type=Path, help="Keep the generated tree here")
+    parser.add_argument(
+        "--json",
+        type=Path,
+        dest="json_file",
+        help="Also write the results to this file",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="xmunge-bench-") as temp_dir:
+        work_dir = (args.work_dir or Path(temp_dir)).resolve()
+        work_dir.mkdir(parents=True, exist_ok=True)
+        build_dir = generate_tree(work_dir, args.sides, args.worlds, args.textures)
+        results = run_scenarios(build_dir, args.jobs, work_dir)
+
+    print(
+        f"{'scenario':<26}{'wall (s)':>10}{'procs':>8}{'tools (s)':>11}"
+        f"{'xmunge (s)':>12}{'status':>8}"
+    )
+    for result in results:
+        print(
+            f"{result.scenario:<26}{result.wall:>10.2f}{result.processes:>8}"
+            f"{result.tool_time:>11.2f}{result.overhead:>12.2f}{result.status:>8}"
+        )
+
+    if args.json_file:
+        with open(args.json_file, "w") as json_file:
+            json.dump([r.as_dict() for r in results], json_file, indent=2)
+
+    return 0 if all(r.status == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
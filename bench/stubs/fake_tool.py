@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# fake_tool.py
+#
+# Stands in for wine, wineserver, LevelPack and the *Munge executables so that xmunge
+# can be benchmarked without the modtools or Wine. Invoked through the wine/wineserver
+# symlinks made by gen_tree.py, e.g. `wine pc_TextureMunge -inputfile '$*.tga'
+# -sourcedir ../Common -outputdir Common/MUNGED/PC -checkdate`.
+#
+# Behaviour is configured through environment variables:
+#   XMUNGE_STUB_LOG       File to append one JSON line per invocation to (tool, start,
+#                         end, files)
+#   XMUNGE_STUB_STARTUP   Seconds to sleep per invocation, standing in for Wine/tool
+#                         startup (default 0.05)
+#   XMUNGE_STUB_PER_FILE  Seconds to sleep per file processed (default 0.002)
+#   XMUNGE_STUB_MEMORY    MiB of memory to hold while running, per tool, e.g.
+#                         "pc_TextureMunge=300,pc_ModelMunge=200"
+#
+# Output directories are created as needed, and -checkdate skips inputs whose outputs
+# are newer than they are.
+import json
+import os
+import sys
+import time
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+# Extension of the munged file produced by each munge executable
+OUTPUT_EXTENSIONS = {
+    "Bin": "bin",
+    "Config": "config",
+    "Font": "font",
+    "Localize": "loc",
+    "Model": "model",
+    "Odf": "class",
+    "PathPlanning": "congraph",
+    "Script": "script",
+    "Shader": "shader",
+    "Terrain": "terrain",
+    "Texture": "texture",
+    "World": "world",
+}
+
+
+def parse_options(args: list[str]) -> dict[str, list[str]]:
+    options = {}
+    current = None
+    for arg in args:
+        if arg.startswith("-") and not arg.lstrip("-").replace(".", "").isdigit():
+            current = arg.lstrip("-").lower()
+            options.setdefault(current, [])
+        elif current is not None:
+            options[current].append(arg)
+    return options
+
+
+def expand(patterns: list[str], source_dir: Path) -> list[Path]:
+    """
+    Expands -inputfile patterns case-insensitively, recursing into subdirectories for
+    patterns starting with $
+    """
+    matched = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        rel_parts = [p.lower() for p in Path(root).relative_to(source_dir).parts]
+        for name in sorted(files):
+            file_parts = rel_parts + [name.lower()]
+            for pattern in patterns:
+                recursive = pattern.startswith("$")
+                parts = pattern.lstrip("$").lower().replace("\\", "/").split("/")
+                if len(file_parts) < len(parts):
+                    continue
+                if not recursive and len(file_parts) != len(parts):
+                    continue
+                tail = file_parts[len(file_parts) - len(parts) :]
+                if all(fnmatchcase(f, p) for f, p in zip(tail, parts)):
+                    matched.append(Path(root) / name)
+                    break
+    return matched
+
+
+def is_current(output: Path, inputs: list[Path]) -> bool:
+    if not output.exists():
+        return False
+    output_mtime = output.stat().st_mtime_ns
+    return all(i.stat().st_mtime_ns <= output_mtime for i in inputs if i.exists())
+
+
+def write_log(name: str, errors: int = 0, warnings: int = 0) -> None:
+    with open(f"{name}.log", "w") as log_file:
+        log_file.write(f"{name}\n{errors} Errors {warnings} Warnings\n")
+
+
+def fake_munge(exe: str, options: dict[str, list[str]]) -> int:
+    category = exe.split("_")[-1][: -len("Munge")]
+    source_dir = Path((options.get("sourcedir") or ["."])[0])
+    output_dir = Path((options.get("outputdir") or ["."])[0])
+    check_date = "checkdate" in options
+    extension = (options.get("ext") or [OUTPUT_EXTENSIONS.get(category, "out")])[0]
+    output_file = (options.get("outputfile") or [None])[0]
+
+    inputs = expand(options.get("inputfile", []), source_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    processed = 0
+    if output_file:
+        output = output_dir / f"{output_file}.{extension}"
+        if inputs and not (check_date and is_current(output, inputs)):
+            output.write_bytes(b"".join(i.read_bytes() for i in inputs))
+            processed = len(inputs)
+    else:
+        for input_file in inputs:
+            output = output_dir / f"{input_file.name.split('.')[0]}.{extension}"
+            if check_date and is_current(output, [input_file]):
+                continue
+            output.write_bytes(input_file.read_bytes())
+            processed += 1
+
+    write_log(exe)
+    return processed
+
+
+def fake_level_pack(options: dict[str, list[str]]) -> int:
+    source_dir = Path((options.get("sourcedir") or ["."])[0])
+    output_dir = options.get("outputdir")
+    check_date = "checkdate" in options
+
+    reqs = expand(options.get("inputfile", []), source_dir)
+    processed = 0
+    for write_file in options.get("writefiles", []):
+        Path(write_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(write_file, "w") as files_list:
+            files_list.write("\n".join(r.stem for r in reqs))
+    if output_dir:
+        Path(output_dir[0]).mkdir(parents=True, exist_ok=True)
+        for req in reqs:
+            lvl = Path(output_dir[0]) / f"{req.stem}.lvl"
+            if check_date and is_current(lvl, [req]):
+                continue
+            lvl.write_bytes(req.read_bytes() * 4)
+            processed += 1
+
+    write_log("LevelPack")
+    return processed
+
+
+def fake_movie_munge(options: dict[str, list[str]]) -> int:
+    output = Path((options.get("output") or ["out.mvs"])[0])
+    if output.parent.exists():
+        output.write_bytes(b"movie")
+    write_log("MovieMunge")
+    return 1
+
+
+def main() -> int:
+    tool = Path(sys.argv[0]).name
+    args = sys.argv[1:]
+    start = time.time()
+
+    if tool == "wine":
+        tool, args = args[0], args[1:]
+
+    processed = 0
+    status = 0
+    if tool.startswith("wineserver"):
+        pass
+    else:
+        memory = dict(
+            (name, int(mib))
+            for name, _, mib in (
+                e.partition("=")
+                for e in os.environ.get("XMUNGE_STUB_MEMORY", "").split(",")
+                if e
+            )
+        )
+        ballast = b"x" * (memory.get(tool, 0) * 1024 * 1024)
+        time.sleep(float(os.environ.get("XMUNGE_STUB_STARTUP", "0.05")))
+        options = parse_options(args)
+        if tool == "LevelPack":
+            processed = fake_level_pack(options)
+        elif tool == "MovieMunge":
+            processed = fake_movie_munge(options)
+        elif tool.endswith("Munge"):
+            processed = fake_munge(tool, options)
+        else:
+            print(f"fake_tool: unknown tool {tool}", file=sys.stderr)
+            status = 1
+        time.sleep(processed * float(os.environ.get("XMUNGE_STUB_PER_FILE", "0.002")))
+        del ballast
+
+    stub_log = os.environ.get("XMUNGE_STUB_LOG")
+    if stub_log:
+        record = {"tool": tool, "start": start, "end": time.time(), "files": processed}
+        with open(stub_log, "a") as log_file:
+            log_file.write(json.dumps(record) + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
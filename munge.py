@@ -3,17 +3,22 @@
 # jedimoose32
 #
 # The main entrypoint for the munge process
+import atexit
 import logging
-from os import remove
+import sys
 from pathlib import Path
-from shutil import copytree, move
 
-from xm.mungers import *
+from xm.build import munge_and_deploy
+from xm.daemon import run_remote
 from xm.utils.args import build_actions_list, parse_args
-from xm.utils.dirs import get_swbf2_path, get_world_id
+from xm.utils.dirs import get_swbf2_path
 from xm.utils.globals import Settings
+from xm.utils.history import timing_history
 from xm.utils.logs import setup_logging
-from xm.utils.tools import mkdir_p
+from xm.utils.progress import progress_line
+from xm.utils.trace import tracer
+from xm.utils.watch import watch
+from xm.utils.wine import wine_session
 
 
 if __name__ == "__main__":
@@ -24,25 +29,25 @@ if __name__ == "__main__":
 
     args = parse_args()
 
-    munge_list = build_actions_list(args)
+    if args.stats:
+        for line in timing_history.report():
+            print(line)
+        sys.exit(0)
 
-    setup_logging(debug=args.debug_mode, platform=args.platform)
+    # Hand the munge to a running `xmunge serve` daemon if there is one
+    if not args.watch and not args.no_daemon:
+        status = run_remote("munge", sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
 
-    # Language stuff
-    if args.language is not None:
-        Settings.platform = args.language.upper()
-        Settings.lang_dir = Settings.platform
-        Settings.lang_version = Settings.platform
+    munge_list = build_actions_list(args)
 
-        if Settings.platform == "ENGLISH":
-            Settings.lang_dir = "ENG"
-            Settings.lang_version = ""
-        elif Settings.platform == "UK":
-            Settings.lang_dir = "UK_"
-            Settings.lang_version = Settings.lang_dir
+    setup_logging(debug=args.debug_mode, platform="_".join(args.platforms))
+    progress_line.attach(logging.getLogger("main"))
 
-    if Settings.lang_version != "ENGLISH":
-        Settings.override_path = Path(f"{Settings.platform}_{Settings.lang_dir}")
+    if args.trace_file:
+        tracer.start(args.trace_file)
+        atexit.register(tracer.save)
 
     ################################################################################
     # Get SWBF2 GameData directory from file if it exists, otherwise prompt for it #
@@ -54,64 +59,21 @@ if __name__ == "__main__":
     # Munge! #
     ##########
 
-    if munge_list["common"]:
-        munger = CommonMunger(Settings.platform)
-        munger.run()
-
-    if munge_list["shell"]:
-        munger = ShellMunger(Settings.platform)
-        munger.run(movies=munge_list["movies"])
-
-    if munge_list["load"]:
-        munger = LoadMunger(Settings.platform)
-        munger.run()
-
-    if munge_list["sides"]:
-        sides_to_munge = munge_list["sides"]
-        # TODO detect whether Common and Sides/Common are already munged and if not, always munge them first
-        if munge_list["sides"] == "EVERYTHING":
-            sides_to_munge = [i.name for i in Path("../Sides").iterdir() if i.is_dir()]
-        for side in sides_to_munge:
-            munger = SideMunger(side, Settings.platform)
-            munger.run()
-
-    if munge_list["worlds"]:
-        worlds_to_munge = munge_list["worlds"]
-        if munge_list["worlds"] == "EVERYTHING":
-            worlds_to_munge = [
-                i.name for i in Path("../Worlds").iterdir() if i.is_dir()
-            ]
-        for world in worlds_to_munge:
-            munger = WorldMunger(world, Settings.platform)
-            munger.run()
-
-    if munge_list["sound"]:
-        munge_sound_streams = True
-        munger = SoundMunger(Settings.platform, munge_sound_streams)
-        munger.run()
-
-    if munge_list["common"] or munge_list["addme"]:
-        munger = AddmeMunger(Settings.platform)
-        munger.run()
-
-    if Settings.platform == "XBOX" and not args.no_xbox_copy:
-        pass
-
-    #########################################
-    # Copy _LVL_platform to SWBF2 directory #
-    #########################################
-
-    copy_source = Settings.output_dir
-    world_id = get_world_id()
-    copy_dest = gamedata_dir / "addon" / world_id / "data" / f"_LVL_{Settings.platform}"
-
-    mkdir_p(copy_dest)
-
-    logger = logging.getLogger("main")
-    logger.info("Copying output files to SWBF2 GameData/addon/%s...", world_id)
-    copytree(copy_source, copy_dest, dirs_exist_ok=True)
-
-    # Move addme.script from ABC/data/_LVL_PC/ up to just ABC/
-    if Path(copy_dest.parent.parent / "addme.script").exists():
-        remove(copy_dest.parent.parent / "addme.script")
-    move(copy_dest / "addme.script", copy_dest.parent.parent)
+    # Keep one wineserver alive for the whole run instead of paying Wine's startup cost
+    # on every tool invocation
+    if not Settings.plan_file:
+        wine_session.start(Settings.wine_prefix)
+
+    def build(actions: dict) -> None:
+        munge_and_deploy(actions, gamedata_dir, args.no_xbox_copy)
+
+    if args.watch:
+        try:
+            build(munge_list)
+        except RuntimeError as err:
+            logging.getLogger("main").error("Munge failed: %s", err)
+        watch(build, Path.cwd().parent)
+    else:
+        build(munge_list)
+
+    wine_session.stop()
@@ -0,0 +1,107 @@
+import os
+import stat
+from pathlib import Path
+
+import pytest
+
+from xm.utils.artifacts import ArtifactCache
+
+TEXTURE_COMMAND = [
+    "pc_TextureMunge",
+    "-inputfile '$*.tga'",
+    "-sourcedir ../Sides/IMP",
+    "-outputdir Sides/IMP/MUNGED/PC",
+    "-checkdate",
+]
+ODF_COMMAND = [
+    "OdfMunge",
+    "-inputfile '$*.odf'",
+    "-sourcedir ../Sides/IMP",
+    "-outputdir Sides/IMP/MUNGED/PC",
+]
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path) -> ArtifactCache:
+    artifact_cache = ArtifactCache()
+    artifact_cache.configure(tmp_path / "cache")
+    return artifact_cache
+
+
+def test_units_per_file(cache, tmp_path):
+    trooper = _write(tmp_path / "IMP" / "trooper.tga", "trooper")
+    option = _write(tmp_path / "IMP" / "trooper.tga.option", "-maps 1")
+    pilot = _write(tmp_path / "IMP" / "pilot.tga", "pilot")
+    units = cache.units(TEXTURE_COMMAND, tmp_path / "IMP", [pilot, trooper, option])
+    assert [files for _, files in units] == [[pilot], [trooper, option]]
+
+    # The same file elsewhere, e.g. in another side, is the same unit
+    copy = _write(tmp_path / "REP" / "pilot.tga", "pilot")
+    command = [*TEXTURE_COMMAND[:2], "-sourcedir ../Sides/REP", *TEXTURE_COMMAND[3:]]
+    assert cache.units(command, tmp_path / "REP", [copy])[0][0] == units[0][0]
+
+    # Flags which change how files are munged are part of the key
+    units_8bit = cache.units([*TEXTURE_COMMAND, "-8bit"], tmp_path / "IMP", [pilot])
+    assert units_8bit[0][0] != units[0][0]
+
+
+def test_units_per_invocation(cache, tmp_path):
+    odfs = [
+        _write(tmp_path / "IMP" / "odf" / "trooper.odf", "ClassParent = soldier"),
+        _write(tmp_path / "IMP" / "odf" / "soldier.odf", "[GameObjectClass]"),
+    ]
+    ((key, files),) = cache.units(ODF_COMMAND, tmp_path / "IMP", odfs)
+    assert files == odfs
+
+    # Changing any input changes the key
+    odfs[1].write_text("[GameObjectClass]\nHealth = 300")
+    assert cache.units(ODF_COMMAND, tmp_path / "IMP", odfs)[0][0] != key
+
+
+def test_store_and_restore(cache, tmp_path):
+    output = _write(tmp_path / "out" / "trooper.texture", "munged")
+    cache.store("ab" * 32, [output])
+    assert cache.contains("ab" * 32)
+    assert cache.lookup("cd" * 32) is None
+
+    entry = cache.lookup("ab" * 32)
+    (restored,) = cache.restore(entry, tmp_path / "restored")
+    assert restored == tmp_path / "restored" / "trooper.texture"
+    assert restored.read_text() == "munged"
+    # Restored as a read-only hard link to the store's copy
+    info = restored.stat()
+    assert info.st_nlink == 2
+    assert not info.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert cache.stats.stored == 1 and cache.stats.restored_bytes == len("munged")
+
+
+def test_store_keeps_the_first_entry(cache, tmp_path):
+    cache.store("ab" * 32, [_write(tmp_path / "a" / "x.texture", "first")])
+    cache.store("ab" * 32, [_write(tmp_path / "b" / "x.texture", "second")])
+    (restored,) = cache.restore(cache.lookup("ab" * 32), tmp_path / "out")
+    assert restored.read_text() == "first"
+    assert cache.stats.stored == 1
+
+
+def test_least_recently_used_entries_are_evicted(cache, tmp_path):
+    cache.configure(tmp_path / "cache", max_size=350)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    for age, key in enumerate(keys):
+        cache.store(key, [_write(tmp_path / key / "x.texture", "x" * 100)])
+        # Stored one after the other, the first one longest ago
+        entry = cache._entry_dir(key)
+        os.utime(entry, (1000 + age * 100, 1000 + age * 100))
+    # Until the first one is used again
+    cache.lookup(keys[0])
+
+    cache.store("ff" * 32, [_write(tmp_path / "last" / "x.texture", "x" * 100)])
+    # Past the limit, entries are evicted oldest first until 90% of it is left
+    assert [cache.contains(k) for k in keys] == [True, False, True]
+    assert cache.contains("ff" * 32)
+    assert cache.stats.evicted == 1
@@ -0,0 +1,85 @@
+from xm.utils import tools
+from xm.utils.tools import MungeBatch, _attribute_log, munge_batch
+
+MERGED_LOG = """Munging imp_inf_trooper.msh
+ERROR[PC_modelmunge msh\\imp_inf_trooper.msh]:Could not read geometry.
+WARNING[PC_texturemunge imp_icon.tga]:Texture is not a power of two.
+ERROR: out of memory
+WARNING[PC_modelmunge imp_inf_pilot.msh]:No collision.
+   2 Errors    2 Warnings
+"""
+
+
+def test_batch_groups():
+    batch = MungeBatch()
+    batch.add("Odf", "$*.odf", "../Sides/IMP", "Sides/IMP/MUNGED/PC", debug=False)
+    batch.add("Model", ["$*.msh"], "../Sides/IMP", "Sides/IMP/MUNGED/PC")
+    batch.add("Odf", "$*.odf", "../Sides/IMP", "Sides/IMP/MUNGED/PC", debug=False)
+    batch.add("Odf", "$odf/*.odf", "../Sides/IMP", "Sides/IMP/MUNGED/PC", debug=False)
+    # Calls with other flags, or for another directory, cannot be merged
+    batch.add("Odf", "$*.odf", "../Sides/IMP", "Sides/IMP/MUNGED/PC", debug=True)
+    batch.add("Odf", "$*.odf", "../Sides/REP", "Sides/REP/MUNGED/PC", debug=False)
+
+    groups = list(batch.groups.values())
+    assert [(g["category"], g["patterns"]) for g in groups] == [
+        ("Odf", ["$*.odf", "$odf/*.odf"]),
+        ("Model", ["$*.msh"]),
+        ("Odf", ["$*.odf"]),
+        ("Odf", ["$*.odf"]),
+    ]
+    assert groups[2]["flags"] == {"debug": True}
+
+
+def test_munge_batch(monkeypatch):
+    calls = []
+
+    def fake_munge(category, input_files, source_dir, output_dir, **flags):
+        calls.append((category, input_files, source_dir))
+
+    with munge_batch() as batch:
+        # Queued rather than run
+        assert tools.munge("Odf", "$*.odf", "../Sides/IMP", "out") is None
+        assert tools.munge("Model", "$*.msh", "../Sides/IMP", "out") is None
+        assert tools.munge("Odf", "$odf/*.odf", "../Sides/IMP", "out") is None
+        # A nested batch hands its calls on to the enclosing one
+        with munge_batch():
+            tools.munge("Config", "$*.fx", "../Sides/IMP", "out")
+        assert len(batch.groups) == 3
+        monkeypatch.setattr(tools, "munge", fake_munge)
+
+    assert calls == [
+        ("Odf", ["$*.odf", "$odf/*.odf"], "../Sides/IMP"),
+        ("Model", ["$*.msh"], "../Sides/IMP"),
+        ("Config", ["$*.fx"], "../Sides/IMP"),
+    ]
+    assert not batch.groups
+    assert getattr(tools._batches, "current", None) is None
+
+
+def test_attribute_log():
+    assert _attribute_log(MERGED_LOG, ["$*.msh", "$*.tga"]) == [
+        (
+            "$*.msh",
+            [
+                "ERROR[PC_modelmunge msh\\imp_inf_trooper.msh]:Could not read geometry.",
+                "WARNING[PC_modelmunge imp_inf_pilot.msh]:No collision.",
+            ],
+        ),
+        (
+            "$*.tga",
+            ["WARNING[PC_texturemunge imp_icon.tga]:Texture is not a power of two."],
+        ),
+        ("unattributed", ["ERROR: out of memory"]),
+    ]
+
+
+def test_attribute_log_by_directory():
+    attributed = dict(_attribute_log(MERGED_LOG, ["$msh/*.msh", "$*.tga"]))
+    assert attributed["$msh/*.msh"] == [
+        "ERROR[PC_modelmunge msh\\imp_inf_trooper.msh]:Could not read geometry."
+    ]
+    # A file outside of the directory belongs to none of the patterns
+    assert attributed["unattributed"] == [
+        "ERROR: out of memory",
+        "WARNING[PC_modelmunge imp_inf_pilot.msh]:No collision.",
+    ]
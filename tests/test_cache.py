@@ -0,0 +1,151 @@
+import os
+from pathlib import Path
+
+from xm.utils.cache import Manifest
+
+COMMAND = "pc_ModelMunge -inputfile $*.msh -sourcedir Sides/IMP -checkdate"
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def _recorded(tmp_path: Path) -> tuple[Manifest, Path, Path]:
+    munge_dir = tmp_path / "MUNGED"
+    munge_dir.mkdir()
+    source = _write(tmp_path / "src" / "imp_inf_trooper.msh", "mesh")
+    output = _write(munge_dir / "imp_inf_trooper.model", "model")
+    manifest = Manifest(munge_dir)
+    manifest.record(COMMAND, [source], [output])
+    return manifest, source, output
+
+
+def test_unknown_command_is_not_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    assert not manifest.is_current(COMMAND + " -debug", [source])
+
+
+def test_unchanged_invocation_is_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    assert manifest.is_current(COMMAND, [source])
+
+
+def test_manifest_is_saved(tmp_path):
+    _, source, _ = _recorded(tmp_path)
+    assert Manifest(tmp_path / "MUNGED").is_current(COMMAND, [source])
+
+
+def test_changed_input_is_not_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    source.write_text("another mesh")
+    assert not manifest.is_current(COMMAND, [source])
+
+
+def test_touched_input_is_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.is_current(COMMAND, [source])
+    assert (
+        manifest.entries[COMMAND]["inputs"][str(source)][1]
+        == stat.st_mtime_ns + 10**9
+    )
+
+
+def test_added_input_is_not_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    added = _write(source.with_name("imp_inf_pilot.msh"), "mesh")
+    assert not manifest.is_current(COMMAND, [source, added])
+
+
+def test_removed_input_is_not_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    source.unlink()
+    assert not manifest.is_current(COMMAND, [])
+    assert not manifest.is_current(COMMAND, [source])
+
+
+def test_missing_output_is_not_current(tmp_path):
+    manifest, source, output = _recorded(tmp_path)
+    output.unlink()
+    assert not manifest.is_current(COMMAND, [source])
+
+
+def test_changed_output_is_not_current(tmp_path):
+    manifest, source, output = _recorded(tmp_path)
+    output.write_text("edited by hand")
+    assert not manifest.is_current(COMMAND, [source])
+
+
+def test_invocation_without_outputs_is_not_current(tmp_path):
+    munge_dir = tmp_path / "MUNGED"
+    munge_dir.mkdir()
+    source = _write(tmp_path / "src" / "imp_inf_trooper.msh", "mesh")
+    manifest = Manifest(munge_dir)
+    manifest.record(COMMAND, [source], [])
+    assert not manifest.is_current(COMMAND, [source])
+
+
+def test_forgotten_invocation_is_not_current(tmp_path):
+    manifest, source, _ = _recorded(tmp_path)
+    manifest.forget(COMMAND)
+    assert not manifest.is_current(COMMAND, [source])
+
+
+SOUND_COMMAND = "ConfigMunge -inputfile *.snd -sourcedir Sides/IMP/Sound -checkdate"
+COMBO_COMMAND = "ConfigMunge -inputfile $*.combo -sourcedir Sides/IMP -checkdate"
+
+
+def _shared_output(tmp_path: Path) -> tuple[Manifest, Path, Path, Path]:
+    """
+    Records two invocations which both write imp.config, the sound one last
+    """
+    munge_dir = tmp_path / "MUNGED"
+    munge_dir.mkdir()
+    combo = _write(tmp_path / "src" / "imp.combo", "combo")
+    sound = _write(tmp_path / "src" / "Sound" / "imp.snd", "sound")
+    output = _write(munge_dir / "imp.config", "munged combo")
+    manifest = Manifest(munge_dir)
+    manifest.record(COMBO_COMMAND, [combo], [output])
+    output.write_text("munged sound")
+    manifest.record(SOUND_COMMAND, [sound], [output])
+    return manifest, combo, sound, output
+
+
+def test_output_written_over_by_another_invocation(tmp_path):
+    manifest, combo, sound, _ = _shared_output(tmp_path)
+    assert manifest.is_current(COMBO_COMMAND, [combo])
+    assert manifest.is_current(SOUND_COMMAND, [sound])
+    assert manifest.written_by_others(COMBO_COMMAND) == {
+        str(tmp_path / "MUNGED" / "imp.config")
+    }
+
+    # The owners are saved in the order the invocations were recorded
+    manifest = Manifest(tmp_path / "MUNGED")
+    assert manifest.is_current(COMBO_COMMAND, [combo])
+    assert manifest.is_current(SOUND_COMMAND, [sound])
+
+
+def test_shared_output_changed_by_hand(tmp_path):
+    manifest, combo, sound, output = _shared_output(tmp_path)
+    output.write_text("edited by hand")
+    assert manifest.is_current(COMBO_COMMAND, [combo])
+    assert not manifest.is_current(SOUND_COMMAND, [sound])
+
+
+def test_output_not_written_stays_with_its_writer(tmp_path):
+    manifest, combo, sound, output = _shared_output(tmp_path)
+    # The combo munge runs again but skips imp.config because of -checkdate
+    manifest.record(COMBO_COMMAND, [combo], [output], written=[])
+    assert manifest.written_by_others(SOUND_COMMAND) == set()
+    output.write_text("edited by hand")
+    assert manifest.is_current(COMBO_COMMAND, [combo])
+
+
+def test_forgotten_owner_hands_outputs_back(tmp_path):
+    manifest, combo, sound, output = _shared_output(tmp_path)
+    manifest.forget(SOUND_COMMAND)
+    output.write_text("edited by hand")
+    assert not manifest.is_current(COMBO_COMMAND, [combo])
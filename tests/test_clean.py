@@ -0,0 +1,140 @@
+from pathlib import Path
+
+import pytest
+
+from xm.build import _stale_manifests, clean_stale
+from xm.utils.cache import MANIFEST_NAME, Manifest
+
+MODEL_COMMAND = "pc_ModelMunge -inputfile $*.msh -sourcedir ../Sides/IMP"
+PACK_COMMAND = "LevelPack -inputfile imp.req -sourcedir ../Sides/IMP"
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def _clean_list(everything: bool = False, sides=None) -> dict:
+    return {
+        "all": everything,
+        "common": everything,
+        "shell": everything,
+        "load": everything,
+        "sound": everything,
+        "sides": "EVERYTHING" if everything else sides,
+        "worlds": "EVERYTHING" if everything else None,
+    }
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch) -> Path:
+    data_dir = tmp_path / "data_ABC"
+    (data_dir / "_BUILD").mkdir(parents=True)
+    (data_dir / "Worlds").mkdir()
+    monkeypatch.chdir(data_dir / "_BUILD")
+    return data_dir
+
+
+@pytest.fixture
+def munged(data_dir) -> dict[str, Path]:
+    """
+    Records a model munge of two meshes of a side, and the pack of its outputs
+    """
+    munge_dir = data_dir / "_BUILD" / "Sides" / "IMP" / "MUNGED" / "PC"
+    files = {
+        name: _write(data_dir / "Sides" / "IMP" / "msh" / f"{name}.msh", name)
+        for name in ["trooper", "pilot"]
+    }
+    for name in ["trooper", "pilot"]:
+        files[f"{name}.model"] = _write(munge_dir / f"{name}.model", name)
+    files["lvl"] = _write(data_dir / "_LVL_PC" / "SIDE" / "imp.lvl", "lvl")
+    manifest = Manifest(munge_dir)
+    models = [files["trooper.model"], files["pilot.model"]]
+    manifest.record(MODEL_COMMAND, [files["trooper"], files["pilot"]], models)
+    manifest.record(PACK_COMMAND, models, [files["lvl"]])
+    files["munge_dir"] = munge_dir
+    return files
+
+
+def test_stale_outputs(munged):
+    manifest = Manifest(munged["munge_dir"])
+    assert manifest.stale_outputs() == {}
+
+    munged["pilot"].unlink()
+    # The pack only reads outputs of the model munge, so its outputs are not stale
+    assert manifest.stale_outputs() == {MODEL_COMMAND: [str(munged["pilot.model"])]}
+
+    # Once no source is left, every output is stale, whatever its name
+    munged["trooper"].unlink()
+    assert sorted(manifest.stale_outputs()[MODEL_COMMAND]) == sorted(
+        [str(munged["trooper.model"]), str(munged["pilot.model"])]
+    )
+
+
+def test_clean_stale(munged):
+    munged["pilot"].unlink()
+    clean_stale(_clean_list(sides=["IMP"]))
+
+    assert not munged["pilot.model"].exists()
+    assert munged["trooper.model"].exists()
+    assert munged["lvl"].exists()
+    # The model munge runs again next time
+    manifest = Manifest(munged["munge_dir"])
+    assert MODEL_COMMAND not in manifest.entries
+    assert PACK_COMMAND in manifest.entries
+
+
+def test_clean_stale_dry_run(munged):
+    munged["pilot"].unlink()
+    clean_stale(_clean_list(sides=["IMP"]), dry_run=True)
+
+    assert munged["pilot.model"].exists()
+    assert MODEL_COMMAND in Manifest(munged["munge_dir"]).entries
+
+
+def test_output_of_another_invocation_is_kept(munged):
+    manifest = Manifest(munged["munge_dir"])
+    remade = _write(munged["pilot"].with_name("pilot_lod.msh"), "pilot")
+    other = MODEL_COMMAND.replace("$*.msh", "pilot_lod.msh")
+    manifest.record(other, [remade], [munged["pilot.model"]])
+    munged["pilot"].unlink()
+
+    clean_stale(_clean_list(sides=["IMP"]))
+    assert munged["pilot.model"].exists()
+    assert Manifest(munged["munge_dir"]).recorded_outputs(other) == [
+        str(munged["pilot.model"])
+    ]
+
+
+def test_stale_manifests(data_dir):
+    for directory in [
+        "_BUILD/Sides/IMP/MUNGED/PC",
+        "_BUILD/Sides/REP/MUNGED/PC",
+        # Sprites are munged next to _BUILD, language overrides get directories of
+        # their own
+        "Sides/IMP/MUNGED/PC_english",
+        "_BUILD/Sides/IMP/MUNGED/PS2",
+        "_BUILD/Common/MUNGED/PC",
+        "_LVL_PC",
+    ]:
+        _write(data_dir / directory / MANIFEST_NAME, "{}")
+    (data_dir / "Sides" / "REP").mkdir()
+
+    def found(clean_list: dict) -> list[str]:
+        return sorted(
+            m.path.parent.relative_to(data_dir).as_posix()
+            for m in _stale_manifests(clean_list)
+        )
+
+    assert found(_clean_list(sides=["IMP"])) == [
+        "Sides/IMP/MUNGED/PC_english",
+        "_BUILD/Sides/IMP/MUNGED/PC",
+    ]
+    assert found(_clean_list(everything=True)) == [
+        "Sides/IMP/MUNGED/PC_english",
+        "_BUILD/Common/MUNGED/PC",
+        "_BUILD/Sides/IMP/MUNGED/PC",
+        "_BUILD/Sides/REP/MUNGED/PC",
+        "_LVL_PC",
+    ]
@@ -0,0 +1,291 @@
+import json
+import logging
+import threading
+from time import sleep
+
+import pytest
+
+from xm import daemon
+from xm.daemon import (
+    BuildServer,
+    client_connect,
+    covers,
+    merge_actions,
+    normalize_request,
+    run_remote,
+)
+from xm.utils.globals import Settings
+from xm.utils.logs import TOOL_LOGGER
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    A daemon listening on a socket in tmp_path, with munging and cleaning replaced by
+    fakes which record their actions
+    """
+    path = tmp_path / "xmunge.sock"
+    monkeypatch.setattr(daemon, "socket_path", lambda build_dir=None: path)
+    runs = []
+    prefixes = []
+
+    def fake_munge(actions, gamedata_dir, no_xbox_copy, progress):
+        runs.append(("munge", actions))
+        prefixes.append(Settings.wine_prefix)
+        logging.getLogger(TOOL_LOGGER).info("pc_ConfigMunge: 3 files munged")
+        if actions["common"] and actions["load"] and not actions["all"]:
+            raise RuntimeError("LevelPack failed")
+        progress("Common", True, 1, 1)
+
+    def fake_clean(actions, stale, dry_run):
+        runs.append(("clean", actions))
+
+    monkeypatch.setattr(daemon, "munge_and_deploy", fake_munge)
+    monkeypatch.setattr(daemon, "clean", fake_clean)
+
+    build_server = BuildServer(tmp_path, path, str(tmp_path / "prefix"))
+    build_server.runs = runs
+    build_server.prefixes = prefixes
+    thread = threading.Thread(target=build_server.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        conn = client_connect(path)
+        if conn is not None:
+            conn.close()
+            break
+        sleep(0.05)
+    yield build_server
+    if thread.is_alive():
+        run_remote("stop", [])
+        thread.join(5)
+
+
+class _Blocker:
+    """
+    Makes cleans wait until released, so that requests queue up behind a running one
+    """
+
+    def __init__(self, server: BuildServer, monkeypatch):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.threads = []
+        self.server = server
+        monkeypatch.setattr(daemon, "clean", self._clean)
+
+    def _clean(self, actions, stale, dry_run):
+        self.server.runs.append(("clean", actions))
+        self.started.set()
+        self.released.wait(5)
+
+    def start(self, argv: list[str]) -> None:
+        """
+        Starts a clean and waits for it to be running
+        """
+        self.started.clear()
+        thread = threading.Thread(target=_request, args=("clean", argv))
+        thread.start()
+        self.threads.append(thread)
+        assert self.started.wait(5)
+
+    def release(self) -> None:
+        self.released.set()
+        for thread in self.threads:
+            thread.join(5)
+
+
+@pytest.fixture
+def blocker(server, monkeypatch):
+    blocker = _Blocker(server, monkeypatch)
+    yield blocker
+    blocker.release()
+
+
+def _request(command: str, argv: list[str]) -> list[dict]:
+    conn = client_connect()
+    with conn:
+        conn.sendall((json.dumps({"command": command, "argv": argv}) + "\n").encode())
+        return [json.loads(line) for line in conn.makefile("r")]
+
+
+def _queue(requests: list[list[str]]) -> tuple[list[dict], list]:
+    """
+    Sends clean requests one after the other
+    :return: The "queued" reply to each request, and the connections to read the rest
+    of the replies from
+    """
+    queued, replies = [], []
+    for argv in requests:
+        conn = client_connect()
+        conn.sendall((json.dumps({"command": "clean", "argv": argv}) + "\n").encode())
+        replies.append((conn, conn.makefile("r")))
+        queued.append(json.loads(replies[-1][1].readline()))
+    return queued, replies
+
+
+def _results(replies: list) -> list[dict]:
+    results = []
+    for conn, reply in replies:
+        results.append(json.loads(list(reply)[-1]))
+        conn.close()
+    return results
+
+
+def test_munge(server):
+    messages = _request("munge", ["--common", "--no-cache"])
+    assert messages[0] == {"type": "queued", "position": 0, "shared": False}
+    assert {
+        "type": "progress",
+        "task": "Common",
+        "succeeded": True,
+        "finished": 1,
+        "total": 1,
+    } in messages
+    assert messages[-1] == {"type": "done", "status": 0, "error": None}
+    ((command, actions),) = server.runs
+    assert command == "munge" and actions["common"] and not actions["load"]
+
+
+def test_tool_output_is_streamed(server):
+    messages = _request("munge", ["--common", "--no-cache"])
+    assert any(
+        m["type"] == "log" and "pc_ConfigMunge: 3 files munged" in m["message"]
+        for m in messages
+    )
+
+
+def test_clean(server):
+    assert run_remote("clean", ["--side", "IMP"]) == 0
+    ((command, actions),) = server.runs
+    assert command == "clean" and actions["sides"] == ["IMP"]
+
+
+def test_failed_munge(server):
+    messages = _request("munge", ["--common", "--load", "--no-cache"])
+    assert messages[-1] == {"type": "done", "status": 1, "error": "LevelPack failed"}
+    assert any(
+        m["type"] == "log" and "Munge failed: LevelPack failed" in m["message"]
+        for m in messages
+    )
+
+
+def test_invalid_arguments(server):
+    messages = _request("munge", ["--platform", "N64", "--no-cache"])
+    assert messages[-1] == {
+        "type": "done",
+        "status": 2,
+        "error": "Invalid platform N64",
+    }
+    assert _request("munge", ["--no-such-option"])[-1]["status"] == 2
+    # The daemon keeps serving after a bad request
+    assert run_remote("munge", ["--common", "--no-cache"]) == 0
+
+
+def test_wine_prefix(server, tmp_path):
+    prefix = str(tmp_path / "prefix")
+    assert run_remote("munge", ["--common", "--no-cache"]) == 0
+    assert run_remote("munge", ["--common", "--no-cache", "--wine-prefix", prefix]) == 0
+    assert server.prefixes == [prefix, prefix]
+
+    messages = _request("munge", ["--common", "--wine-prefix", str(tmp_path / "other")])
+    assert messages[-1]["status"] == 2
+    assert "Wine prefix" in messages[-1]["error"]
+    assert len(server.runs) == 2
+
+
+def test_unknown_command(server):
+    assert _request("deploy", []) == [
+        {"type": "done", "status": 2, "error": "Unknown command deploy"}
+    ]
+    assert server.runs == []
+
+
+def test_queued_requests_are_shared(server, blocker):
+    blocker.start(["--load"])
+    queued, replies = _queue(
+        [["--side", "IMP", "--common"], ["--common", "--side", "imp"], ["--common"]]
+    )
+    blocker.release()
+
+    assert queued == [
+        {"type": "queued", "position": 1, "shared": False},
+        {"type": "queued", "position": 1, "shared": True},
+        {"type": "queued", "position": 1, "shared": True},
+    ]
+    assert _results(replies) == [{"type": "done", "status": 0, "error": None}] * 3
+    assert len(server.runs) == 2
+
+
+def test_queued_requests_are_merged(server, blocker):
+    blocker.start(["--load"])
+    queued, replies = _queue([["--side", "IMP"], ["--side", "REP", "imp"], ["--shell"]])
+    blocker.release()
+
+    assert [q["shared"] for q in queued] == [False, True, True]
+    assert _results(replies) == [{"type": "done", "status": 0, "error": None}] * 3
+    (_, first), (_, merged) = server.runs
+    assert first["load"] and not first["shell"]
+    assert merged["sides"] == ["IMP", "REP"] and merged["shell"]
+    assert not merged["load"] and not merged["all"]
+
+
+def test_covered_request_joins_running_job(server, blocker):
+    blocker.start(["--side", "IMP", "REP", "--load"])
+    queued, replies = _queue([["--side", "rep"], ["--side", "CIS"]])
+    blocker.release()
+
+    assert queued == [
+        {"type": "queued", "position": 0, "shared": True},
+        {"type": "queued", "position": 1, "shared": False},
+    ]
+    assert _results(replies) == [{"type": "done", "status": 0, "error": None}] * 2
+    assert [actions["sides"] for _, actions in server.runs] == [["IMP", "REP"], ["CIS"]]
+
+
+def test_requests_with_other_options_are_not_merged(server, blocker):
+    blocker.start(["--load"])
+    queued, replies = _queue([["--side", "IMP"], ["--side", "IMP", "--dry-run"]])
+    blocker.release()
+
+    assert [q["shared"] for q in queued] == [False, False]
+    assert _results(replies) == [{"type": "done", "status": 0, "error": None}] * 2
+    assert len(server.runs) == 3
+
+
+def test_normalize_request():
+    key, actions = normalize_request("munge", ["--side", "IMP", "-j", "4"])
+    assert normalize_request("munge", ["-j", "4", "--side", "IMP"]) == (key, actions)
+    assert normalize_request("munge", ["--side", "IMP"])[0] != key
+    assert normalize_request("clean", ["--side", "IMP", "-j", "4"])[0] != key
+    assert actions["sides"] == ["IMP"] and not actions["all"]
+    assert normalize_request("munge", ["--bogus"]) == (("munge", ("--bogus",)), None)
+
+
+def test_covers_and_merge_actions():
+    everything = normalize_request("munge", [])[1]
+    imp_rep = normalize_request("munge", ["--side", "IMP", "REP", "--common"])[1]
+    rep = normalize_request("munge", ["--side", "rep"])[1]
+    world = normalize_request("munge", ["--world", "ABC"])[1]
+
+    assert covers(everything, imp_rep) and covers(imp_rep, rep)
+    assert not covers(rep, imp_rep) and not covers(imp_rep, everything)
+    assert not covers(imp_rep, world)
+
+    merged = merge_actions(rep, world)
+    assert merged["sides"] == ["rep"] and merged["worlds"] == ["ABC"]
+    assert covers(merged, rep) and covers(merged, world)
+    assert not merged["common"] and not merged["all"]
+    assert merge_actions(world, everything)["worlds"] == "EVERYTHING"
+
+
+def test_stop(server, tmp_path):
+    assert run_remote("stop", []) == 0
+    for _ in range(100):
+        if not (tmp_path / "xmunge.sock").exists():
+            break
+        sleep(0.05)
+    assert client_connect() is None
+
+
+def test_no_daemon(tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon, "socket_path", lambda build_dir=None: tmp_path / "s")
+    assert run_remote("munge", []) is None
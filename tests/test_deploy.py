@@ -0,0 +1,144 @@
+import errno
+import os
+from pathlib import Path
+
+import pytest
+
+from xm.utils import deploy
+from xm.utils.deploy import DEPLOY_MANIFEST_NAME, Deployment
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+@pytest.fixture
+def lvl_dir(tmp_path) -> Path:
+    lvl_dir = tmp_path / "_LVL_PC"
+    _write(lvl_dir / "core.lvl", "core")
+    _write(lvl_dir / "SIDE" / "imp.lvl", "imp")
+    _write(lvl_dir / "SIDE" / "rep.lvl", "rep")
+    return lvl_dir
+
+
+def _deploy(dest_dir: Path, lvl_dir: Path, mode: str = "copy") -> Deployment:
+    deployment = Deployment(dest_dir, mode)
+    deployment.deploy_tree(lvl_dir)
+    return deployment
+
+
+def _counts(deployment: Deployment) -> tuple[int, int, int, int]:
+    stats = deployment.stats
+    return stats.copied, stats.linked, stats.unchanged, stats.removed
+
+
+def test_deploy_and_rerun(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "addon" / "ABC" / "data" / "_LVL_PC"
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (3, 0, 0, 0)
+    assert (dest_dir / "SIDE" / "imp.lvl").read_text() == "imp"
+
+    # The manifest is read back, so nothing is copied again
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (0, 0, 3, 0)
+
+    _write(lvl_dir / "SIDE" / "imp.lvl", "imp, changed")
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (1, 0, 2, 0)
+    assert (dest_dir / "SIDE" / "imp.lvl").read_text() == "imp, changed"
+
+
+def test_rewritten_with_same_contents(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    _deploy(dest_dir, lvl_dir)
+    core = lvl_dir / "core.lvl"
+    stat = core.stat()
+    os.utime(core, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (0, 0, 3, 0)
+
+
+def test_touched_deployed_file_is_replaced(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    _deploy(dest_dir, lvl_dir)
+    _write(dest_dir / "core.lvl", "edited in GameData")
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (1, 0, 2, 0)
+    assert (dest_dir / "core.lvl").read_text() == "core"
+
+
+def test_stale_files_are_removed(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    _deploy(dest_dir, lvl_dir)
+    _write(dest_dir / "SIDE" / "mine.txt", "not deployed by xmunge")
+    for name in ["imp.lvl", "rep.lvl"]:
+        (lvl_dir / "SIDE" / name).unlink()
+    _write(lvl_dir / "FPM" / "COM" / "fpm.lvl", "fpm")
+
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (1, 0, 1, 2)
+    assert not (dest_dir / "SIDE" / "imp.lvl").exists()
+    assert (dest_dir / "SIDE" / "mine.txt").exists()
+    # Directories left empty are removed
+    (dest_dir / "SIDE" / "mine.txt").unlink()
+    (lvl_dir / "FPM" / "COM" / "fpm.lvl").unlink()
+    _deploy(dest_dir, lvl_dir)
+    assert not (dest_dir / "FPM").exists()
+    assert dest_dir.is_dir()
+
+
+def test_hardlink(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    deployment = _deploy(dest_dir, lvl_dir, "hardlink")
+    assert _counts(deployment) == (0, 3, 0, 0)
+    assert (dest_dir / "core.lvl").samefile(lvl_dir / "core.lvl")
+
+
+def test_hardlink_across_filesystems_copies(tmp_path, lvl_dir, monkeypatch):
+    dest_dir = tmp_path / "dest"
+    dest_dir.mkdir()
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        result = real_stat(path, *args, **kwargs)
+        if Path(path) == dest_dir:
+            fields = list(result[:10])
+            fields[2] += 1
+            return os.stat_result(fields)
+        return result
+
+    monkeypatch.setattr(os, "stat", stat)
+    deployment = _deploy(dest_dir, lvl_dir, "hardlink")
+    monkeypatch.undo()
+
+    assert _counts(deployment) == (3, 0, 0, 0)
+    assert not (dest_dir / "core.lvl").samefile(lvl_dir / "core.lvl")
+
+
+def test_reflink_falls_back_to_copying(tmp_path, lvl_dir, monkeypatch):
+    def reflink(source, dest):
+        raise OSError(errno.EOPNOTSUPP, "not supported")
+
+    monkeypatch.setattr(deploy, "_reflink", reflink)
+    dest_dir = tmp_path / "dest"
+    deployment = _deploy(dest_dir, lvl_dir, "reflink")
+    assert _counts(deployment) == (3, 0, 0, 0)
+    assert (dest_dir / "core.lvl").read_text() == "core"
+    assert not list(dest_dir.glob(".*.tmp"))
+
+
+def test_symlink_then_copy(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    _deploy(dest_dir, lvl_dir, "symlink")
+    assert (dest_dir / "core.lvl").is_symlink()
+
+    # Files deployed in another mode are deployed again
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (3, 0, 0, 0)
+    assert not (dest_dir / "core.lvl").is_symlink()
+
+
+def test_unreadable_manifest_is_ignored(tmp_path, lvl_dir):
+    dest_dir = tmp_path / "dest"
+    _write(dest_dir / DEPLOY_MANIFEST_NAME, "{")
+    assert _counts(_deploy(dest_dir, lvl_dir)) == (3, 0, 0, 0)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Deployment("dest", "teleport")
@@ -0,0 +1,82 @@
+import pytest
+
+from xm.utils import history
+from xm.utils.history import HISTORY_FILE, TASK_CATEGORY, TimingHistory
+from xm.utils.scheduler import Scheduler
+
+
+@pytest.fixture
+def timings(tmp_path) -> TimingHistory:
+    return TimingHistory(tmp_path / HISTORY_FILE)
+
+
+def test_predict(timings):
+    assert timings.predict("Sides/IMP", "OdfMunge", "$*.odf", 10) is None
+    for duration in [2.0, 3.0, 100.0]:
+        timings.record("Sides/IMP", "OdfMunge", "$*.odf", duration, files=10)
+    # The median of its own runs, per input file
+    assert timings.predict("Sides/IMP", "OdfMunge", "$*.odf", 20) == pytest.approx(6)
+    # Otherwise the average per input file of the tool
+    assert timings.predict("Sides/REP", "OdfMunge", "$*.odf", 3) == pytest.approx(10.5)
+    assert timings.predict("Sides/IMP", "ConfigMunge", "$*.fx", 3) is None
+
+
+def test_predict_rss(timings):
+    assert timings.predict_rss("Sides/IMP", "LevelPack", "imp.req") is None
+    timings.record("Sides/IMP", "LevelPack", "imp.req", 1.0, peak_rss_kb=300)
+    timings.record("Sides/IMP", "LevelPack", "imp.req", 1.0, peak_rss_kb=200)
+    timings.record("Sides/REP", "LevelPack", "rep.req", 1.0, peak_rss_kb=500)
+    # Ran remotely, so its peak is unknown
+    timings.record("Sides/REP", "LevelPack", "rep.req", 1.0)
+    # The largest peak of its own runs, not scaled by the number of files
+    assert timings.predict_rss("Sides/IMP", "LevelPack", "imp.req") == 300
+    # Otherwise the largest peak of the tool
+    assert timings.predict_rss("Sides/ALL", "LevelPack", "all.req") == 500
+    assert timings.predict_rss("Sides/IMP", "OdfMunge", "$*.odf") is None
+
+
+def test_records_are_kept(tmp_path, timings):
+    timings.begin_build()
+    timings.record("Sides/IMP", "OdfMunge", "$*.odf", 4.0, files=2, peak_rss_kb=100)
+    timings.record("Sides/IMP", TASK_CATEGORY, "Sides/IMP:munge", 5.0)
+
+    reloaded = TimingHistory(tmp_path / HISTORY_FILE)
+    assert reloaded.predict("Sides/IMP", "OdfMunge", "$*.odf", 1) == 2.0
+    assert reloaded.predict_rss("Sides/IMP", "OdfMunge", "$*.odf") == 100
+    assert reloaded.task_duration("Sides/IMP:munge") == 5.0
+    assert reloaded.task_duration("Sides/IMP:pack") is None
+
+
+def test_old_builds_are_dropped(tmp_path, timings, monkeypatch):
+    monkeypatch.setattr(history, "MAX_BUILDS", 3)
+    for build in range(4):
+        timings.build = build + 1
+        timings.record("Sides/IMP", "OdfMunge", "$*.odf", build + 1)
+    timings.begin_build()
+
+    # The two latest munges are kept, along with the one which just started
+    reloaded = TimingHistory(tmp_path / HISTORY_FILE)
+    assert [r["build"] for r in reloaded._load()] == [3, 4]
+    assert reloaded.predict("Sides/IMP", "OdfMunge", "$*.odf", 1) == 3.5
+
+
+def test_critical_paths(timings):
+    for task, duration in [("Common", 10.0), ("Sides/IMP:munge", 4.0)]:
+        timings.record(task, TASK_CATEGORY, task, duration)
+    timings.record("Sides/IMP", TASK_CATEGORY, "Sides/IMP:pack", 2.0)
+
+    scheduler = Scheduler(history=timings)
+    scheduler.add("Common", lambda: None)
+    scheduler.add("Sides/IMP:munge", lambda: None)
+    scheduler.add("Sides/IMP:pack", lambda: None, ["Common", "Sides/IMP:munge"])
+    # Without a recorded duration, the median of the recorded tasks is assumed
+    scheduler.add("Sides/REP:munge", lambda: None)
+    scheduler.add("Sides/REP:pack", lambda: None, ["Common", "Sides/REP:munge"])
+
+    assert scheduler.critical_paths() == {
+        "Common": 14.0,
+        "Sides/IMP:munge": 6.0,
+        "Sides/IMP:pack": 2.0,
+        "Sides/REP:munge": 8.0,
+        "Sides/REP:pack": 4.0,
+    }
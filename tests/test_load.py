@@ -0,0 +1,62 @@
+import os
+from pathlib import Path
+
+from xm.mungers import load
+from xm.mungers.load import LoadMunger, _write_reqs
+
+
+def _req_files(req_dir):
+    return {p.name: p.read_text() for p in req_dir.iterdir()}
+
+
+def test_writes_new_files(tmp_path):
+    _write_reqs(tmp_path, {"imp1": "ucft {}\n", "rep1": "ucft {}\n"})
+    assert _req_files(tmp_path) == {"imp1.req": "ucft {}\n", "rep1.req": "ucft {}\n"}
+
+
+def test_keeps_unchanged_files(tmp_path):
+    path = tmp_path / "imp1.req"
+    path.write_text("ucft {}\n")
+    os.utime(path, ns=(0, 0))
+    _write_reqs(tmp_path, {"imp1": "ucft {}\n"})
+    assert path.stat().st_mtime_ns == 0
+
+
+def test_rewrites_changed_files(tmp_path):
+    (tmp_path / "imp1.req").write_text("ucft {}\n")
+    _write_reqs(tmp_path, {"imp1": "ucft { texture }\n"})
+    assert _req_files(tmp_path) == {"imp1.req": "ucft { texture }\n"}
+
+
+def test_removes_unwanted_request_files_only(tmp_path):
+    (tmp_path / "old.req").write_text("ucft {}\n")
+    (tmp_path / "notes.txt").write_text("keep me")
+    _write_reqs(tmp_path, {"imp1": "ucft {}\n"})
+    assert _req_files(tmp_path) == {"imp1.req": "ucft {}\n", "notes.txt": "keep me"}
+
+
+def test_packs_load_request_files(tmp_path, monkeypatch):
+    load_dir = tmp_path / "data_ABC" / "Load"
+    (load_dir / "backdrops" / "imp").mkdir(parents=True)
+    (load_dir / "backdrops" / "imp" / "imp1.tga").touch()
+    (load_dir / "extra").mkdir()
+    (load_dir / "load.req").touch()
+    (load_dir / "extra" / "tips.req").touch()
+    (tmp_path / "data_ABC" / "_BUILD").mkdir()
+    monkeypatch.chdir(tmp_path / "data_ABC" / "_BUILD")
+    packs = []
+    monkeypatch.setattr(load, "munge", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        load,
+        "level_pack",
+        lambda input_files, source_dir, *args, **kwargs: packs.append(
+            (input_files, Path(source_dir).as_posix())
+        ),
+    )
+
+    LoadMunger().run()
+    assert packs == [
+        ("$*.req", "../Load/__TEMP__/textures"),
+        ("$*.req", "../Load/__TEMP__/backdrops"),
+        (["extra/tips.req", "load.req"], "../Load"),
+    ]
@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from xm.utils.tools import PathIndex, mkdir_p
+
+
+@pytest.fixture
+def sides(tmp_path):
+    (tmp_path / "Sides" / "IMP" / "MSH").mkdir(parents=True)
+    return tmp_path / "Sides"
+
+
+@pytest.fixture
+def scans(monkeypatch) -> list[str]:
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(str(path))
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    return scanned
+
+
+def test_resolve_ignores_case(sides):
+    index = PathIndex()
+    assert (
+        index.resolve(sides.parent / "sides" / "imp" / "msh") == sides / "IMP" / "MSH"
+    )
+    # Parts which do not exist are kept as given
+    assert index.resolve(sides / "imp" / "odf") == sides / "IMP" / "odf"
+
+
+def test_resolve_relative_path(sides, monkeypatch):
+    monkeypatch.chdir(sides)
+    assert PathIndex().resolve(Path("../sides/Imp")) == Path("../Sides/IMP")
+
+
+def test_resolve_prefers_upper_case(sides):
+    (sides / "imp").mkdir()
+    (sides / "Rep").mkdir()
+    (sides / "rep").mkdir()
+    index = PathIndex()
+    assert index.resolve(sides / "Imp") == sides / "IMP"
+    assert index.resolve(sides / "imp") == sides / "IMP"
+    # Then lower case, then as given
+    assert index.resolve(sides / "REP") == sides / "rep"
+    assert index.resolve(sides / "Rep") == sides / "rep"
+
+
+def test_listings_are_cached(sides, scans):
+    index = PathIndex()
+    index.resolve(sides / "imp" / "msh")
+    listed = len(scans)
+    index.resolve(sides / "Imp" / "Msh")
+    assert len(scans) == listed
+
+
+def test_missing_part_is_listed_again(sides):
+    index = PathIndex()
+    assert index.resolve(sides / "rep") == sides / "rep"
+    # Created behind the index's back, e.g. by a munge tool
+    (sides / "REP").mkdir()
+    assert index.resolve(sides / "rep") == sides / "REP"
+
+
+def test_invalidate(sides):
+    index = PathIndex()
+    assert index.resolve(sides / "imp" / "msh") == sides / "IMP" / "MSH"
+    (sides / "IMP" / "MSH").rename(sides / "IMP" / "msh")
+    # The listing of IMP still has the old name
+    assert index.resolve(sides / "imp" / "msh") == sides / "IMP" / "MSH"
+
+    index.invalidate(sides / "IMP")
+    assert index.resolve(sides / "imp" / "msh") == sides / "IMP" / "msh"
+
+
+def test_mkdir_p_invalidates(sides, monkeypatch):
+    index = PathIndex()
+    monkeypatch.setattr("xm.utils.tools.path_index", index)
+    assert index.resolve(sides / "imp" / "msh") == sides / "IMP" / "MSH"
+    (sides / "IMP" / "MSH").rename(sides / "IMP" / "msh")
+    mkdir_p(sides / "IMP" / "msh" / "odf")
+    # The listings of the new directory's ancestors are forgotten
+    assert index.resolve(sides / "imp" / "MSH" / "odf") == sides / "IMP" / "msh" / "odf"
@@ -0,0 +1,52 @@
+import pytest
+
+from xm.mungers.pipeline import schedule_mungers
+from xm.utils.args import build_actions_list, build_parser
+from xm.utils.scheduler import Scheduler
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    A data directory with sides IMP and rep, and sprites for IMP in Common
+    """
+    data_dir = tmp_path / "data_ABC"
+    (data_dir / "_BUILD").mkdir(parents=True)
+    (data_dir / "Common" / "sprites" / "imp_sprite_scout" / "output" / "packed").mkdir(
+        parents=True
+    )
+    (data_dir / "Sides" / "IMP").mkdir(parents=True)
+    (data_dir / "Sides" / "rep").mkdir(parents=True)
+    monkeypatch.chdir(data_dir / "_BUILD")
+    return data_dir
+
+
+def _schedule(*argv: str) -> Scheduler:
+    scheduler = Scheduler()
+    actions = build_actions_list(build_parser().parse_args(list(argv)))
+    schedule_mungers(scheduler, actions, "PC")
+    return scheduler
+
+
+def test_side_munge_waits_for_its_sprites(data_dir):
+    scheduler = _schedule("--common", "--side", "IMP", "rep")
+    assert scheduler.tasks["Common:sprites:IMP"].deps == set()
+    assert scheduler.tasks["Sides/IMP:munge"].deps == {"Common:sprites:IMP"}
+    assert scheduler.tasks["Sides/rep:munge"].deps == set()
+    assert scheduler.tasks["Sides/IMP:pack"].deps == {"Sides/IMP:munge", "Common"}
+
+
+def test_side_munge_without_common(data_dir):
+    for name in ["core", "common", "ingame"]:
+        munge_dir = data_dir / "_BUILD" / "Common" / "MUNGED" / "PC"
+        munge_dir.mkdir(parents=True, exist_ok=True)
+        (munge_dir / f"{name}.files").touch()
+    scheduler = _schedule("--side", "IMP")
+    assert "Common" not in scheduler
+    assert scheduler.tasks["Sides/IMP:munge"].deps == set()
+    assert scheduler.tasks["Sides/IMP:pack"].deps == {"Sides/IMP:munge"}
+
+
+def test_sound_and_load_are_told_apart(data_dir):
+    scheduler = _schedule("--load", "--sound", "--common")
+    assert "Load" in scheduler and "Sound" in scheduler
@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from xm.utils import reqs
+from xm.utils.reqs import REQ_GRAPH_NAME, ReqGraph, _parse_sections, parse_req
+
+SIDE_REQ = """ucft
+{
+    REQN
+    {
+        "class"
+        "imp_inf_trooper"
+        "imp_inf_pilot"
+    }
+    // REQN { "class" "imp_inf_commented_out" }
+    REQN
+    {
+        "texture"
+        "platform=pc"
+        "imp_icon"
+    }
+    REQN { "config" "imp hud" } REQN { "lvl" "imp_inf" }
+}
+"""
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def test_parse_sections():
+    assert _parse_sections(SIDE_REQ) == [
+        ("class", ["imp_inf_trooper", "imp_inf_pilot"], None),
+        ("texture", ["imp_icon"], "pc"),
+        ("config", ["imp hud"], None),
+        ("lvl", ["imp_inf"], None),
+    ]
+
+
+def test_parse_sections_without_names():
+    assert _parse_sections('ucft { REQN { } REQN { "lvl" } }') == [("lvl", [], None)]
+    assert _parse_sections("") == []
+
+
+@pytest.mark.parametrize(
+    "platform, textures", [(None, ["imp_icon"]), ("PC", ["imp_icon"]), ("PS2", [])]
+)
+def test_parse_req(platform, textures):
+    assert parse_req(SIDE_REQ, platform) == [
+        ("class", ["imp_inf_trooper", "imp_inf_pilot"]),
+        ("texture", textures),
+        ("config", ["imp hud"]),
+        ("lvl", ["imp_inf"]),
+    ]
+
+
+def test_dependencies(tmp_path):
+    source_dir = tmp_path / "Sides" / "IMP"
+    munge_dir = tmp_path / "MUNGED"
+    req = _write(source_dir / "imp.req", SIDE_REQ)
+    nested = _write(source_dir / "req" / "imp_inf.req", 'ucft { REQN { "class" "x" } }')
+    trooper = _write(munge_dir / "imp_inf_trooper.class", "")
+    trooper_req = _write(
+        munge_dir / "imp_inf_trooper.class.req", 'ucft { REQN { "model" "m" } }'
+    )
+    model = _write(munge_dir / "m.model", "")
+    icon = _write(munge_dir / "IMP_ICON.texture", "")
+    x = _write(munge_dir / "x.class", "")
+
+    graph = ReqGraph(munge_dir)
+    assert graph.dependencies([req], source_dir, [munge_dir], "PC") == {
+        req: sorted([req, nested, trooper, trooper_req, model, icon, x])
+    }
+    assert icon not in graph.dependencies([req], source_dir, [munge_dir], "PS2")[req]
+
+
+def test_parsed_files_are_kept(tmp_path, monkeypatch):
+    req = _write(tmp_path / "imp.req", SIDE_REQ)
+    graph = ReqGraph(tmp_path)
+    sections = graph.sections(req)
+    graph.save()
+    assert (tmp_path / REQ_GRAPH_NAME).exists()
+
+    def fail(contents):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(reqs, "_parsed", {})
+    monkeypatch.setattr(reqs, "_parse_sections", fail)
+    assert ReqGraph(tmp_path).sections(req) == sections
+
+
+def test_changed_file_is_parsed_again(tmp_path, monkeypatch):
+    req = _write(tmp_path / "imp.req", SIDE_REQ)
+    graph = ReqGraph(tmp_path)
+    graph.sections(req)
+    graph.save()
+
+    stat = req.stat()
+    req.write_text('ucft { REQN { "lvl" "imp_inf" } }')
+    os.utime(req, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    monkeypatch.setattr(reqs, "_parsed", {})
+    graph = ReqGraph(tmp_path)
+    assert graph.sections(req) == [("lvl", ["imp_inf"])]
+    graph.save()
+    assert ReqGraph(tmp_path).parsed[str(req)]["sections"] == [["lvl", ["imp_inf"]]]
+
+
+def test_unreadable_graph_is_ignored(tmp_path):
+    (tmp_path / REQ_GRAPH_NAME).write_text("{")
+    assert ReqGraph(tmp_path).parsed == {}
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from time import monotonic, sleep
+from typing import Optional
+
+import pytest
+
+from xm.utils import tools as tools_module
+from xm.utils.globals import Settings
+from xm.utils.tools import ToolRunner
+
+MiB = 1024
+
+
+def _wait_until(condition) -> None:
+    deadline = monotonic() + 5
+    while not condition():
+        assert monotonic() < deadline, "timed out"
+        sleep(0.005)
+
+
+class _Tools:
+    """
+    Stands in for the tool processes of a ToolRunner: each invocation records that it
+    started, then runs until the test finishes it
+    """
+
+    def __init__(self, runner: ToolRunner):
+        self.runner = runner
+        self.started = []
+        # The most memory predicted for the running tools whenever one started, in KiB
+        self.peak_predicted_kb = 0
+        self._finished = {}
+        self._threads = {}
+        runner._run_local = self._run_local
+
+    async def _run_local(self, command, log_name, result, tool) -> None:
+        self.started.append(command[1])
+        self.peak_predicted_kb = max(
+            self.peak_predicted_kb, sum(t.predicted_kb for t in self.runner._running)
+        )
+        while not self._finished[command[1]].is_set():
+            await asyncio.sleep(0.005)
+
+    def _queued(self) -> int:
+        return len(self.runner._waiting) + self.runner.running
+
+    def submit(self, tool: str, name: str, run=None) -> None:
+        """
+        Hands an invocation to the runner from a thread of its own, and waits for it to
+        arrive
+        :param tool: The tool, e.g. LevelPack
+        :param name: A name for the invocation, unique within the test
+        :param run: (Optional) Runs the invocation's command, by default through
+        ToolRunner.run()
+        """
+        self._finished[name] = threading.Event()
+        queued = self._queued()
+        command = [tool, name]
+        run = run or (lambda command: self.runner.call(self.runner.run(command)))
+        thread = threading.Thread(target=run, args=(command,))
+        thread.start()
+        self._threads[name] = thread
+        _wait_until(lambda: self._queued() > queued)
+
+    def finish(self, name: str) -> None:
+        self._finished[name].set()
+        self._threads[name].join(5)
+
+    def assert_started(self, names: list[str]) -> None:
+        """
+        Waits for the invocations to start, then checks that no others started
+        :param names: The names of every invocation expected to have started, in order
+        """
+        _wait_until(lambda: len(self.started) >= len(names))
+        # Give any other invocation the chance to start as well
+        sleep(0.05)
+        assert self.started == names
+
+    def finish_all(self) -> None:
+        for name in list(self._threads):
+            self._finished[name].set()
+        for thread in self._threads.values():
+            thread.join(5)
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    monkeypatch.setattr(Settings, "jobs", 4)
+    monkeypatch.setattr(Settings, "tool_jobs", {})
+    monkeypatch.setattr(Settings, "mem_budget", 0)
+    fake_tools = _Tools(ToolRunner())
+    yield fake_tools
+    fake_tools.finish_all()
+
+
+def test_jobs_limit(tools, monkeypatch):
+    monkeypatch.setattr(Settings, "jobs", 2)
+    for name in ["a", "b", "c"]:
+        tools.submit("OdfMunge", name)
+    tools.assert_started(["a", "b"])
+
+    tools.finish("a")
+    tools.assert_started(["a", "b", "c"])
+    assert tools.runner.running == 2
+
+
+def test_tool_jobs_limit(tools, monkeypatch):
+    monkeypatch.setattr(Settings, "tool_jobs", {"levelpack": 1})
+    tools.submit("LevelPack", "core")
+    tools.submit("LevelPack", "common")
+    tools.submit("OdfMunge", "odf")
+    tools.assert_started(["core", "odf"])
+    assert tools.runner.by_category["LevelPack"] == 1
+
+    tools.finish("core")
+    tools.assert_started(["core", "odf", "common"])
+
+
+@pytest.fixture
+def submit_predicted(tools, monkeypatch):
+    """
+    Runs invocations through _exec_wine() with a memory budget of 100 MiB, predicting
+    each invocation's peak memory use from its name
+    """
+    predicted = {}
+    monkeypatch.setattr(Settings, "mem_budget", 100)
+    monkeypatch.setattr(tools_module, "tool_runner", tools.runner)
+    monkeypatch.setattr(
+        tools_module.timing_history,
+        "predict_rss",
+        lambda munger, category, pattern: predicted.get(pattern),
+    )
+
+    def submit(name: str, memory_mib: Optional[int] = None) -> None:
+        if memory_mib is not None:
+            predicted[name] = memory_mib * MiB
+        tools.submit(
+            "LevelPack",
+            name,
+            lambda command: tools_module._exec_wine(command, pattern=name),
+        )
+
+    return submit
+
+
+def test_memory_budget(tools, submit_predicted):
+    submit_predicted("a", 40)
+    submit_predicted("b", 40)
+    submit_predicted("c", 40)
+    tools.assert_started(["a", "b"])
+
+    tools.finish("a")
+    tools.assert_started(["a", "b", "c"])
+    assert tools.peak_predicted_kb <= 100 * MiB
+
+
+def test_jobs_start_in_arrival_order(tools, submit_predicted):
+    submit_predicted("small", 30)
+    submit_predicted("big", 80)
+    # Would fit next to the first one, but the big one arrived before it
+    submit_predicted("later", 30)
+    tools.assert_started(["small"])
+
+    tools.finish("small")
+    tools.assert_started(["small", "big"])
+    tools.finish("big")
+    tools.assert_started(["small", "big", "later"])
+    assert tools.peak_predicted_kb <= 100 * MiB
+
+
+def test_tool_over_budget_runs_alone(tools, submit_predicted):
+    submit_predicted("huge", 150)
+    submit_predicted("small", 10)
+    tools.assert_started(["huge"])
+
+    tools.finish("huge")
+    tools.assert_started(["huge", "small"])
+
+
+def test_unpredicted_tool_needs_no_memory(tools, submit_predicted):
+    submit_predicted("big", 90)
+    # Without a history for it, the invocation is not held back
+    submit_predicted("new")
+    tools.assert_started(["big", "new"])
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from xm.utils.history import HISTORY_FILE, TASK_CATEGORY, TimingHistory
+from xm.utils.scheduler import Scheduler, current_task
+
+
+class _Recorder:
+    """
+    Makes task callables which record the order they ran in
+    """
+
+    def __init__(self):
+        self.ran = []
+        self._lock = threading.Lock()
+
+    def task(self, name: str, fail: bool = False):
+        def func():
+            with self._lock:
+                self.ran.append(name)
+            if fail:
+                raise ValueError(name)
+
+        return func
+
+
+def _add(scheduler: Scheduler, recorder: _Recorder, graph: dict) -> None:
+    for name, deps in graph.items():
+        scheduler.add(name, recorder.task(name), deps)
+
+
+def test_runs_in_order_added():
+    scheduler, recorder = Scheduler(), _Recorder()
+    _add(
+        scheduler,
+        recorder,
+        {
+            "Sides/IMP:pack": ["Common", "Sides/IMP:munge"],
+            "Common": [],
+            "Sides/IMP:munge": [],
+            "Load": [],
+        },
+    )
+    scheduler.run()
+    # In the order the tasks were added, each as soon as its dependencies are done
+    assert recorder.ran == ["Common", "Sides/IMP:munge", "Sides/IMP:pack", "Load"]
+
+
+def test_dependencies_finish_first():
+    scheduler, recorder = Scheduler(jobs=4), _Recorder()
+    graph = {
+        "Common": [],
+        "Sides/IMP:munge": [],
+        "Sides/IMP:pack": ["Common", "Sides/IMP:munge"],
+        "Sides/REP:munge": [],
+        "Sides/REP:pack": ["Common", "Sides/REP:munge"],
+        "addme": ["Sides/IMP:pack", "Sides/REP:pack"],
+    }
+    _add(scheduler, recorder, graph)
+    scheduler.run()
+    assert sorted(recorder.ran) == sorted(graph)
+    for name, deps in graph.items():
+        assert all(recorder.ran.index(d) < recorder.ran.index(name) for d in deps)
+
+
+def test_failed_task_skips_dependents():
+    scheduler, recorder = Scheduler(), _Recorder()
+    scheduler.add("Common", recorder.task("Common", fail=True))
+    scheduler.add("Sides/IMP:munge", recorder.task("Sides/IMP:munge"))
+    scheduler.add("Sides/IMP:pack", recorder.task("Sides/IMP:pack"), ["Common"])
+    scheduler.add("addme", recorder.task("addme"), ["Sides/IMP:pack"])
+
+    with pytest.raises(RuntimeError, match="3 task"):
+        scheduler.run()
+    assert recorder.ran == ["Common", "Sides/IMP:munge"]
+
+
+@pytest.mark.parametrize(
+    "graph, error",
+    [
+        ({"a": ["b"]}, "unknown task b"),
+        ({"a": ["b"], "b": ["c"], "c": ["a"]}, "cycle"),
+    ],
+)
+def test_malformed_graph(graph, error):
+    scheduler, recorder = Scheduler(), _Recorder()
+    _add(scheduler, recorder, graph)
+    with pytest.raises(RuntimeError, match=error):
+        scheduler.run()
+    assert recorder.ran == []
+
+
+def test_duplicate_task():
+    scheduler = Scheduler()
+    scheduler.add("Common", lambda: None)
+    with pytest.raises(RuntimeError, match="Duplicate"):
+        scheduler.add("Common", lambda: None)
+
+
+def test_longest_chain_starts_first(tmp_path):
+    timings = TimingHistory(tmp_path / HISTORY_FILE)
+    for task, duration in [("Load", 1.0), ("Sides/IMP:munge", 2.0), ("Common", 30.0)]:
+        timings.record(task, TASK_CATEGORY, task, duration)
+
+    scheduler, recorder = Scheduler(jobs=2, history=timings), _Recorder()
+    started = threading.Barrier(2, timeout=5)
+
+    def together(name: str):
+        # Waits for the other one of the two tasks started first
+        def func():
+            recorder.task(name)()
+            started.wait()
+
+        return func
+
+    scheduler.add("Load", recorder.task("Load"))
+    scheduler.add("Sides/IMP:munge", together("Sides/IMP:munge"))
+    scheduler.add("Common", together("Common"))
+    scheduler.run()
+
+    assert set(recorder.ran[:2]) == {"Common", "Sides/IMP:munge"}
+    assert recorder.ran[2] == "Load"
+
+
+def test_durations_are_recorded(tmp_path):
+    timings = TimingHistory(tmp_path / HISTORY_FILE)
+    scheduler = Scheduler(history=timings)
+    names = []
+    scheduler.add("Sides/IMP:munge", lambda: names.append(current_task()))
+    scheduler.run()
+
+    assert names == ["Sides/IMP:munge"]
+    assert timings.task_duration("Sides/IMP:munge") is not None
+    assert current_task() == ""
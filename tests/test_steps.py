@@ -0,0 +1,93 @@
+import pytest
+
+from xm.mungers.base import BaseMunger, MungeStep, _patterns_overlap
+from xm.mungers.world import WorldMunger
+from xm.utils.scheduler import Scheduler
+
+
+@pytest.mark.parametrize(
+    "a, b, overlap",
+    [
+        ("out/a*", "out/*b", True),
+        ("out/*.config", "out/*.config", True),
+        ("out/*", "out/abc.model.req", True),
+        ("out/abc.path", "out/*.PATH", True),
+        ("out\\abc.path", "out/abc.path", True),
+        ("out/*.[ch]", "out/*.d", True),
+        ("out/*.class", "out/*.model", False),
+        ("out/*.class", "out/*.class.req", False),
+        ("out/abc.path", "out/abcd.path", False),
+        ("../Worlds/ABC/*.odf", "Worlds/ABC/MUNGED/PC/*.odf", False),
+    ],
+)
+def test_patterns_overlap(a, b, overlap):
+    assert _patterns_overlap(a, b) is overlap
+    assert _patterns_overlap(b, a) is overlap
+
+
+class _StepMunger(BaseMunger):
+    def run(self):
+        pass
+
+
+def _step(name: str, reads=(), writes=()) -> MungeStep:
+    return MungeStep(name, lambda: None, reads, writes)
+
+
+def test_schedule_steps():
+    scheduler = Scheduler()
+    steps = [
+        _step("prepare", writes=["out/*"]),
+        _step("odf", ["src/*.odf"], ["out/*.class"]),
+        _step("model", ["src/*.msh"], ["out/*.model"]),
+        _step("config", ["src/*.combo"], ["out/*.config"]),
+        _step("sky", ["src/*.sky"], ["out/*.config"]),
+        _step("pack", ["out/*.class", "out/*.model"], ["lvl/*.lvl"]),
+    ]
+    name = _StepMunger("Worlds/ABC")._schedule_steps(
+        scheduler, "ABC:munge", steps, ["Common"]
+    )
+
+    assert name == "ABC:munge"
+    deps = {task.name: task.deps for task in scheduler.tasks.values()}
+    assert deps == {
+        "ABC:munge:prepare": {"Common"},
+        "ABC:munge:odf": {"Common", "ABC:munge:prepare"},
+        "ABC:munge:model": {"Common", "ABC:munge:prepare"},
+        "ABC:munge:config": {"Common", "ABC:munge:prepare"},
+        "ABC:munge:sky": {"Common", "ABC:munge:prepare", "ABC:munge:config"},
+        "ABC:munge:pack": {
+            "Common",
+            "ABC:munge:prepare",
+            "ABC:munge:odf",
+            "ABC:munge:model",
+        },
+        "ABC:munge": {"Common", *(f"ABC:munge:{s.name}" for s in steps)},
+    }
+
+
+def test_world_steps(tmp_path, monkeypatch):
+    world_dir = tmp_path / "data_ABC" / "Worlds" / "ABC" / "world1"
+    world_dir.mkdir(parents=True)
+    for name in ["ABC.wld", "ABC.pth", "ABD.wld"]:
+        (world_dir / name).touch()
+    (tmp_path / "data_ABC" / "_BUILD").mkdir()
+    monkeypatch.chdir(tmp_path / "data_ABC" / "_BUILD")
+
+    scheduler = Scheduler()
+    WorldMunger("ABC").schedule(scheduler)
+
+    def deps(step: str) -> set[str]:
+        return {
+            d.rsplit(":", 1)[-1] for d in scheduler.tasks[f"Worlds/ABC:{step}"].deps
+        }
+
+    assert deps("munge:odf") == {"prepare"}
+    assert deps("munge:world") == {"prepare"}
+    # The Config munges all write .config files, so they keep their order
+    assert deps("munge:sky") == {"prepare", "config"}
+    assert deps("munge:sound") == {"prepare", "config", "sky"}
+    # Only worlds with paths get a path munge
+    assert "Worlds/ABC:munge:path:ABC" in scheduler
+    assert "Worlds/ABC:munge:path:ABD" not in scheduler
+    assert deps("pack") == {"munge"}
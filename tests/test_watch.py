@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from xm.utils.watch import actions_for_changes
+
+DATA_DIR = Path("/mods/data_ABC")
+
+
+def _actions(*changed: str):
+    return actions_for_changes([DATA_DIR / c for c in changed], DATA_DIR)
+
+
+def test_nothing_to_munge():
+    assert _actions() is None
+
+
+def test_ignored_changes():
+    assert (
+        _actions(
+            "Load/__TEMP__/load.req",
+            "addme/munged/addme.script",
+            "Sides/IMP/MUNGED/PC/imp.lvl",
+            "Common/scripts/setup_teams.lua.swp",
+            "Common/scripts/.#setup_teams.lua",
+        )
+        is None
+    )
+
+
+def test_side_and_world():
+    actions = _actions(
+        "Sides/IMP/msh/imp_inf_trooper.msh",
+        "Sides/IMP/odf/imp_inf_trooper.odf",
+        "Worlds/ABC/world1/ABC.wld",
+    )
+    assert actions["sides"] == ["IMP"]
+    assert actions["worlds"] == ["ABC"]
+    assert not actions["common"] and not actions["load"]
+
+
+def test_side_and_world_commons():
+    actions = _actions("Sides/Common/msh/com_weap.msh", "Worlds/Common/sky.tga")
+    assert actions["sides"] == "EVERYTHING"
+    assert actions["worlds"] == "EVERYTHING"
+
+
+def test_everything_after_a_side():
+    actions = _actions("Sides/IMP/req/imp.req", "Sides/Common/msh/com_weap.msh")
+    assert actions["sides"] == "EVERYTHING"
+
+
+def test_bare_roots_after_an_overflow():
+    actions = _actions("Sides", "Worlds", "Shell")
+    assert actions["sides"] == "EVERYTHING"
+    assert actions["worlds"] == "EVERYTHING"
+    assert actions["shell"] and actions["movies"]
+
+
+def test_other_directories():
+    actions = _actions(
+        "Common/scripts/setup_teams.lua",
+        "Load/backdrops/imp/imp1.tga",
+        "Shell/movies/shell.mcfg",
+        "addme/addme.lua",
+        "Sound/global.req",
+    )
+    assert actions["common"] and actions["load"] and actions["addme"]
+    assert actions["shell"] and actions["movies"] and actions["sound"]
+    assert actions["sides"] == [] and actions["worlds"] == []
+
+
+def test_shell_without_movies():
+    actions = _actions("Shell/scripts/shell_interface.lua")
+    assert actions["shell"] and not actions["movies"]
@@ -0,0 +1,192 @@
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from xm.utils.remote import WorkerPool
+from xm.worker import MungeWorker, _inside_job
+
+SECRET = "correct horse battery staple"
+
+# Stands in for Wine and pc_TextureMunge: upper-cases every file in -sourcedir into
+# -outputdir and writes a log to its working directory. With XMUNGE_TEST_MEET set, it
+# first waits for another invocation to meet it there.
+FAKE_WINE = f"""#!{sys.executable}
+import os, sys, time
+meet = os.environ.get("XMUNGE_TEST_MEET")
+if meet:
+    open(os.path.join(meet, str(os.getpid())), "w").close()
+    deadline = time.monotonic() + 5
+    while len(os.listdir(meet)) < 2:
+        if time.monotonic() > deadline:
+            sys.exit(1)
+        time.sleep(0.01)
+args = sys.argv[1:]
+source, output = args[args.index("-sourcedir") + 1], args[args.index("-outputdir") + 1]
+print("Munging with", args[0])
+os.makedirs(output, exist_ok=True)
+for name in sorted(os.listdir(source)):
+    with open(os.path.join(source, name)) as src:
+        with open(os.path.join(output, name + ".tex"), "w") as dest:
+            dest.write(src.read().upper())
+with open(args[0] + ".log", "w") as log:
+    log.write("WARNING: texture is not a power of two\\n")
+"""
+
+COMMAND = [
+    "pc_TextureMunge",
+    "-inputfile $*.tga",
+    "-sourcedir ../Common/textures",
+    "-outputdir Common/MUNGED/PC",
+]
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    """
+    A munge worker with two slots on a loopback port, with pc_TextureMunge as its only
+    tool and a fake Wine on the PATH
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "wine").write_text(FAKE_WINE)
+    (bin_dir / "wine").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    tools_dir = tmp_path / "ToolsFL" / "bin"
+    tools_dir.mkdir(parents=True)
+    (tools_dir / "pc_TextureMunge.exe").touch()
+
+    munge_worker = MungeWorker(tmp_path / "worker", tools_dir, SECRET, slots=2)
+    listening = threading.Event()
+    threading.Thread(
+        target=munge_worker.serve_forever,
+        args=(lambda port: listening.set(),),
+        daemon=True,
+    ).start()
+    assert listening.wait(5)
+    return munge_worker
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data_ABC"
+    (data_dir / "_BUILD").mkdir(parents=True)
+    textures = data_dir / "Common" / "textures"
+    textures.mkdir(parents=True)
+    (textures / "hud.tga").write_text("hud")
+    monkeypatch.chdir(data_dir / "_BUILD")
+    return data_dir / "_BUILD"
+
+
+def _pool(worker: MungeWorker, secret: str = SECRET) -> WorkerPool:
+    pool = WorkerPool()
+    pool.configure([(worker.host, worker.port)], secret)
+    return pool
+
+
+def _inputs(build_dir: Path) -> list[Path]:
+    return [build_dir.parent / "Common" / "textures" / "hud.tga"]
+
+
+def test_run(worker, build_dir, caplog):
+    pool = _pool(worker)
+    returncode, output, log_text = pool.run(
+        COMMAND, "pc_TextureMunge.log", _inputs(build_dir)
+    )
+    assert returncode == 0
+    assert output == ["Munging with pc_TextureMunge"]
+    assert log_text == "WARNING: texture is not a power of two"
+    munged = build_dir / "Common" / "MUNGED" / "PC" / "hud.tga.tex"
+    assert munged.read_text() == "HUD"
+    assert not (build_dir / "pc_TextureMunge.log").exists()
+
+    # The worker already has the input, so it is not sent again
+    with caplog.at_level(logging.DEBUG, logger="main"):
+        assert pool.run(COMMAND, None, _inputs(build_dir))[0] == 0
+    assert "pc_TextureMunge: sent 0 of 1 files" in caplog.text
+
+
+def test_slots(worker, build_dir, tmp_path, monkeypatch):
+    meet = tmp_path / "meet"
+    meet.mkdir()
+    monkeypatch.setenv("XMUNGE_TEST_MEET", str(meet))
+    pool = _pool(worker)
+    results = []
+
+    def run() -> None:
+        results.append(pool.run(COMMAND, None, _inputs(build_dir))[0])
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    # Each invocation only finishes once the other one is running too
+    assert results == [0, 0]
+
+
+def test_wrong_secret(worker, build_dir):
+    pool = _pool(worker, "guess")
+    with pytest.raises(ValueError, match="Authentication failed"):
+        pool._run_on(pool.addresses[0], COMMAND, None, {}, [], build_dir)
+    # The worker is dropped and the invocation left to run locally
+    assert pool.run(COMMAND, None, _inputs(build_dir)) is None
+    assert not pool.enabled
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        ["sh", "-c true"],
+        ["pc_ModelMunge", "-sourcedir ../Common/textures"],
+        ["../../bin/wine", "-sourcedir ../Common/textures"],
+        ["pc_TextureMunge", "-sourcedir /etc", "-outputdir Common/MUNGED/PC"],
+        ["pc_TextureMunge", "-sourcedir ../../..", "-outputdir Common/MUNGED/PC"],
+        ["pc_TextureMunge", "-sourcedir Z:\\etc", "-outputdir Common/MUNGED/PC"],
+    ],
+)
+def test_refused_commands(worker, build_dir, command):
+    pool = _pool(worker)
+    with pytest.raises(ValueError, match="Refusing"):
+        pool._run_on(pool.addresses[0], command, None, {}, [], build_dir)
+
+
+@pytest.mark.parametrize(
+    "files, dirs, log_name",
+    [
+        ({"../../escape.tga": "0" * 64}, [], None),
+        ({}, ["/tmp/escape"], None),
+        ({}, [], "../../escape.log"),
+    ],
+)
+def test_refused_paths(worker, build_dir, files, dirs, log_name):
+    pool = _pool(worker)
+    with pytest.raises(ValueError, match="Refusing"):
+        pool._run_on(pool.addresses[0], COMMAND, log_name, files, dirs, build_dir)
+
+
+@pytest.mark.parametrize(
+    "path, inside",
+    [
+        ("../Common/textures", True),
+        ("Common/MUNGED/PC", True),
+        ("..\\Sides\\IMP\\msh", True),
+        ("$*.tga", True),
+        ("..", True),
+        ("../..", False),
+        ("../../etc/passwd", False),
+        ("/etc/passwd", False),
+        ("C:\\Windows", False),
+        ("..\\..\\escape", False),
+    ],
+)
+def test_inside_job(path, inside):
+    assert _inside_job(path) is inside
+
+
+def test_secret_required(tmp_path):
+    with pytest.raises(ValueError):
+        MungeWorker(tmp_path, tmp_path, "")
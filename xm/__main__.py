@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional
+
+from xm.daemon import BuildServer, run_remote
+from xm.utils.dirs import get_swbf2_path
+from xm.utils.globals import Settings
+from xm.utils.logs import setup_logging
+from xm.utils.remote import DEFAULT_WORKER_PORT, WORKER_SECRET_ENV
+from xm.utils.wine import wine_session
+from xm.worker import MungeWorker
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = ArgumentParser(prog="xmunge")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Run a build daemon for the _BUILD directory in the current directory",
+    )
+    serve_parser.add_argument("--wine-prefix", nargs="?", type=str)
+    serve_parser.add_argument("-d", action="store_true", dest="debug_mode")
+
+    subparsers.add_parser(
+        "stop", help="Stop the build daemon for the current directory"
+    )
+
+    worker_parser = subparsers.add_parser(
+        "worker",
+        help="Run tools for munges on other machines, with this machine's modtools "
+        "and Wine",
+    )
+    worker_parser.add_argument("--host", default="127.0.0.1")
+    worker_parser.add_argument("--port", type=int, default=DEFAULT_WORKER_PORT)
+    worker_parser.add_argument("--root", type=Path, help="Where to keep received files")
+    worker_parser.add_argument(
+        "--tools-dir",
+        type=Path,
+        help="The modtools' ToolsFL/bin directory",
+        default=Settings.bin_path,
+    )
+    worker_parser.add_argument("--wine-prefix", nargs="?", type=str)
+    worker_parser.add_argument(
+        "--slots",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="How many tools to run at once (default: one per core)",
+    )
+    worker_parser.add_argument("-d", action="store_true", dest="debug_mode")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "stop":
+        status = run_remote("stop", [])
+        if status is None:
+            print("No daemon is running for this directory", file=sys.stderr)
+            return 1
+        return status
+
+    if args.command == "worker":
+        secret = os.environ.get(WORKER_SECRET_ENV)
+        if not secret:
+            print(
+                f"Set {WORKER_SECRET_ENV} to the secret shared with munge clients",
+                file=sys.stderr,
+            )
+            return 1
+        root = (
+            args.root or Path(tempfile.gettempdir()) / f"xmunge-worker-{args.port}"
+        ).resolve()
+        worker = MungeWorker(
+            root,
+            args.tools_dir.resolve(),
+            secret,
+            args.host,
+            args.port,
+            args.wine_prefix,
+            args.slots,
+        )
+        # The worker's log goes in its root rather than in whichever _BUILD it was
+        # started from
+        root.mkdir(parents=True, exist_ok=True)
+        os.chdir(root)
+        setup_logging(debug=args.debug_mode)
+        wine_session.start(args.wine_prefix)
+        try:
+            worker.serve_forever(ready=lambda port: print(port, flush=True))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            wine_session.stop()
+        return 0
+
+    setup_logging(debug=args.debug_mode)
+    gamedata_dir = get_swbf2_path()
+    wine_session.start(args.wine_prefix)
+    try:
+        BuildServer(gamedata_dir, wine_prefix=args.wine_prefix).serve_forever()
+    finally:
+        wine_session.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
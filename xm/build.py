@@ -0,0 +1,416 @@
+import logging
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import remove
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable, Optional, Union
+
+from xm.mungers import schedule_builds
+from xm.utils.artifacts import CacheStats, artifact_cache
+from xm.utils.cache import MANIFEST_NAME, Manifest, get_manifest, shared_scans
+from xm.utils.deploy import Deployment, deploy_file
+from xm.utils.dirs import get_swbf2_path, get_world_id
+from xm.utils.globals import BuildContext, Settings
+from xm.utils.history import timing_history
+from xm.utils.plan import BuildPlan, build_plan
+from xm.utils.progress import progress_line
+from xm.utils.remote import WORKER_SECRET_ENV, parse_address, remote_workers
+from xm.utils.scheduler import Scheduler
+from xm.utils.tools import get_dir_no_case as _
+from xm.utils.tools import run_planned_call
+from xm.utils.workdir import WORK_DIR_PREFIX
+from xm.worker import start_local_workers
+
+# Loopback workers started for --local-workers, kept for later munges in the same
+# process (e.g. in the daemon)
+_local_workers: list[tuple[str, int]] = []
+
+# The secret shared with the loopback workers when none is set in the environment
+_local_secret = secrets.token_hex(32)
+
+
+def configure_workers() -> None:
+    """
+    Points the remote munge worker pool at the workers given by --workers, starting any
+    --local-workers which are not running yet
+    :return: None
+    """
+    addresses = [parse_address(a) for a in Settings.workers]
+    secret = os.environ.get(WORKER_SECRET_ENV) or _local_secret
+    if len(_local_workers) < Settings.local_workers:
+        _local_workers.extend(
+            start_local_workers(
+                Settings.local_workers - len(_local_workers),
+                Settings.bin_path,
+                secret,
+                Settings.wine_prefix,
+            )
+        )
+    addresses += _local_workers[: Settings.local_workers]
+    remote_workers.configure(addresses, secret)
+    if addresses:
+        logging.getLogger("main").info(
+            "Dispatching munges to %d worker(s): %s",
+            len(addresses),
+            ", ".join(f"{host}:{port}" for host, port in addresses),
+        )
+
+
+def deploy(gamedata_dir: Path, build: BuildContext) -> None:
+    """
+    Copies the changed contents of _LVL_<platform> to the SWBF2 GameData directory
+    :param gamedata_dir: The SWBF2 GameData directory
+    :param build: The build of the platform to deploy
+    :return: None
+    """
+    copy_source = build.output_dir
+    world_id = get_world_id()
+    copy_dest = gamedata_dir / "addon" / world_id / "data" / f"_LVL_{build.platform}"
+
+    logger = logging.getLogger("main")
+    logger.info("Copying output files to SWBF2 GameData/addon/%s...", world_id)
+    deployment = Deployment(copy_dest, Settings.deploy_mode, Settings.jobs)
+    deployment.deploy_tree(copy_source, exclude=["addme.script"])
+
+    # addme.script goes up to just ABC/ rather than ABC/data/_LVL_PC/
+    deploy_file(copy_source / "addme.script", copy_dest.parent.parent / "addme.script")
+    logger.info("Deployed: %s", deployment.stats)
+
+
+def plan_munge(munge_list: dict, plan_path: Path) -> None:
+    """
+    Walks the mungers selected in munge_list without running any tools, logs the tool
+    invocations the munge would run with their predicted durations, and saves them to a
+    plan file for --execute-plan
+    :param munge_list: The actions list built from the command-line arguments
+    :param plan_path: The file to save the plan to
+    :raise RuntimeError: If walking any munger failed
+    :return: None
+    """
+    logger = logging.getLogger("main")
+    scheduler = Scheduler()
+    schedule_builds(scheduler, munge_list, Settings.platforms, Settings.languages)
+    build_plan.start(
+        Settings.platforms,
+        {name: sorted(task.deps) for name, task in scheduler.tasks.items()},
+    )
+    try:
+        scheduler.run()
+    finally:
+        build_plan.stop()
+    for line in build_plan.report():
+        logger.info(line)
+    build_plan.save(plan_path)
+    logger.info(
+        "Saved the plan to %s, run it with --execute-plan %s", plan_path, plan_path
+    )
+
+
+def plan_scheduler(
+    plan_path: Path, progress: Optional[Callable[[str, bool, int, int], None]] = None
+) -> Scheduler:
+    """
+    Builds the graph of tasks recorded in a plan file, each of which runs the task's
+    planned tool invocations in order
+    :param plan_path: The plan file saved by --plan
+    :param progress: (Optional) Called whenever a task finishes, see Scheduler
+    :raise RuntimeError: If the plan cannot be run for the current platforms
+    :return: The Scheduler
+    """
+    plan = BuildPlan.load(plan_path)
+    if plan["platforms"] != Settings.platforms:
+        raise RuntimeError(
+            f"{plan_path} is a plan for {','.join(plan['platforms'])}, "
+            f"not {','.join(Settings.platforms)}"
+        )
+    logging.getLogger("main").info(
+        "Running %d tool invocation(s) planned on %s",
+        len(plan["calls"]),
+        plan["created"],
+    )
+    scheduler = Scheduler(jobs=Settings.jobs, progress=progress, history=timing_history)
+    for name, deps in plan["tasks"].items():
+        calls = [c for c in plan["calls"] if c["task"] == name]
+
+        def run(calls=calls) -> None:
+            for call in calls:
+                run_planned_call(call)
+
+        scheduler.add(name, run, deps)
+    return scheduler
+
+
+def munge_and_deploy(
+    munge_list: dict,
+    gamedata_dir: Path,
+    no_xbox_copy: bool = False,
+    progress: Optional[Callable[[str, bool, int, int], None]] = None,
+) -> None:
+    """
+    Runs the mungers selected in munge_list for every platform in Settings.platforms,
+    then deploys the results. The tasks of all platforms run on the same scheduler, and
+    the sources they share are only scanned once.
+    :param munge_list: The actions list built from the command-line arguments
+    :param gamedata_dir: The SWBF2 GameData directory
+    :param no_xbox_copy: (Optional) If True, skips copying the results to an Xbox
+    :param progress: (Optional) Called whenever a munge task finishes, see Scheduler
+    :raise RuntimeError: If any munge task failed
+    :return: None
+    """
+    artifact_cache.stats = CacheStats()
+    if Settings.plan_file:
+        with shared_scans():
+            plan_munge(munge_list, Path(Settings.plan_file))
+        return
+
+    configure_workers()
+    timing_history.begin_build()
+
+    def report(name: str, succeeded: bool, finished: int, total: int) -> None:
+        progress_line.task_finished(name, succeeded, finished, total)
+        if progress is not None:
+            progress(name, succeeded, finished, total)
+
+    if Settings.execute_plan:
+        scheduler = plan_scheduler(Path(Settings.execute_plan), report)
+    else:
+        scheduler = Scheduler(
+            jobs=Settings.jobs, progress=report, history=timing_history
+        )
+        schedule_builds(scheduler, munge_list, Settings.platforms, Settings.languages)
+    progress_line.begin(
+        {name: timing_history.task_duration(name) for name in scheduler.tasks},
+        Settings.jobs,
+    )
+    try:
+        with shared_scans():
+            scheduler.run()
+    finally:
+        progress_line.end()
+        if Settings.cache_stats:
+            logging.getLogger("main").info(artifact_cache.report())
+
+    for platform in Settings.platforms:
+        build = BuildContext(platform)
+        if build.platform == "XBOX" and not no_xbox_copy:
+            pass
+
+        #########################################
+        # Copy _LVL_platform to SWBF2 directory #
+        #########################################
+
+        deploy(gamedata_dir, build)
+
+
+def _remove(path: Path, dry_run: bool = False) -> None:
+    """
+    Deletes a file or a directory tree
+    :param path: The file or directory
+    :param dry_run: (Optional) If True, only logs that it would be deleted
+    :return: None
+    """
+    if dry_run:
+        logging.getLogger("main").info("Would remove %s", path)
+    elif path.is_dir() and not path.is_symlink():
+        rmtree(path)
+    else:
+        remove(path)
+
+
+def clean_addme(dry_run: bool = False) -> None:
+    """
+    Performs a clean of the munged addme.script file in _BUILD/../addme/munged/
+    :param dry_run: (Optional) If True, only lists what would be removed
+    :return: None
+    """
+    addme_script = Path.cwd().parent / "addme" / "munged" / "addme.script"
+    if not addme_script.exists():
+        return
+    _remove(addme_script, dry_run)
+
+
+def clean_subdir(subdir: Union[str, Path], dry_run: bool = False) -> None:
+    """
+    Performs a clean of the munged files in _BUILD/<subdir>/MUNGED/**/
+    :param subdir: The subdirectory of _BUILD to clean inside of
+    :param dry_run: (Optional) If True, only lists what would be removed
+    :return: None
+    """
+    clean_dir = Path.cwd() / subdir / "MUNGED"
+    if not clean_dir.exists():
+        return
+    for item in clean_dir.iterdir():
+        _remove(item, dry_run)
+
+
+def clean_outputs(dry_run: bool = False) -> None:
+    """
+    Removes all items in _BUILD/../_LVL_<platform>/, for every platform in
+    Settings.platforms, and <SWBF2-GameData>/addon/<ABC>/
+    :param dry_run: (Optional) If True, only lists what would be removed
+    :return: None
+    """
+    mLogger = logging.getLogger("main")
+    output_dirs = [BuildContext(p).output_dir for p in Settings.platforms]
+    output_dirs = [d for d in output_dirs if d.exists()]
+    if not output_dirs:
+        return
+
+    for output_dir in output_dirs:
+        mLogger.info("Deleting contents of %s...", output_dir)
+        for item in output_dir.iterdir():
+            _remove(item, dry_run)
+
+    addon_dir = get_swbf2_path() / "addon" / get_world_id()
+    if not addon_dir.exists():
+        return
+
+    mLogger.info("Removing %s from %s...", get_world_id(), get_swbf2_path() / "addon")
+    _remove(addon_dir, dry_run)
+
+
+def _clean_targets(clean_list: dict) -> list[str]:
+    """
+    Lists the directories selected for cleaning in clean_list, relative to _BUILD
+    :param clean_list: The actions list built from the command-line arguments
+    :return: The directories, e.g. ["Common", "Sides/ALL"]
+    """
+    targets = [
+        name.capitalize()
+        for name in ["common", "shell", "load", "sound"]
+        if clean_list[name]
+    ]
+    for kind in ["sides", "worlds"]:
+        selected = clean_list[kind]
+        if selected == "EVERYTHING":
+            selected = [
+                i.name for i in Path(f"../{kind.capitalize()}").iterdir() if i.is_dir()
+            ]
+        targets += [str(_(Path(kind.capitalize()) / name)) for name in selected or []]
+    return targets
+
+
+def _stale_manifests(clean_list: dict) -> list[Manifest]:
+    """
+    Finds the build manifests of the platforms being cleaned in the parts of the data
+    directory selected in clean_list: those in a MUNGED/<platform> directory under a
+    selected directory (in _BUILD or next to it, where sprites are munged to), or for a
+    full clean every one of them, including those in _LVL_<platform> and those of sides
+    and worlds whose sources are gone altogether
+    :param clean_list: The actions list built from the command-line arguments
+    :return: The manifests
+    """
+    data_dir = Path.cwd().parent
+    platforms = [p.lower() for p in Settings.platforms]
+    output_dirs = [BuildContext(p).output_dir.name.lower() for p in Settings.platforms]
+    targets = [t.lower().replace("\\", "/") for t in _clean_targets(clean_list)]
+    manifests = []
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(WORK_DIR_PREFIX)]
+        if MANIFEST_NAME not in files:
+            continue
+        parts = [p.lower() for p in Path(root).relative_to(data_dir).parts]
+        if parts and parts[0] in output_dirs:
+            selected = clean_list["all"]
+        else:
+            # MUNGED/<platform>, or the override directory of a language,
+            # MUNGED/<platform>_<lang_dir>
+            munged = any(
+                parts[i] == "munged" and parts[i + 1].split("_")[0] in platforms
+                for i in range(len(parts) - 1)
+            )
+            rel = "/".join(
+                parts[1:] if parts[:1] == [Path.cwd().name.lower()] else parts
+            )
+            selected = munged and (
+                clean_list["all"]
+                or any(rel == t or rel.startswith(f"{t}/") for t in targets)
+            )
+        if selected:
+            manifests.append(get_manifest(root))
+    return manifests
+
+
+def clean_stale(clean_list: dict, dry_run: bool = False) -> None:
+    """
+    Removes the munged files and LVLs whose sources have been deleted since they were
+    made, as recorded in the build manifests, leaving everything which is still up to
+    date in place. Outputs which another recorded invocation still produces are kept.
+    The invocations which made the removed files are forgotten, so that they run again
+    next time.
+    :param clean_list: The actions list built from the command-line arguments
+    :param dry_run: (Optional) If True, only lists what would be removed
+    :return: None
+    """
+    logger = logging.getLogger("main")
+    manifests = _stale_manifests(clean_list)
+    with ThreadPoolExecutor(max_workers=Settings.jobs) as pool:
+        found = list(pool.map(lambda m: m.stale_outputs(), manifests))
+
+    stale, live = set(), set()
+    for manifest, stale_outputs in zip(manifests, found):
+        for command in list(manifest.entries):
+            outputs = set(manifest.recorded_outputs(command) or [])
+            stale_here = set(stale_outputs.get(command, []))
+            stale |= stale_here
+            live |= outputs - stale_here
+
+    removed = 0
+    for name in sorted(stale - live):
+        path = Path(name)
+        if path.exists():
+            _remove(path, dry_run)
+            removed += 1
+    if not dry_run:
+        for manifest, stale_outputs in zip(manifests, found):
+            for command in stale_outputs:
+                manifest.forget(command)
+    logger.info(
+        "%d stale file(s) %s, checked %d build manifest(s)",
+        removed,
+        "would be removed" if dry_run else "removed",
+        len(manifests),
+    )
+
+
+def clean(clean_list: dict, stale: bool = False, dry_run: bool = False) -> None:
+    """
+    Cleans the munged files of everything selected in clean_list, with up to
+    Settings.jobs directories being deleted at once
+    :param clean_list: The actions list built from the command-line arguments
+    :param stale: (Optional) If True, only removes outputs whose sources have been
+    deleted, see clean_stale()
+    :param dry_run: (Optional) If True, only lists what would be removed
+    :return: None
+    """
+    logger = logging.getLogger("main")
+
+    if stale:
+        clean_stale(clean_list, dry_run)
+        logger.info("Done cleaning!")
+        return
+
+    steps = [
+        (target, partial(clean_subdir, _(Path(target)), dry_run))
+        for target in _clean_targets(clean_list)
+    ]
+    if clean_list["addme"]:
+        steps.append(("addme", partial(clean_addme, dry_run)))
+    if clean_list["all"]:
+        output_dirs = ", ".join(
+            str(BuildContext(p).output_dir) for p in Settings.platforms
+        )
+        steps.append((output_dirs, partial(clean_outputs, dry_run)))
+
+    def run(name: str, step: Callable[[], None]) -> None:
+        logger.info("Cleaning %s...", name)
+        step()
+
+    with ThreadPoolExecutor(max_workers=Settings.jobs) as pool:
+        for future in [pool.submit(run, name, step) for name, step in steps]:
+            future.result()
+
+    logger.info("Done cleaning!")
@@ -0,0 +1,451 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+from collections import deque
+from contextlib import redirect_stderr
+from pathlib import Path
+from typing import Optional, Union
+
+from xm.build import clean, munge_and_deploy
+from xm.utils.args import build_actions_list, build_parser, option_args, parse_args
+from xm.utils.globals import Settings
+from xm.utils.logs import TOOL_LOGGER
+from xm.utils.tools import path_index
+from xm.utils.trace import tracer
+
+COMMANDS = ["munge", "clean"]
+
+# The actions which name sides or worlds rather than being on or off
+_NAMED_ACTIONS = ["sides", "worlds"]
+
+
+def socket_path(build_dir: Optional[Path] = None) -> Path:
+    """
+    Finds the path of the socket a daemon serving a _BUILD directory listens on. Sockets
+    live in a per-user runtime directory rather than in _BUILD itself since socket paths
+    are limited to about 100 characters.
+    :param build_dir: (Optional) The _BUILD directory, otherwise the current directory
+    :return: The socket path
+    """
+    build_dir = (build_dir or Path.cwd()).resolve()
+    runtime_dir = Path(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir())
+    name = hashlib.sha1(str(build_dir).encode()).hexdigest()[:16]
+    return runtime_dir / f"xmunge-{os.getuid()}" / f"{name}.sock"
+
+
+def _resolve_prefix(prefix: Optional[str]) -> Optional[Path]:
+    return Path(prefix).expanduser().resolve() if prefix else None
+
+
+def _send(conn: socket.socket, message: dict) -> bool:
+    try:
+        conn.sendall((json.dumps(message) + "\n").encode())
+        return True
+    except OSError:
+        return False
+
+
+def normalize_request(command: str, argv: list[str]) -> tuple[tuple, Optional[dict]]:
+    """
+    Splits a request into the options it runs with and the actions it selects, so that
+    requests can be compared regardless of the order of their arguments
+    :param command: "munge" or "clean"
+    :param argv: The command-line arguments of the request
+    :return: A key which is equal for requests with the same command and options, and
+    the actions list, or None if the arguments cannot be parsed, in which case the key
+    is the arguments themselves
+    """
+    try:
+        with redirect_stderr(io.StringIO()):
+            args = build_parser(clean=command == "clean").parse_args(argv)
+    except SystemExit:
+        return (command, tuple(argv)), None
+    options = {
+        name: value
+        for name, value in vars(args).items()
+        if name in option_args and name != "no_daemon"
+    }
+    key = (command, json.dumps(options, sort_keys=True, default=str))
+    return key, build_actions_list(args)
+
+
+def _names(value: Union[str, list[str], None]) -> Union[str, set[str]]:
+    return value if value == "EVERYTHING" else {name.lower() for name in value or []}
+
+
+def covers(actions: dict, other: dict) -> bool:
+    """
+    Checks whether one actions list does everything another one does
+    :param actions: The actions list which may cover the other
+    :param other: The other actions list
+    :return: True if every munger selected in other is also selected in actions
+    """
+    for name, value in other.items():
+        if name in _NAMED_ACTIONS:
+            mine, theirs = _names(actions.get(name)), _names(value)
+            if mine != "EVERYTHING" and (theirs == "EVERYTHING" or theirs - mine):
+                return False
+        elif value and not actions.get(name):
+            return False
+    return True
+
+
+def merge_actions(actions: dict, other: dict) -> dict:
+    """
+    :param actions: An actions list
+    :param other: Another actions list
+    :return: An actions list which selects every munger either of them selects
+    """
+    merged = dict(actions)
+    for name, value in other.items():
+        mine = actions.get(name)
+        if name not in _NAMED_ACTIONS:
+            merged[name] = bool(mine or value)
+        elif "EVERYTHING" in [mine, value]:
+            merged[name] = "EVERYTHING"
+        else:
+            added = [n for n in value or [] if n.lower() not in _names(mine)]
+            merged[name] = (list(mine or []) + added) or None
+    return merged
+
+
+class Job:
+    """
+    A munge or clean request waiting for or being run by the daemon, along with every
+    client waiting for its result
+    """
+
+    def __init__(
+        self,
+        command: str,
+        argv: list[str],
+        key: Optional[tuple] = None,
+        actions: Optional[dict] = None,
+    ):
+        """
+        :param command: "munge" or "clean"
+        :param argv: The command-line arguments of the request
+        :param key: (Optional) The key of the request, see normalize_request()
+        :param actions: (Optional) The actions list of the request, which grows as other
+        requests are merged into it
+        """
+        self.command = command
+        self.argv = argv
+        self.key = key or (command, tuple(argv))
+        self.actions = actions
+        self.clients: list[socket.socket] = []
+        self.started = False
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def attach(self, conn: socket.socket) -> None:
+        with self._lock:
+            self.clients.append(conn)
+
+    def send(self, message: dict) -> None:
+        """
+        Sends a message to every attached client, dropping those which have gone away
+        """
+        with self._lock:
+            self.clients = [c for c in self.clients if _send(c, message)]
+
+    def progress(self, name: str, succeeded: bool, finished: int, total: int) -> None:
+        self.send(
+            {
+                "type": "progress",
+                "task": name,
+                "succeeded": succeeded,
+                "finished": finished,
+                "total": total,
+            }
+        )
+
+
+class _JobLogHandler(logging.Handler):
+    """
+    Streams the records of the main logger to the clients of the running job
+    """
+
+    def __init__(self, job: Job, level: int):
+        super().__init__(level)
+        self.job = job
+        self.setFormatter(
+            logging.Formatter(
+                fmt="%(asctime)s [%(levelname)s]:  %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.job.send({"type": "log", "message": self.format(record)})
+
+
+class BuildServer:
+    """
+    Runs munge and clean requests from munge.py and clean.py clients, one at a time, in
+    a single long-lived process, so that path lookups, build manifests, request graphs
+    and the Wine session stay warm between requests. Requests are compared by their
+    options and the mungers they select: a request which a queued or running request
+    with the same options covers joins it, and one with the same options as a queued
+    request is merged into that request rather than queued again. Every client of a
+    request receives its log, progress and result as they happen.
+
+    Every request runs in the daemon's own WINEPREFIX, the one its wineserver was
+    started for; requests for a different prefix are refused.
+    """
+
+    def __init__(
+        self,
+        gamedata_dir: Path,
+        path: Optional[Path] = None,
+        wine_prefix: Optional[str] = None,
+    ):
+        self.gamedata_dir = gamedata_dir
+        self.path = path or socket_path()
+        self.wine_prefix = wine_prefix
+        self.queue: deque[Job] = deque()
+        self.stopping = False
+        self._cond = threading.Condition()
+
+    def _find_job(self, key: tuple, actions: Optional[dict]) -> Optional[Job]:
+        """
+        Finds a job a request can share: one with the same options which already does
+        everything the request asks for, whether it is running or not, otherwise a
+        queued one with the same options, which is extended to do what the request asks
+        for as well. Must be called with self._cond held.
+        """
+        candidates = [j for j in self.queue if j.key == key]
+        if actions is None:
+            # Unparsed arguments only match the very same arguments
+            return next((j for j in candidates if not j.started), None)
+        for job in candidates:
+            if covers(job.actions, actions):
+                return job
+        for job in candidates:
+            if not job.started:
+                job.actions = merge_actions(job.actions, actions)
+                return job
+        return None
+
+    def submit(self, command: str, argv: list[str], conn: socket.socket) -> Job:
+        """
+        Queues a request, or attaches the client to a job which does what it asks for,
+        see _find_job()
+        :return: The job the client is attached to
+        """
+        key, actions = normalize_request(command, argv)
+        with self._cond:
+            job = self._find_job(key, actions)
+            shared = job is not None
+            if job is None:
+                job = Job(command, argv, key, actions)
+                self.queue.append(job)
+            # Before the client can receive anything from the job, and before the job
+            # can finish, so that "queued" always comes first
+            position = list(self.queue).index(job)
+            _send(conn, {"type": "queued", "position": position, "shared": shared})
+            job.attach(conn)
+            self._cond.notify_all()
+        return job
+
+    def _handle_client(self, conn: socket.socket) -> None:
+        with conn:
+            try:
+                request = json.loads(conn.makefile("r").readline())
+            except (OSError, ValueError):
+                return
+            command = request.get("command")
+            if command == "stop":
+                with self._cond:
+                    self.stopping = True
+                    self._cond.notify_all()
+                _send(conn, {"type": "done", "status": 0, "error": None})
+                return
+            if command not in COMMANDS:
+                _send(
+                    conn,
+                    {
+                        "type": "done",
+                        "status": 2,
+                        "error": f"Unknown command {command}",
+                    },
+                )
+                return
+            job = self.submit(command, list(request.get("argv", [])), conn)
+            job.done.wait()
+
+    def _run(self, job: Job) -> tuple[int, Optional[str]]:
+        logger = logging.getLogger("main")
+        try:
+            args = parse_args(clean=job.command == "clean", argv=job.argv)
+        except SystemExit as err:
+            return int(err.code or 0), "Invalid arguments"
+        except Exception as err:
+            return 2, str(err)
+        requested = _resolve_prefix(getattr(args, "wine_prefix", None))
+        if requested and requested != _resolve_prefix(self.wine_prefix):
+            return 2, (
+                f"The daemon runs tools in the Wine prefix "
+                f"{self.wine_prefix or '(default)'}, not {requested}; stop it or pass "
+                "--no-daemon"
+            )
+        # parse_args() set the client's prefix, which may be none at all
+        Settings.wine_prefix = self.wine_prefix
+
+        handler = _JobLogHandler(
+            job, logging.DEBUG if args.debug_mode else logging.INFO
+        )
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG if args.debug_mode else logging.INFO)
+        logging.getLogger(TOOL_LOGGER).addHandler(handler)
+        try:
+            actions = job.actions or build_actions_list(args)
+            if job.command == "clean":
+                clean(actions, args.stale, args.dry_run)
+                path_index.invalidate()
+                return 0, None
+
+            if args.trace_file:
+                tracer.start(Path(args.trace_file).resolve())
+            try:
+                munge_and_deploy(
+                    actions, self.gamedata_dir, args.no_xbox_copy, job.progress
+                )
+            finally:
+                tracer.save()
+                tracer.path = None
+            return 0, None
+        except Exception as err:
+            logger.error("%s failed: %s", job.command.capitalize(), err)
+            return 1, str(err)
+        finally:
+            logger.removeHandler(handler)
+            logging.getLogger(TOOL_LOGGER).removeHandler(handler)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self.queue and not self.stopping:
+                    self._cond.wait()
+                if not self.queue:
+                    return
+                job = self.queue[0]
+                job.started = True
+            status, error = 1, "The daemon failed to run the request"
+            try:
+                status, error = self._run(job)
+            except Exception as err:
+                logging.getLogger("main").exception(
+                    "%s failed", job.command.capitalize()
+                )
+                error = str(err)
+            finally:
+                with self._cond:
+                    self.queue.popleft()
+                job.send({"type": "done", "status": status, "error": error})
+                job.done.set()
+
+    def serve_forever(self) -> None:
+        """
+        Listens for clients until a stop request arrives, then finishes the queued
+        requests and exits
+        :return: None
+        """
+        logger = logging.getLogger("main")
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self.path.exists():
+            if client_connect(self.path) is not None:
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            self.path.unlink()
+
+        worker = threading.Thread(
+            target=self._worker, name="xmunge-daemon", daemon=True
+        )
+        worker.start()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(str(self.path))
+            server.listen()
+            server.settimeout(0.5)
+            logger.info("Serving %s on %s", Path.cwd(), self.path)
+            try:
+                while not self.stopping:
+                    try:
+                        conn, _ = server.accept()
+                    except socket.timeout:
+                        continue
+                    conn.settimeout(None)
+                    threading.Thread(
+                        target=self._handle_client, args=(conn,), daemon=True
+                    ).start()
+            finally:
+                self.path.unlink(missing_ok=True)
+                with self._cond:
+                    self.stopping = True
+                    self._cond.notify_all()
+        worker.join()
+        logger.info("Daemon stopped")
+
+
+def client_connect(path: Optional[Path] = None) -> Optional[socket.socket]:
+    """
+    Connects to the daemon serving the current _BUILD directory
+    :param path: (Optional) The socket path, otherwise the one for the current directory
+    :return: The connected socket, or None if no daemon is running
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = path or socket_path()
+    if not path.exists():
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+
+def run_remote(command: str, argv: list[str]) -> Optional[int]:
+    """
+    Asks the daemon to run a munge or clean request and prints its log and progress as
+    it arrives
+    :param command: "munge", "clean" or "stop"
+    :param argv: The command-line arguments of the request
+    :return: The exit status of the request, or None if no daemon is running and the
+    request should run in-process
+    """
+    conn = client_connect()
+    if conn is None:
+        return None
+    with conn:
+        _send(conn, {"command": command, "argv": argv})
+        for line in conn.makefile("r"):
+            message = json.loads(line)
+            kind = message["type"]
+            if kind == "log":
+                print(message["message"], file=sys.stderr)
+            elif kind == "queued" and message["position"] > 0:
+                print(
+                    f"Waiting for {message['position']} request(s) ahead of this one"
+                    + (" (sharing an identical request)" if message["shared"] else ""),
+                    file=sys.stderr,
+                )
+            elif kind == "progress":
+                print(
+                    f"[{message['finished']}/{message['total']}] {message['task']}"
+                    + ("" if message["succeeded"] else " FAILED"),
+                    file=sys.stderr,
+                )
+            elif kind == "done":
+                if message["error"]:
+                    print(message["error"], file=sys.stderr)
+                return message["status"]
+    # The daemon went away mid-request
+    return 1
@@ -5,3 +5,4 @@ from .shell import ShellMunger
 from .side import SideMunger
 from .sound import SoundMunger
 from .world import WorldMunger
+from .pipeline import schedule_builds, schedule_mungers
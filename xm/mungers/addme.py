@@ -1,8 +1,6 @@
 import logging
-from shutil import copy
 
-from xm.utils.globals import Settings
-from xm.utils.tools import mkdir_p, munge
+from xm.utils.tools import copy_munged, mkdir_p, munge
 from .base import BaseMunger
 
 
@@ -21,7 +19,8 @@ class AddmeMunger(BaseMunger):
         addme_output_dir = self.source_dir / "munged"
 
         mkdir_p(addme_output_dir)
+        mkdir_p(self.build.output_dir)
 
         munge("Script", "addme.lua", self.source_dir, addme_output_dir)
 
-        copy(addme_output_dir / "addme.script", Settings.output_dir)
+        copy_munged(addme_output_dir / "addme.script", self.build.output_dir)
@@ -2,10 +2,78 @@ import logging
 from abc import ABC, abstractmethod
 from pathlib import Path
 from shutil import copy, copytree
+from typing import Callable, Iterable
 
+from xm.utils.globals import BuildContext
+from xm.utils.scheduler import Scheduler
 from xm.utils.tools import get_dir_no_case as _
 
 
+def _patterns_overlap(a: str, b: str) -> bool:
+    """
+    Checks whether two patterns may match the same path. This errs on the side of
+    overlapping: patterns are only told apart by their literal text before the first
+    wildcard and after the last one, so that e.g. out/*.class and out/*.model are
+    disjoint, but out/a* and out/*b are not.
+    :param a: A pattern, see MungeStep
+    :param b: Another pattern
+    :return: False if no path can match both patterns, True otherwise
+    """
+    a, b = (p.lower().replace("\\", "/") for p in (a, b))
+    prefixes, suffixes = [], []
+    for pattern in (a, b):
+        first = min((i for i, c in enumerate(pattern) if c in "*?["), default=None)
+        if first is None:
+            prefixes.append(pattern)
+            suffixes.append(pattern)
+            continue
+        last = max(i for i, c in enumerate(pattern) if c in "*?]")
+        prefixes.append(pattern[:first])
+        suffixes.append(pattern[last + 1 :])
+    return (
+        prefixes[0].startswith(prefixes[1]) or prefixes[1].startswith(prefixes[0])
+    ) and (suffixes[0].endswith(suffixes[1]) or suffixes[1].endswith(suffixes[0]))
+
+
+class MungeStep:
+    """
+    One tool call of a munger, along with glob patterns for the files it reads and
+    writes. Patterns are paths relative to _BUILD in which * also matches across
+    directories, e.g. ../Worlds/ABC/*.odf for "$*.odf".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], object],
+        reads: Iterable[str] = (),
+        writes: Iterable[str] = (),
+    ):
+        self.name = name
+        self.func = func
+        self.reads = [str(r) for r in reads]
+        self.writes = [str(w) for w in writes]
+
+    def must_follow(self, other: "MungeStep") -> bool:
+        """
+        Checks whether this step has to wait for an earlier step, because it reads what
+        the earlier step writes or writes what the earlier step reads or writes
+        """
+        return any(
+            _patterns_overlap(a, b)
+            for mine, theirs in [
+                (self.reads, other.writes),
+                (self.writes, other.reads),
+                (self.writes, other.writes),
+            ]
+            for a in mine
+            for b in theirs
+        )
+
+    def __repr__(self):
+        return f"MungeStep({self.name!r})"
+
+
 class BaseMunger(ABC):
     """
     Abstract base class for all other mungers. Intended to handle common properties such as platform and language,
@@ -13,7 +81,9 @@ class BaseMunger(ABC):
     """
 
     def __init__(self, source_subdir: str, platform: str = "PC"):
+        self.name: str = source_subdir
         self.platform: str = platform
+        self.build = BuildContext(platform)
         self.source_dir = _(Path("..") / source_subdir)
         self.munge_dir = _(Path(source_subdir) / "MUNGED" / platform)
 
@@ -21,6 +91,45 @@ class BaseMunger(ABC):
     def run(self, **kwargs):
         raise NotImplementedError
 
+    def schedule(self, scheduler: Scheduler, deps: Iterable[str] = (), **kwargs) -> str:
+        """
+        Adds this munger to a build graph as a single task which calls run()
+        :param scheduler: The Scheduler to add the task(s) to
+        :param deps: (Optional) Names of the tasks that must finish before this munger
+        may start
+        :param kwargs: (Optional) Keyword arguments to forward to run()
+        :return: The name of the task which finishes this munger
+        """
+        scheduler.add(self.name, lambda: self.run(**kwargs), deps)
+        return self.name
+
+    def _schedule_steps(
+        self,
+        scheduler: Scheduler,
+        name: str,
+        steps: list[MungeStep],
+        deps: Iterable[str] = (),
+    ) -> str:
+        """
+        Adds a task for each step, depending only on the earlier steps it must follow,
+        so that steps which touch different files run at the same time, plus a task
+        named name which finishes once every step has
+        :param scheduler: The Scheduler to add the tasks to
+        :param name: The name of the task which finishes the steps
+        :param steps: The steps, in the order they would run one at a time
+        :param deps: (Optional) Names of the tasks that must finish before any step may
+        start
+        :return: name
+        """
+        task_names = []
+        for i, step in enumerate(steps):
+            task_name = f"{name}:{step.name}"
+            step_deps = [task_names[j] for j in range(i) if step.must_follow(steps[j])]
+            scheduler.add(task_name, step.func, [*deps, *step_deps])
+            task_names.append(task_name)
+        scheduler.add(name, lambda: None, [*deps, *task_names])
+        return name
+
     def _copy_premunged_files(self):
         pre_munged_dir = _(self.source_dir / "munged")
         if not pre_munged_dir.exists():
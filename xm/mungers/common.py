@@ -1,97 +1,339 @@
+import hashlib
+import json
 import logging
+import os
+from functools import partial
 from glob import iglob
 from pathlib import Path
-from shutil import rmtree
+from shutil import copyfile
+from threading import Lock
+from typing import Iterable, Optional
 
-from xm.utils.globals import Settings
-from xm.utils.tools import level_pack, mkdir_p, munge, soundfl_munge
+from xm.utils.cache import find_munge_outputs
+from xm.utils.globals import Language, Settings
+from xm.utils.scheduler import Scheduler
+from xm.utils.tools import (
+    level_pack,
+    mkdir_p,
+    munge,
+    munge_batch,
+    soundfl_munge,
+)
 from xm.utils.tools import get_dir_no_case as _
 from .base import BaseMunger
 
 
 class CommonMunger(BaseMunger):
     """
-    Handles munging of common data.
+    Handles munging of common data. Every language other than English additionally gets
+    its localization merged and munged to its override directory,
+    Common/MUNGED/<platform>_<lang_dir>, with the files in
+    Common/Localize/<platform>_<lang_dir> taking precedence, and its core.lvl packed
+    from there to _LVL_<platform>/<platform>_<lang_dir>; everything else is munged once
+    for all languages.
     """
 
     munge_temp_name = "MungeTemp"
+    localize_state_name = ".merged.json"
 
-    sprite_sides = ["ALL", "CIS", "IMP", "REP"]
-
-    sprites_list = [
-        "all_sprite_soldier_snow",
-        "all_sprite_pilot",
-        "all_sprite_soldier",
-        "all_sprite_soldierjungle",
-        "cis_sprite_bdroid",
-        "cis_sprite_sbdroid",
-        "cis_sprite_droideka",
-        "imp_sprite_officer",
-        "imp_sprite_tiepilot",
-        "imp_sprite_stormtroopersnow",
-        "imp_sprite_stormtrooper",
-        "imp_sprite_atatpilot",
-        "imp_sprite_scout",
-        "rep_sprite_trooper",
-    ]
-
-    def __init__(self, platform="PC"):
+    # Localization tables are streamed through memory in chunks of this size while they
+    # are merged
+    merge_chunk_size = 1024 * 1024
+
+    # The merged localization files made in this process, by the paths, sizes and
+    # modification times of the files they were merged from, along with their own size,
+    # modification time and digest, so that platforms which merge the same files copy
+    # the merged file of the first one instead of merging them again
+    _merged: dict[tuple, tuple[Path, int, int, str]] = {}
+    _merged_lock = Lock()
+
+    def __init__(self, platform="PC", languages: Iterable[str] = ()):
         super().__init__("Common", platform)
+        self.languages = [
+            Language(name) for name in languages if not Language(name).is_default
+        ]
+        # The tasks which munge the sprites of each side, by side name, once scheduled
+        self.sprite_tasks: dict[str, str] = {}
 
-    def _munge_sprites(self):
-        sprite_source_dir_base = self.source_dir.parent / "Sides"
-        for side_name in self.sprite_sides:
-            side_dir = _(sprite_source_dir_base / side_name / "MUNGED" / self.platform)
-            mkdir_p(side_dir)
-
-        for sprite_name in self.sprites_list:
-            sprite_side = sprite_name.split("_")[0].upper()
-            sprite_output_dir = _(
-                sprite_source_dir_base / sprite_side / "MUNGED" / self.platform
-            )
-            mkdir_p(sprite_output_dir)
-            munge(
-                "Texture",
-                f"sprites/{sprite_name}/output/packed/*.tga",
-                self.source_dir,
-                sprite_output_dir,
-                sprite=True,
+    def schedule(self, scheduler: Scheduler, deps: Iterable[str] = (), **kwargs) -> str:
+        """
+        Adds Common to a build graph as a task which calls run(), plus a task for each
+        side with sprites which munges them into the side's munge directory (see
+        sprite_tasks), and a task for each language other than English which munges the
+        language's localization and packs its core.lvl once the rest of Common has been
+        munged
+        :param scheduler: The Scheduler to add the tasks to
+        :param deps: (Optional) Names of the tasks that must finish before Common may
+        start
+        :param kwargs: (Optional) Keyword arguments to forward to run()
+        :return: The name of the task which finishes Common itself
+        """
+        sprites = kwargs.pop("sprites", True)
+        name = super().schedule(scheduler, deps, sprites=False, **kwargs)
+        if sprites:
+            for side, sprite_names in self._find_sprites().items():
+                task_name = f"{name}:sprites:{side}"
+                scheduler.add(
+                    task_name, partial(self.munge_sprites, side, sprite_names), deps
+                )
+                self.sprite_tasks[side] = task_name
+        for language in self.languages:
+            scheduler.add(
+                f"{name}:{language.name.lower()}",
+                partial(self.munge_language, language),
+                [name],
             )
+        return name
+
+    def _find_sprites(self) -> dict[str, list[str]]:
+        """
+        Finds every sprite set with packed textures in
+        Common/sprites/<sprite>/output/packed, grouped by the side they are munged into,
+        which is the part of the sprite's name before the first underscore. Sprites of
+        sides which do not exist in Sides are skipped.
+        :return: A dict of side name to the sorted names of its sprites
+        """
+        sprites_dir = _(self.source_dir / "sprites")
+        if not sprites_dir.is_dir():
+            return {}
+        sides_dir = _(self.source_dir.parent / "Sides")
+        sides = {}
+        for entry in os.scandir(sprites_dir):
+            if entry.is_dir() and _(Path(entry.path) / "output" / "packed").is_dir():
+                sides.setdefault(entry.name.split("_")[0].upper(), []).append(
+                    entry.name
+                )
+        found = {}
+        for side, names in sorted(sides.items()):
+            if not _(sides_dir / side).is_dir():
+                logging.getLogger("main").warning(
+                    "No side %s in %s, skipping sprites %s",
+                    side,
+                    sides_dir,
+                    ", ".join(sorted(names)),
+                )
+                continue
+            found[side] = sorted(names)
+        return found
+
+    def munge_sprites(self, side: str, sprite_names: list[str]) -> None:
+        """
+        Munges the packed textures of a side's sprites into the side's munge directory,
+        next to the side's sources
+        :param side: The side's name, see _find_sprites()
+        :param sprite_names: The names of the side's sprites
+        :return: None
+        """
+        sprite_output_dir = _(
+            self.source_dir.parent / "Sides" / side / "MUNGED" / self.platform
+        )
+        mkdir_p(sprite_output_dir)
+        munge(
+            "Texture",
+            [f"sprites/{s}/output/packed/*.tga" for s in sprite_names],
+            self.source_dir,
+            sprite_output_dir,
+            sprite=True,
+        )
+
+    def _munge_sprites(self):
+        # One munge per side, run alongside each other; a side whose sprites are
+        # unchanged is skipped by the manifest
+        with munge_batch(jobs=Settings.jobs):
+            for side_name, sprite_names in self._find_sprites().items():
+                self.munge_sprites(side_name, sprite_names)
 
     def _munge_fpm(self):
         fpm_source_dir = self.source_dir / "req" / "fpm"
-        fpm_output_dir = Settings.output_dir / "FPM" / "COM"
+        fpm_output_dir = self.build.output_dir / "FPM" / "COM"
         mkdir_p(fpm_output_dir)
         common_files = [
             f"Common/MUNGED/{self.platform}/{f}" for f in ["core", "common", "ingame"]
         ]
         level_pack("*.req", fpm_source_dir, fpm_output_dir, common=common_files)
 
-    def _merge_localize_files(self) -> None:
+    def _language_munge_dir(self, language: Optional[Language]) -> Path:
         """
-        Helper method for iterating through each language of localization files and concatenating the contents of
-        those with identical (case-insensitive) names
-        :return: None
+        :param language: (Optional) A language other than English
+        :return: The directory the language's localization is munged to, or the munge
+        directory without a language
+        """
+        if language is None:
+            return self.munge_dir
+        return _(self.munge_dir.parent / language.override_path(self.platform))
+
+    def _localize_sources(
+        self, language: Optional[Language] = None
+    ) -> dict[str, list[Path]]:
+        """
+        Groups the localization files by (case-insensitive) name, with the
+        platform-specific files first. For a language, only the files it overrides are
+        included, with its override files first; LevelPack finds the rest where they
+        were munged without a language.
+        :param language: (Optional) A language other than English
+        :return: A dict of lower-case file name to the files to merge into it, in order
+        """
+        localize_path = _(self.source_dir / "Localize")
+        directories = [_(localize_path / self.platform), localize_path]
+        if language is not None:
+            directories.insert(
+                0, _(localize_path / language.override_path(self.platform))
+            )
+        sources = {}
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+                if entry.is_file() and entry.name.lower().endswith(".cfg"):
+                    sources.setdefault(entry.name.lower(), []).append(Path(entry.path))
+        if language is not None:
+            overrides = directories[0]
+            sources = {
+                name: files
+                for name, files in sources.items()
+                if files[0].parent == overrides
+            }
+        return sources
+
+    def _merge_localize_files(
+        self, munge_dir: Path, sources: dict[str, list[Path]]
+    ) -> tuple[list[str], dict]:
+        """
+        Concatenates the localization files with identical (case-insensitive) names, one
+        merged file per language, into a staging directory which is kept between munges.
+        Files are streamed in chunks and a merged file is only replaced when its
+        contents change, so unchanged languages keep their timestamps and are not munged
+        again.
+        :param munge_dir: The directory the merged files are munged to, which keeps the
+        staging directory
+        :param sources: The files to merge, see _localize_sources()
+        :return: The names of the merged files which need to be munged, and the merge
+        state to update once they are
         """
-        munge_temp = Path(self.munge_temp_name)
-        localize_path = self.source_dir / "Localize"
-        localize_platform_path = localize_path / self.platform
         logger = logging.getLogger("main")
         logger.info("Merge localization files...")
-        mkdir_p(munge_temp)
-        for item in list(localize_platform_path.iterdir()) + list(
-            localize_path.iterdir()
-        ):
-            if not item.is_file():
-                continue
-            if not item.suffix == ".cfg":
-                continue
-            contents = ""
-            with open(item, "r") as source_file:
-                contents = source_file.read()
-            with open(munge_temp / item.name.lower(), "a") as merged_file:
-                merged_file.write(contents)
-                logger.info("Merged %s", item.name)
+        staging_dir = munge_dir / self.munge_temp_name
+        mkdir_p(staging_dir)
+        state_path = staging_dir / self.localize_state_name
+        try:
+            with open(state_path, "r") as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            state = {}
+
+        for name in set(state) - set(sources):
+            # The language no longer exists, or is no longer overridden
+            for output in find_munge_outputs(munge_dir, [staging_dir / name]):
+                output.unlink()
+            (staging_dir / name).unlink(missing_ok=True)
+            del state[name]
+
+        to_munge = []
+        for name, files in sources.items():
+            merged = staging_dir / name
+            entry = state.get(name, {})
+            stamps = [[str(f), f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+            if entry.get("sources") != stamps or not merged.exists():
+                temp = staging_dir / f".{name}.{os.getpid()}.tmp"
+                key = tuple(tuple(stamp) for stamp in stamps)
+                digest = self._merge(files, key, temp)
+                if digest != entry.get("digest") or not merged.exists():
+                    os.replace(temp, merged)
+                    logger.info("Merged %s", ", ".join(str(f) for f in files))
+                else:
+                    temp.unlink()
+                stat = merged.stat()
+                with self._merged_lock:
+                    self._merged[key] = (merged, stat.st_size, stat.st_mtime_ns, digest)
+                entry = dict(entry, sources=stamps, digest=digest)
+                state[name] = entry
+            if entry.get("munged") != entry["digest"] or not find_munge_outputs(
+                munge_dir, [merged]
+            ):
+                to_munge.append(name)
+
+        self._save_localize_state(state_path, state)
+        return to_munge, state
+
+    def _merge(self, files: list[Path], key: tuple, temp: Path) -> str:
+        """
+        Concatenates localization files into a temporary file, or copies the merged file
+        another platform already made from the same files if it is unchanged
+        :param files: The files to merge, in order
+        :param key: The paths, sizes and modification times of the files
+        :param temp: The file to write
+        :return: The digest of the merged contents
+        """
+        with self._merged_lock:
+            shared = self._merged.get(key)
+        if shared is not None:
+            path, size, mtime_ns, digest = shared
+            try:
+                stat = path.stat()
+                if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                    copyfile(path, temp)
+                    return digest
+            except FileNotFoundError:
+                pass
+
+        digest = hashlib.sha256()
+        with open(temp, "wb") as merged_file:
+            for source in files:
+                with open(source, "rb") as source_file:
+                    for chunk in iter(
+                        lambda: source_file.read(self.merge_chunk_size), b""
+                    ):
+                        digest.update(chunk)
+                        merged_file.write(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _save_localize_state(state_path: Path, state: dict) -> None:
+        temp = state_path.with_name(f"{state_path.name}.{os.getpid()}.tmp")
+        with open(temp, "w") as state_file:
+            json.dump(state, state_file, indent=1)
+        os.replace(temp, state_path)
+
+    def _munge_localize(self, language: Optional[Language] = None) -> None:
+        """
+        Merges the localization files and munges the languages whose merged contents
+        changed
+        :param language: (Optional) A language other than English, to munge with its
+        override files to its override directory
+        :return: None
+        """
+        munge_dir = self._language_munge_dir(language)
+        to_munge, state = self._merge_localize_files(
+            munge_dir, self._localize_sources(language)
+        )
+        if not to_munge:
+            return
+        staging_dir = munge_dir / self.munge_temp_name
+        result = munge("Localize", sorted(to_munge), staging_dir, munge_dir)
+        if result is not None and result.succeeded and not result.planned:
+            for name in to_munge:
+                state[name]["munged"] = state[name]["digest"]
+            self._save_localize_state(staging_dir / self.localize_state_name, state)
+
+    def munge_language(self, language: Language) -> None:
+        """
+        Munges the localization of a language other than English to its override
+        directory and packs its core.lvl, which is where the game loads localization
+        from, against it and the rest of Common
+        :param language: The language
+        :return: None
+        """
+        logger = logging.getLogger("main")
+        logger.info("Munge Common for %s...", language.name)
+
+        override = language.override_path(self.platform)
+        munge_dir = self._language_munge_dir(language)
+        output_dir = self.build.output_dir / override
+        mkdir_p(munge_dir)
+        mkdir_p(output_dir)
+
+        self._munge_localize(language)
+        level_pack("core.req", self.source_dir, output_dir, [munge_dir, self.munge_dir])
 
     def run(
         self,
@@ -103,29 +345,33 @@ class CommonMunger(BaseMunger):
         logger = logging.getLogger("main")
         logger.info("Munge Common...")
 
-        mkdir_p(Settings.output_dir)
+        mkdir_p(self.build.output_dir)
         mkdir_p(self.munge_dir)
         self._copy_premunged_files()
 
-        munge("Odf", "$*.odf", self.source_dir, self.munge_dir)
-        munge("Config", "$*.fx", self.source_dir, self.munge_dir)
-        munge("Config", "$*.combo", self.source_dir, self.munge_dir)
-        munge("Script", "$*.lua", self.source_dir, self.munge_dir)
-        munge("Config", "$*.mcfg", self.source_dir, self.munge_dir)
-        munge("Config", "$*.sanm", self.source_dir, self.munge_dir)
-        munge("Config", "$*.hud", self.source_dir, self.munge_dir)
-        munge("Font", "$*.fff", self.source_dir, self.munge_dir)
-        munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
-        munge(
-            "Model", ["$effects/*.msh", "$MSHs/*.msh"], self.source_dir, self.munge_dir
-        )
-        if shaders is True and self.platform != "PS2":
+        with munge_batch():
+            munge("Odf", "$*.odf", self.source_dir, self.munge_dir)
+            munge("Config", "$*.fx", self.source_dir, self.munge_dir)
+            munge("Config", "$*.combo", self.source_dir, self.munge_dir)
+            munge("Script", "$*.lua", self.source_dir, self.munge_dir)
+            munge("Config", "$*.mcfg", self.source_dir, self.munge_dir)
+            munge("Config", "$*.sanm", self.source_dir, self.munge_dir)
+            munge("Config", "$*.hud", self.source_dir, self.munge_dir)
+            munge("Font", "$*.fff", self.source_dir, self.munge_dir)
+            munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
             munge(
-                "Shader",
-                ["shaders/*.xml", "shaders/*.vsfrag"],
+                "Model",
+                ["$effects/*.msh", "$MSHs/*.msh"],
                 self.source_dir,
                 self.munge_dir,
             )
+            if shaders is True and self.platform != "PS2":
+                munge(
+                    "Shader",
+                    ["shaders/*.xml", "shaders/*.vsfrag"],
+                    self.source_dir,
+                    self.munge_dir,
+                )
 
         common_sound_path = _(self.source_dir / "Sound")
         munge(
@@ -146,14 +392,12 @@ class CommonMunger(BaseMunger):
             self._munge_sprites()
 
         if localize:
-            self._merge_localize_files()
-            munge("Localize", "*.cfg", self.munge_temp_name, self.munge_dir)
-            rmtree(self.munge_temp_name)
+            self._munge_localize()
 
         level_pack(
             "core.req",
             self.source_dir,
-            Settings.output_dir,
+            self.build.output_dir,
             self.munge_dir,
             write_files=[
                 "core",
@@ -162,7 +406,7 @@ class CommonMunger(BaseMunger):
         level_pack(
             "common.req",
             self.source_dir,
-            Settings.output_dir,
+            self.build.output_dir,
             self.munge_dir,
             common=[
                 "core",
@@ -174,7 +418,7 @@ class CommonMunger(BaseMunger):
         level_pack(
             "ingame.req",
             self.source_dir,
-            Settings.output_dir,
+            self.build.output_dir,
             self.munge_dir,
             common=["core", "common"],
             write_files=[
@@ -184,7 +428,7 @@ class CommonMunger(BaseMunger):
         level_pack(
             "inshell.req",
             self.source_dir,
-            Settings.output_dir,
+            self.build.output_dir,
             self.munge_dir,
             common=["core", "common"],
             write_files=[
@@ -201,7 +445,7 @@ class CommonMunger(BaseMunger):
         level_pack(
             "mission.req",
             self.source_dir,
-            Settings.output_dir,
+            self.build.output_dir,
             self.munge_dir,
         )
 
@@ -1,9 +1,9 @@
 import logging
-from glob import iglob
+import os
 from os import remove
-from shutil import rmtree
+from pathlib import Path
 
-from xm.utils.globals import Settings
+from xm.utils.cache import find_inputs
 from xm.utils.tools import level_pack, mkdir_p, munge
 from xm.utils.tools import get_dir_no_case as _
 from .base import BaseMunger
@@ -16,9 +16,11 @@ class LoadMunger(BaseMunger):
 
     temp_name = "__TEMP__"
 
+    image_extensions = (".tga", ".pic")
+
     def __init__(self, platform="PC"):
         super().__init__("Load", platform)
-        self.output_dir = Settings.output_dir / "Load"
+        self.output_dir = self.build.output_dir / "Load"
 
     def run(self):
         logger = logging.getLogger("main")
@@ -38,9 +40,6 @@ class LoadMunger(BaseMunger):
         munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
         munge("Model", "$*.msh", self.source_dir, self.munge_dir)
 
-        req_temp_dir = self.source_dir / self.temp_name
-        mkdir_p(req_temp_dir)
-
         backdrop_dir = self.source_dir / "backdrops"
 
         if not backdrop_dir.exists():
@@ -49,53 +48,121 @@ class LoadMunger(BaseMunger):
             )
             return
 
-        all_files = []
-        for backdrop in backdrop_dir.iterdir():
-            if not backdrop.is_dir():
-                continue
-            tga_files = list(backdrop.glob("*.tga"))
-            tga_files += list(backdrop.glob(f"{self.platform}/*.tga"))
-            pic_files = list(backdrop.glob("*.pic"))
-            pic_files += list(backdrop.glob(f"{self.platform}/*.pic"))
-            all_files = tga_files + pic_files
-            for file in all_files:
-                with open(req_temp_dir / f"{file.stem}.req", "w") as req_file:
-                    req_file.write(f'ucft{{ REQN {{ "texture" "{file.stem}" }} }}')
+        backdrops = self._find_backdrops(backdrop_dir)
+
+        # Each backdrop image is packed into its own LVL, then each backdrop's images
+        # are packed together. The request files are kept between munges and only
+        # rewritten when their contents change, so that LevelPack only runs for the
+        # images and backdrops which actually changed.
+        texture_req_dir = self.source_dir / self.temp_name / "textures"
+        backdrop_req_dir = self.source_dir / self.temp_name / "backdrops"
+        mkdir_p(texture_req_dir)
+        mkdir_p(backdrop_req_dir)
+
+        images = sorted({i for stems in backdrops.values() for i in stems})
+        _write_reqs(
+            texture_req_dir,
+            {i: f'ucft{{ REQN {{ "texture" "{i}" }} }}' for i in images},
+        )
+        _write_reqs(
+            backdrop_req_dir,
+            {
+                name: 'ucft{ REQN { "lvl"\n'
+                + "".join(f'"{i}"\n' for i in stems)
+                + "} }"
+                for name, stems in backdrops.items()
+            },
+        )
 
         level_pack(
             "$*.req",
-            req_temp_dir,
+            texture_req_dir,
             self.munge_dir,
             self.munge_dir,
             common=[
-                f"Common/MUNGED/{self.platform}/core.files",
+                f"Common/MUNGED/{self.platform}/core",
             ],
         )
 
-        for item in iglob(f"{req_temp_dir}/*.*"):
-            remove(item)
-
-        for backdrop in backdrop_dir.iterdir():
-            if not backdrop.is_dir():
-                continue
-            with open(req_temp_dir / f"{backdrop.name}.req", "w") as req_file:
-                req_file.write(f'ucft{{ REQN {{ "lvl"\n')
-                for file in all_files:
-                    req_file.write(f'"{file.stem}"\n')
-                req_file.write(f"}} }}")
-
         mkdir_p(_(self.output_dir))
 
-        # NOTE: If this isn't working I think it's because the input_dir should be the temp dir
         level_pack(
             "$*.req",
-            self.source_dir,
+            backdrop_req_dir,
             self.output_dir,
             self.munge_dir,
             common=[
-                f"Common/MUNGED/{self.platform}/core.files",
+                f"Common/MUNGED/{self.platform}/core",
             ],
         )
 
-        rmtree(req_temp_dir)
-        remove(req_temp_dir)
+        # Request files of Load's own, outside the generated ones, are packed as well
+        own_reqs = [
+            req.relative_to(self.source_dir).as_posix()
+            for req in find_inputs("$*.req", self.source_dir)
+            if self.temp_name.lower()
+            not in (p.lower() for p in req.relative_to(self.source_dir).parts)
+        ]
+        if own_reqs:
+            level_pack(
+                own_reqs,
+                self.source_dir,
+                self.output_dir,
+                self.munge_dir,
+                common=[
+                    f"Common/MUNGED/{self.platform}/core",
+                ],
+            )
+
+    def _find_backdrops(self, backdrop_dir: Path) -> dict[str, list[str]]:
+        """
+        Lists the images of every backdrop in a single pass over backdrops/, taking both
+        the images directly in each backdrop and those in its subdirectory for the
+        current platform
+        :param backdrop_dir: The Load/backdrops directory
+        :return: A dict of backdrop name to the sorted names of its images, without
+        extensions
+        """
+        backdrops = {}
+        for backdrop in os.scandir(backdrop_dir):
+            if not backdrop.is_dir():
+                continue
+            stems = set()
+            for entry in os.scandir(backdrop.path):
+                if entry.is_dir() and entry.name.lower() == self.platform.lower():
+                    stems.update(
+                        Path(e.name).stem
+                        for e in os.scandir(entry.path)
+                        if e.is_file()
+                        and e.name.lower().endswith(self.image_extensions)
+                    )
+                elif entry.is_file() and entry.name.lower().endswith(
+                    self.image_extensions
+                ):
+                    stems.add(Path(entry.name).stem)
+            backdrops[backdrop.name] = sorted(stems)
+        return backdrops
+
+
+def _write_reqs(req_dir: Path, contents: dict[str, str]) -> None:
+    """
+    Brings a directory of generated request files up to date, writing only the files
+    whose contents differ from what is on disk and deleting request files which are no
+    longer wanted
+    :param req_dir: The directory holding the request files
+    :param contents: A dict of request file name, without extension, to its contents
+    :return: None
+    """
+    logger = logging.getLogger("main")
+    existing = {e.name: e.path for e in os.scandir(req_dir) if e.name.endswith(".req")}
+    for name, text in contents.items():
+        path = existing.pop(f"{name}.req", None)
+        if path is not None:
+            with open(path, "r") as req_file:
+                if req_file.read() == text:
+                    continue
+        with open(req_dir / f"{name}.req", "w") as req_file:
+            req_file.write(text)
+        logger.debug("Wrote %s", req_dir / f"{name}.req")
+    for path in existing.values():
+        remove(path)
@@ -0,0 +1,206 @@
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from xm.utils.globals import BuildContext, building
+from xm.utils.scheduler import Scheduler, Task
+from xm.utils.tools import get_dir_no_case as _
+from .addme import AddmeMunger
+from .common import CommonMunger
+from .load import LoadMunger
+from .shell import ShellMunger
+from .side import SideMunger
+from .sound import SoundMunger
+from .world import WorldMunger
+
+
+def _list_subdirs(parent: str) -> list[str]:
+    """
+    Lists the names of the directories in _BUILD/../<parent>
+    :param parent: Either "Sides" or "Worlds"
+    :return: A list of directory names
+    """
+    parent_dir = _(Path("..") / parent)
+    if not parent_dir.exists():
+        return []
+    return [i.name for i in parent_dir.iterdir() if i.is_dir()]
+
+
+def _common_is_munged(platform: str) -> bool:
+    """
+    Checks whether Common has been packed, i.e. whether the .files lists used by every
+    other LevelPack call exist
+    :param platform: The platform being munged
+    :return: True if Common/MUNGED/<platform>/core|common|ingame.files all exist, False
+    otherwise
+    """
+    common_munge_dir = _(Path("Common") / "MUNGED" / platform)
+    return all(
+        (common_munge_dir / f"{f}.files").exists() for f in ["core", "common", "ingame"]
+    )
+
+
+def _subdir_common_is_munged(parent: str, platform: str) -> bool:
+    """
+    Checks whether <parent>/Common has been munged, or whether there is nothing to munge
+    :param parent: Either "Sides" or "Worlds"
+    :param platform: The platform being munged
+    :return: True if the munge directory for <parent>/Common is non-empty or there is no
+    <parent>/Common source
+    """
+    if not _(Path("..") / parent / "Common").exists():
+        return True
+    munge_dir = _(Path(parent) / "Common" / "MUNGED" / platform)
+    return munge_dir.exists() and any(munge_dir.iterdir())
+
+
+class _PlatformTasks:
+    """
+    Stands in for a Scheduler while the mungers of one platform add their tasks to it,
+    running each task under the platform's BuildContext and, when several platforms
+    share the scheduler, prefixing task names with the platform (e.g.
+    PS2/Sides/ABC:munge) so that the tasks of different platforms are told apart
+    """
+
+    def __init__(self, scheduler: Scheduler, build: BuildContext, prefixed: bool):
+        self.scheduler = scheduler
+        self.build = build
+        self.prefix = f"{build.platform}/" if prefixed else ""
+
+    def __contains__(self, name: str) -> bool:
+        return f"{self.prefix}{name}" in self.scheduler
+
+    def add(
+        self, name: str, func: Callable[[], None], deps: Iterable[str] = ()
+    ) -> Task:
+        def run() -> None:
+            with building(self.build):
+                func()
+
+        return self.scheduler.add(
+            f"{self.prefix}{name}", run, [f"{self.prefix}{d}" for d in deps]
+        )
+
+
+def _find_common(names: list[str]) -> Optional[str]:
+    for name in names:
+        if name.lower() == "common":
+            return name
+    return None
+
+
+def schedule_mungers(
+    scheduler: Scheduler, munge_list: dict, platform: str, languages: Iterable[str] = ()
+) -> None:
+    """
+    Adds a task for every munger selected in munge_list to the scheduler, along with the
+    dependencies between them. Common is scheduled automatically, even if it was not
+    requested, when something that packs against it is requested and
+    Common/MUNGED/<platform> has not been packed yet; the same goes for Sides/Common and
+    Worlds/Common.
+    :param scheduler: The Scheduler to add tasks to
+    :param munge_list: The actions list built from the command-line arguments
+    :param platform: The platform being munged
+    :param languages: (Optional) The languages being munged, see CommonMunger
+    :return: None
+    """
+    logger = logging.getLogger("main")
+
+    sides_to_munge = munge_list["sides"] or []
+    if sides_to_munge == "EVERYTHING":
+        sides_to_munge = _list_subdirs("Sides")
+    worlds_to_munge = munge_list["worlds"] or []
+    if worlds_to_munge == "EVERYTHING":
+        worlds_to_munge = _list_subdirs("Worlds")
+
+    needs_common = (
+        munge_list["shell"] or munge_list["load"] or sides_to_munge or worlds_to_munge
+    )
+    munge_common = munge_list["common"]
+    if not munge_common and needs_common and not _common_is_munged(platform):
+        logger.info("Common has not been munged yet, munging it first")
+        munge_common = True
+
+    common_deps = []
+    sprite_tasks = {}
+    if munge_common:
+        common = CommonMunger(platform, languages)
+        common_deps.append(common.schedule(scheduler))
+        sprite_tasks = {
+            side.lower(): task for side, task in common.sprite_tasks.items()
+        }
+
+    if munge_list["shell"]:
+        ShellMunger(platform).schedule(
+            scheduler, common_deps, movies=munge_list["movies"]
+        )
+
+    if munge_list["load"]:
+        LoadMunger(platform).schedule(scheduler, common_deps)
+
+    for parent, munger_class, names in [
+        ("Sides", SideMunger, sides_to_munge),
+        ("Worlds", WorldMunger, worlds_to_munge),
+    ]:
+        if not names:
+            continue
+        names = list(names)
+        deps = list(common_deps)
+        subdir_common = _find_common(names)
+        if subdir_common is None and not _subdir_common_is_munged(parent, platform):
+            logger.info("%s/Common has not been munged yet, munging it first", parent)
+            subdir_common = "Common"
+            names.insert(0, subdir_common)
+        if subdir_common is not None:
+            names.remove(subdir_common)
+            deps.append(munger_class(subdir_common, platform).schedule(scheduler))
+        for name in names:
+            if parent == "Sides" and name.lower() in sprite_tasks:
+                # Common munges the side's sprites into the side's munge directory, so
+                # the side's own munges wait for them
+                munger_class(name, platform).schedule(
+                    scheduler, deps, munge_deps=[sprite_tasks[name.lower()]]
+                )
+            else:
+                munger_class(name, platform).schedule(scheduler, deps)
+
+    if munge_list["sound"]:
+        SoundMunger(platform, streams=True).schedule(scheduler)
+
+    if munge_list["common"] or munge_list["addme"]:
+        AddmeMunger(platform).schedule(scheduler)
+
+
+def schedule_builds(
+    scheduler: Scheduler,
+    munge_list: dict,
+    platforms: list[str],
+    languages: Iterable[str] = (),
+) -> None:
+    """
+    Adds the tasks of every platform to the same scheduler, see schedule_mungers(), so
+    that the tool invocations of all platforms share its workers. The sides and worlds
+    to munge are only listed once for all of them. When more than one platform is built,
+    task names are prefixed with the platform, and addme, which every platform munges
+    into the same addme/munged directory, is munged for one platform at a time.
+    :param scheduler: The Scheduler to add tasks to
+    :param munge_list: The actions list built from the command-line arguments
+    :param platforms: The platforms being munged
+    :param languages: (Optional) The languages being munged, see CommonMunger
+    :return: None
+    """
+    munge_list = dict(munge_list)
+    for parent in ["Sides", "Worlds"]:
+        if munge_list[parent.lower()] == "EVERYTHING":
+            munge_list[parent.lower()] = _list_subdirs(parent)
+
+    prefixed = len(platforms) > 1
+    previous_addme = None
+    for platform in platforms:
+        tasks = _PlatformTasks(scheduler, BuildContext(platform), prefixed)
+        schedule_mungers(tasks, munge_list, platform, languages)
+        addme = f"{tasks.prefix}addme"
+        if addme in scheduler:
+            if previous_addme is not None:
+                scheduler.tasks[addme].deps.add(previous_addme)
+            previous_addme = addme
@@ -1,6 +1,5 @@
 import logging
 
-from xm.utils.globals import Settings
 from xm.utils.tools import level_pack, mkdir_p, movie_munge, munge
 from xm.utils.tools import get_dir_no_case as _
 from .base import BaseMunger
@@ -13,8 +12,8 @@ class ShellMunger(BaseMunger):
 
     def __init__(self, platform="PC"):
         super().__init__("Shell", platform)
-        self.output_dir = Settings.output_dir / "Shell"
-        self.movies_output_dir = Settings.output_dir / "Movies"
+        self.output_dir = self.build.output_dir / "Shell"
+        self.movies_output_dir = self.build.output_dir / "Movies"
 
     def _munge_movies(self):
         movies_dir = _(self.source_dir / "movies")
@@ -22,7 +21,9 @@ class ShellMunger(BaseMunger):
         mlst_dir = _(movies_dir / self.platform)
         if not mlst_dir.exists():
             logger = logging.getLogger("main")
-            logger.error("Movies directory %s does not exist - skipping movie munge!", mlst_dir)
+            logger.error(
+                "Movies directory %s does not exist - skipping movie munge!", mlst_dir
+            )
             return
         for mlst_file in mlst_dir.iterdir():
             movie_munge(
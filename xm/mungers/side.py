@@ -1,8 +1,9 @@
 import logging
 from pathlib import Path
+from typing import Iterable
 
-from xm.utils.globals import Settings
-from xm.utils.tools import level_pack, mkdir_p, munge
+from xm.utils.scheduler import Scheduler
+from xm.utils.tools import level_pack, mkdir_p, munge, munge_batch
 from xm.utils.tools import get_dir_no_case as _
 from .base import BaseMunger
 
@@ -15,9 +16,40 @@ class SideMunger(BaseMunger):
     def __init__(self, side: str, platform="PC"):
         self.side = side
         super().__init__(f"Sides/{self.side}", platform)
-        self.output_dir = Settings.output_dir / "SIDE"
+        self.output_dir = self.build.output_dir / "SIDE"
+
+    def schedule(
+        self,
+        scheduler: Scheduler,
+        deps: Iterable[str] = (),
+        munge_deps: Iterable[str] = (),
+        **kwargs,
+    ) -> str:
+        """
+        Adds this side to a build graph as two tasks: munging the side's chunks, which
+        only waits for munge_deps, and packing its LVLs, which waits for the chunks as
+        well as for deps (e.g. Common and Sides/Common)
+        :param scheduler: The Scheduler to add the tasks to
+        :param deps: (Optional) Names of the tasks that must finish before the side's
+        LVLs may be packed
+        :param munge_deps: (Optional) Names of the tasks that must finish before the
+        side's chunks may be munged, e.g. the one munging Common's sprites of the side
+        into its munge directory
+        :return: The name of the task which finishes this side
+        """
+        munge_task = f"{self.name}:munge"
+        scheduler.add(munge_task, self.munge_chunks, munge_deps)
+        if self.side == "Common":
+            return munge_task
+        pack_task = f"{self.name}:pack"
+        scheduler.add(pack_task, self.pack, [munge_task, *deps])
+        return pack_task
 
     def run(self):
+        self.munge_chunks()
+        self.pack()
+
+    def munge_chunks(self):
         logger = logging.getLogger("main")
         logger.info("Munge Sides/%s...", self.side)
 
@@ -25,13 +57,20 @@ class SideMunger(BaseMunger):
 
         self._copy_premunged_files()
 
-        munge("Odf", "$*.odf", self.source_dir, self.munge_dir)
-        munge("Config", "$effects/*.fx", self.source_dir, self.munge_dir)
-        munge("Config", "$*.combo", self.source_dir, self.munge_dir)
-        munge("Model", "$*.msh", self.source_dir, self.munge_dir)
-        munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
-        munge("Config", ["*.snd", "*.mus"], self.source_dir / "Sound", self.munge_dir)
+        with munge_batch():
+            munge("Odf", "$*.odf", self.source_dir, self.munge_dir)
+            munge("Config", "$effects/*.fx", self.source_dir, self.munge_dir)
+            munge("Config", "$*.combo", self.source_dir, self.munge_dir)
+            munge("Model", "$*.msh", self.source_dir, self.munge_dir)
+            munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
+            munge(
+                "Config",
+                ["*.snd", "*.mus"],
+                self.source_dir / "Sound",
+                self.munge_dir,
+            )
 
+    def pack(self):
         common_munge_dir = _(Path(f"Common/MUNGED/{self.platform}"))
         sides_common_munge_dir = _(Path(f"Sides/Common/MUNGED/{self.platform}"))
 
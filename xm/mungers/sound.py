@@ -1,6 +1,5 @@
 import logging
 
-from xm.utils.globals import Settings
 from xm.utils.tools import level_pack, mkdir_p, munge
 from xm.utils.tools import get_dir_no_case as _
 from .base import BaseMunger
@@ -13,8 +12,11 @@ class SoundMunger(BaseMunger):
 
     def __init__(self, platform="PC", streams=True):
         super().__init__("Load", platform)
+        # Scheduled as Sound rather than after its source directory, which it shares
+        # with LoadMunger
+        self.name = "Sound"
         self.munge_streams = streams
-        self.output_dir = Settings.output_dir / "Sound"
+        self.output_dir = self.build.output_dir / "Sound"
 
     def run(self):
         logger = logging.getLogger("main")
@@ -1,10 +1,12 @@
 import logging
 from pathlib import Path
+from typing import Iterable
 
-from xm.utils.globals import Settings
+from xm.utils.scheduler import Scheduler
+from xm.utils.cache import find_inputs
 from xm.utils.tools import level_pack, mkdir_p, munge, world_munge
 from xm.utils.tools import get_dir_no_case as _
-from .base import BaseMunger
+from .base import BaseMunger, MungeStep
 
 
 class WorldMunger(BaseMunger):
@@ -15,9 +17,37 @@ class WorldMunger(BaseMunger):
     def __init__(self, world: str, platform="PC"):
         self.world = world
         super().__init__(f"Worlds/{self.world}", platform)
-        self.output_dir = Settings.output_dir / self.world.upper()
+        self.output_dir = self.build.output_dir / self.world.upper()
+
+    def schedule(self, scheduler: Scheduler, deps: Iterable[str] = (), **kwargs) -> str:
+        """
+        Adds this world to a build graph: one task per step of munging the world's
+        chunks, which need nothing else to be munged first and run alongside each other
+        where they touch different files, and a task packing its LVLs, which waits for
+        the chunks as well as for deps (e.g. Common and Worlds/Common)
+        :param scheduler: The Scheduler to add the tasks to
+        :param deps: (Optional) Names of the tasks that must finish before the world's
+        LVLs may be packed
+        :return: The name of the task which finishes this world
+        """
+        munge_task = self._schedule_steps(
+            scheduler, f"{self.name}:munge", self._munge_steps()
+        )
+        if self.world == "Common":
+            return munge_task
+        pack_task = f"{self.name}:pack"
+        scheduler.add(pack_task, self.pack, [munge_task, *deps])
+        return pack_task
 
     def run(self):
+        self.munge_chunks()
+        self.pack()
+
+    def munge_chunks(self):
+        for step in self._munge_steps():
+            step.func()
+
+    def _prepare(self):
         logger = logging.getLogger("main")
         logger.info("Munge Worlds/%s...", self.world)
 
@@ -25,68 +55,170 @@ class WorldMunger(BaseMunger):
 
         self._copy_premunged_files()
 
-        munge("Odf", "$*.odf", self.source_dir, self.munge_dir)
-        munge("Model", "$*.msh", self.source_dir, self.munge_dir)
-        munge("Texture", ["$*.tga", "$*.pic"], self.source_dir, self.munge_dir)
-        munge("Terrain", "$*.ter", self.source_dir, self.munge_dir)
-        munge("World", "$*.lyr", self.source_dir, self.munge_dir)
-        munge("World", "$*.wld", self.source_dir, self.munge_dir)
-
-        for wld_file in self.source_dir.glob("**/*.wld"):
-            world_munge(
-                f"${wld_file.stem}*.pth",
-                self.source_dir,
-                self.munge_dir,
-                output_file=wld_file.stem,
-                chunk_id="path",
-                ext="path",
-            )
+    def _munge_steps(self) -> list[MungeStep]:
+        """
+        Declares the tool calls which munge the world's chunks, with the source files
+        each reads and the munged files each writes. Each reads its own kind of source
+        file, so the only ordering between them comes from calls which write the same
+        kind of munged file (e.g. the .config files of both Config munges).
+        :return: The steps, in the order they would run one at a time
+        """
+        src = self.source_dir
+        out = self.munge_dir
 
-        munge("PathPlanning", "$*.pln", self.source_dir, self.munge_dir)
-        munge("Config", "$effects/*.fx", self.source_dir, self.munge_dir)
-        munge("Config", "$*.combo", self.source_dir, self.munge_dir)
+        def step(name, func, reads, writes):
+            # Each munged file may come with a .req file of the same name
+            return MungeStep(
+                name,
+                func,
+                [src / r for r in reads],
+                [out / f"{w}{req}" for w in writes for req in ["", ".req"]],
+            )
 
-        world_munge("$*.sky", self.source_dir, self.munge_dir, chunk_id="sky")
-        world_munge(
-            "$*.fx", self.source_dir, self.munge_dir, chunk_id="fx", ext="envfx"
-        )
-        world_munge(
-            "$*.prp",
-            self.source_dir,
-            self.munge_dir,
-            hash_strings=True,
-            chunk_id="prp",
-            ext="prop",
-        )
-        world_munge(
-            "$*.bnd",
-            self.source_dir,
-            self.munge_dir,
-            hash_strings=True,
-            chunk_id="bnd",
-            ext="boundary",
-        )
+        steps = [
+            MungeStep("prepare", self._prepare, writes=[out / "*"]),
+            step(
+                "odf",
+                lambda: munge("Odf", "$*.odf", src, out),
+                ["*.odf"],
+                ["*.class"],
+            ),
+            step(
+                "model",
+                lambda: munge("Model", "$*.msh", src, out),
+                ["*.msh"],
+                ["*.model"],
+            ),
+            step(
+                "texture",
+                lambda: munge("Texture", ["$*.tga", "$*.pic"], src, out),
+                ["*.tga", "*.pic"],
+                ["*.texture"],
+            ),
+            step(
+                "terrain",
+                lambda: munge("Terrain", "$*.ter", src, out),
+                ["*.ter"],
+                ["*.terrain"],
+            ),
+            step(
+                "world",
+                lambda: munge("World", ["$*.lyr", "$*.wld"], src, out),
+                ["*.lyr", "*.wld"],
+                ["*.world"],
+            ),
+        ]
 
-        munge(
-            "Config",
-            ["$*.snd", "$*.mus", "$*.tsr"],
-            _(self.source_dir / "Sound"),
-            self.munge_dir,
-            hash_strings=True,
-        )
+        # Each world's paths are munged into a single file named after the world, so
+        # every .wld needs a call of its own; they write different files, so they all
+        # run at once. Worlds without any paths are left out.
+        paths = find_inputs("$*.pth", src)
+        for wld_file in find_inputs("$*.wld", src):
+            stem = wld_file.stem
+            if not any(p.name.lower().startswith(stem.lower()) for p in paths):
+                continue
+            steps.append(
+                step(
+                    f"path:{stem}",
+                    lambda stem=stem: world_munge(
+                        f"${stem}*.pth",
+                        src,
+                        out,
+                        output_file=stem,
+                        chunk_id="path",
+                        ext="path",
+                    ),
+                    [f"{stem}*.pth"],
+                    [f"{stem}.path"],
+                )
+            )
 
-        world_munge(
-            "$*.lgt",
-            self.source_dir,
-            self.munge_dir,
-            hash_strings=True,
-            chunk_id="lght",
-            ext="light",
-        )
-        world_munge(
-            "$*.pvs", self.source_dir, self.munge_dir, chunk_id="PORT", ext="povs"
-        )
+        steps += [
+            step(
+                "pathplanning",
+                lambda: munge("PathPlanning", "$*.pln", src, out),
+                ["*.pln"],
+                ["*.congraph"],
+            ),
+            step(
+                "config",
+                lambda: munge("Config", ["$effects/*.fx", "$*.combo"], src, out),
+                ["effects/*.fx", "*.combo"],
+                ["*.config"],
+            ),
+            step(
+                "sky",
+                lambda: world_munge("$*.sky", src, out, chunk_id="sky"),
+                ["*.sky"],
+                ["*.config"],
+            ),
+            step(
+                "fx",
+                lambda: world_munge("$*.fx", src, out, chunk_id="fx", ext="envfx"),
+                ["*.fx"],
+                ["*.envfx"],
+            ),
+            step(
+                "prp",
+                lambda: world_munge(
+                    "$*.prp",
+                    src,
+                    out,
+                    hash_strings=True,
+                    chunk_id="prp",
+                    ext="prop",
+                ),
+                ["*.prp"],
+                ["*.prop"],
+            ),
+            step(
+                "bnd",
+                lambda: world_munge(
+                    "$*.bnd",
+                    src,
+                    out,
+                    hash_strings=True,
+                    chunk_id="bnd",
+                    ext="boundary",
+                ),
+                ["*.bnd"],
+                ["*.boundary"],
+            ),
+            step(
+                "sound",
+                lambda: munge(
+                    "Config",
+                    ["$*.snd", "$*.mus", "$*.tsr"],
+                    _(src / "Sound"),
+                    out,
+                    hash_strings=True,
+                ),
+                ["Sound/*.snd", "Sound/*.mus", "Sound/*.tsr"],
+                ["*.config"],
+            ),
+            step(
+                "lgt",
+                lambda: world_munge(
+                    "$*.lgt",
+                    src,
+                    out,
+                    hash_strings=True,
+                    chunk_id="lght",
+                    ext="light",
+                ),
+                ["*.lgt"],
+                ["*.light"],
+            ),
+            step(
+                "pvs",
+                lambda: world_munge("$*.pvs", src, out, chunk_id="PORT", ext="povs"),
+                ["*.pvs"],
+                ["*.povs"],
+            ),
+        ]
+        return steps
 
+    def pack(self):
         common_munge_dir = _(Path(f"Common/MUNGED/{self.platform}"))
         worlds_common_munge_dir = _(Path(f"Worlds/Common/MUNGED/{self.platform}"))
 
@@ -1,16 +1,61 @@
-from argparse import ArgumentParser, Namespace
-from typing import Any
+import os
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from typing import Any, Optional
 
+from .artifacts import DEFAULT_MAX_SIZE, artifact_cache, default_cache_dir
+from .deploy import DEPLOY_MODES
 from .globals import Settings
+from .plan import DEFAULT_PLAN_FILE
+from .trace import DEFAULT_TRACE_FILE
 from .validators import ArgumentValidator
 
 
-def parse_args(clean: bool = False) -> Namespace:
+def _tool_jobs(value: str) -> dict[str, int]:
+    """
+    Parses a list of per-tool process limits, e.g. "LevelPack=1,pc_TextureMunge=4"
+    :param value: The argument
+    :raise ArgumentTypeError: If an entry is not of the form TOOL=N with N at least 1
+    :return: A dict of lower-cased tool name to limit
+    """
+    limits = {}
+    for entry in [e for e in value.split(",") if e]:
+        tool, _, limit = entry.partition("=")
+        if not tool or not limit.isdigit() or int(limit) < 1:
+            raise ArgumentTypeError(f"Expected TOOL=N, got {entry}")
+        limits[tool.strip().lower()] = int(limit)
+    return limits
+
+
+def _name_list(value: str) -> list[str]:
+    """
+    Parses a comma-separated list of platforms or languages to build, e.g. "PC,PS2" or
+    "ENGLISH,FRENCH"
+    :param value: The argument
+    :raise ArgumentTypeError: If the list is empty
+    :return: The upper-cased names, in order and without repeats
+    """
+    names = []
+    for name in [n.strip().upper() for n in value.split(",") if n.strip()]:
+        if name not in names:
+            names.append(name)
+    if not names:
+        raise ArgumentTypeError(f"Expected a comma-separated list, got {value!r}")
+    return names
+
+
+def build_parser(clean: bool = False) -> ArgumentParser:
+    """
+    Builds the parser for the arguments of munge.py, or of clean.py
+    :param clean: (Optional) If True, builds the parser for clean.py
+    :return: The parser
+    """
     parser = ArgumentParser()
 
     # "Built-in" arguments (from old munge.bat)
-    parser.add_argument("--platform", nargs="?", type=str, default="PC")
-    parser.add_argument("--language", nargs="?", type=str)
+    parser.add_argument("--platform", type=_name_list, default=["PC"], dest="platforms")
+    parser.add_argument(
+        "--language", type=_name_list, default=["ENGLISH"], dest="languages"
+    )
     parser.add_argument("--world", nargs="+", type=str, dest="worlds")
     parser.add_argument("--side", nargs="+", type=str, dest="sides")
     parser.add_argument("--load", action="store_true")
@@ -24,34 +69,123 @@ def parse_args(clean: bool = False) -> Namespace:
 
     # "Add-on" arguments (for convenience)
     parser.add_argument("--addme", action="store_true")
+    parser.add_argument("--no-daemon", action="store_true", dest="no_daemon")
+    # Cleaning is bound by the disk rather than the tools, so it deletes as many
+    # directories at once as there are cores
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=(os.cpu_count() or 1) if clean else 1,
+        dest="jobs",
+    )
+    if clean:
+        parser.add_argument("--stale", action="store_true")
+        parser.add_argument("--dry-run", action="store_true", dest="dry_run")
     if not clean:
         parser.add_argument("--wine-prefix", nargs="?", type=str)
+        parser.add_argument(
+            "--tool-jobs", type=_tool_jobs, default={}, dest="tool_jobs"
+        )
+        parser.add_argument("--mem-budget", type=int, default=0, dest="mem_budget")
+        parser.add_argument("--no-cache", action="store_true", dest="no_cache")
+        parser.add_argument(
+            "--trace", nargs="?", type=str, const=DEFAULT_TRACE_FILE, dest="trace_file"
+        )
+        parser.add_argument(
+            "--deploy-mode", choices=DEPLOY_MODES, default="copy", dest="deploy_mode"
+        )
+        parser.add_argument("--watch", action="store_true")
+        parser.add_argument("--cache-dir", nargs="?", type=str, dest="cache_dir")
+        parser.add_argument(
+            "--cache-size",
+            type=int,
+            default=DEFAULT_MAX_SIZE // (1024 * 1024),
+            dest="cache_size",
+        )
+        parser.add_argument("--cache-stats", action="store_true", dest="cache_stats")
+        parser.add_argument(
+            "--workers",
+            type=lambda value: [a for a in value.split(",") if a],
+            default=[],
+        )
+        parser.add_argument(
+            "--local-workers", type=int, default=0, dest="local_workers"
+        )
+        parser.add_argument(
+            "--plan", nargs="?", type=str, const=DEFAULT_PLAN_FILE, dest="plan_file"
+        )
+        parser.add_argument("--execute-plan", type=str, dest="execute_plan")
+        parser.add_argument("--stats", action="store_true")
 
     parser.add_argument("-d", action="store_true", dest="debug_mode")
+    return parser
+
 
-    args = parser.parse_args()
+def parse_args(clean: bool = False, argv: Optional[list[str]] = None) -> Namespace:
+    args = build_parser(clean).parse_args(argv)
 
-    if not clean and args.wine_prefix:
+    if not clean:
         Settings.wine_prefix = args.wine_prefix
 
+    Settings.jobs = max(1, args.jobs)
+    if not clean:
+        Settings.tool_jobs = args.tool_jobs
+        Settings.mem_budget = max(0, args.mem_budget)
+        Settings.use_cache = not args.no_cache
+        Settings.deploy_mode = args.deploy_mode
+        Settings.cache_stats = args.cache_stats
+        Settings.workers = args.workers
+        Settings.local_workers = max(0, args.local_workers)
+        Settings.plan_file = args.plan_file
+        Settings.execute_plan = args.execute_plan
+        artifact_cache.configure(
+            (args.cache_dir or default_cache_dir()) if Settings.use_cache else None,
+            args.cache_size * 1024 * 1024,
+        )
+
     validator = ArgumentValidator(args)
     validator.validate_args()
 
-    Settings.set_platform(args.platform.upper())
+    Settings.platforms = args.platforms
+    Settings.languages = args.languages
 
     return args
 
 
+# Arguments which configure how the munge runs rather than selecting what to munge
+option_args = [
+    "platforms",
+    "languages",
+    "no_xbox_copy",
+    "wine_prefix",
+    "jobs",
+    "tool_jobs",
+    "mem_budget",
+    "no_cache",
+    "trace_file",
+    "deploy_mode",
+    "watch",
+    "cache_dir",
+    "cache_size",
+    "cache_stats",
+    "workers",
+    "local_workers",
+    "plan_file",
+    "execute_plan",
+    "stats",
+    "stale",
+    "dry_run",
+    "no_daemon",
+    "debug_mode",
+]
+
+
 def build_actions_list(args: Namespace) -> dict[Any]:
     action_all = True
     action_list = dict(vars(args))
-    action_list.pop("platform")
-    action_list.pop("language")
-    if hasattr(action_list, "no_xbox_copy"):
-        action_list.pop("no_xbox_copy")
-    if hasattr(action_list, "wine_prefix"):
-        action_list.pop("wine_prefix")
-    action_list.pop("debug_mode")
+    for option in option_args:
+        action_list.pop(option, None)
     if any(action_list.values()):
         action_all = False
         action_list["all"] = False
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging as log
+import os
+import shutil
+import stat
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Iterable, Optional, Union
+
+from .cache import stat_digest
+
+CACHE_DIR_ENV = "XMUNGE_CACHE_DIR"
+
+# 10 GiB
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+# Tools whose outputs for an input depend on nothing but that input and its .option
+# sidecar, so that each input can be cached on its own and shared between munge
+# directories. Every other tool (e.g. OdfMunge, which follows ClassParent into other
+# .odf files) is cached per invocation, keyed by all of its inputs.
+PER_FILE_TOOLS = ("TextureMunge", "ModelMunge")
+
+# Arguments which say where files are rather than how they are munged, and so are left
+# out of cache keys
+_LOCATION_ARGS = ("-inputfile", "-sourcedir", "-outputdir")
+
+
+def default_cache_dir() -> Path:
+    """
+    Finds the artifact cache used when --cache-dir is not given: $XMUNGE_CACHE_DIR,
+    otherwise xmunge/ under the user's cache directory
+    :return: The cache directory
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "xmunge"
+
+
+class CacheStats:
+    """
+    Counts what the artifact cache did during one munge
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.restored_bytes = 0
+
+    def __str__(self):
+        return (
+            f"{self.hits} hits ({self.restored_bytes / (1024 * 1024):.1f} MiB restored), "
+            f"{self.misses} misses, "
+            f"{self.stored} stored, {self.evicted} evicted"
+        )
+
+
+class ArtifactCache:
+    """
+    A content-addressed store of munged files, shared by every munge directory, checkout
+    and user pointed at the same cache directory. Each entry holds the outputs of a tool
+    for one set of inputs, keyed by the tool, its flags and the names and content hashes
+    of the inputs. Entries are restored into a munge directory as hard links (or copies
+    across filesystems) instead of running the tool. Stored files are read-only, so a
+    tool writing over a restored file in place cannot corrupt the store; restored links
+    are removed before a tool munges their inputs again.
+
+    The least recently used entries are evicted once the store grows past its size
+    limit.
+    """
+
+    def __init__(self):
+        self.directory: Optional[Path] = None
+        self.max_size = DEFAULT_MAX_SIZE
+        self.stats = CacheStats()
+        self._size: Optional[int] = None
+        self._lock = Lock()
+
+    def configure(
+        self, directory: Optional[Union[str, Path]], max_size: int = DEFAULT_MAX_SIZE
+    ) -> None:
+        """
+        Points the cache at a directory, or disables it
+        :param directory: The cache directory, or None to disable the cache
+        :param max_size: (Optional) The size in bytes past which entries are evicted
+        :return: None
+        """
+        with self._lock:
+            self.directory = Path(directory).expanduser() if directory else None
+            self.max_size = max_size
+            self._size = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def units(
+        self,
+        command: list[str],
+        source_dir: Union[str, Path],
+        input_paths: list[Path],
+        output_file: Optional[Union[str, Path]] = None,
+    ) -> list[tuple[str, list[Path]]]:
+        """
+        Splits a munge into the units the cache stores: one per input file for the tools
+        in PER_FILE_TOOLS, otherwise one for the whole invocation
+        :param command: The munge executable and its arguments
+        :param source_dir: The directory the input patterns are relative to
+        :param input_paths: Every file matched by the input patterns
+        :param output_file: (Optional) The name of the single file all inputs are munged
+        into, if any
+        :return: A list of (key, input files) pairs; .option sidecars go with the file
+        they belong to
+        """
+        base = {
+            "tool": command[0],
+            "flags": [c for c in command[1:] if not c.startswith(_LOCATION_ARGS)],
+            "output_file": str(output_file) if output_file else None,
+        }
+
+        def key(names_and_files: Iterable[tuple[str, Path]]) -> str:
+            inputs = sorted([name, stat_digest(path)] for name, path in names_and_files)
+            data = json.dumps(dict(base, inputs=inputs), sort_keys=True)
+            return hashlib.sha256(data.encode()).hexdigest()
+
+        if command[0].endswith(PER_FILE_TOOLS) and not output_file:
+            by_name = {p.name.lower(): p for p in input_paths}
+            units = []
+            for name, path in sorted(by_name.items()):
+                if name.endswith(".option"):
+                    continue
+                files = [path]
+                if f"{name}.option" in by_name:
+                    files.append(by_name[f"{name}.option"])
+                units.append((key((f.name.lower(), f) for f in files), files))
+            return units
+
+        source_dir = Path(source_dir)
+        return [
+            (
+                key(
+                    (p.relative_to(source_dir).as_posix().lower(), p)
+                    for p in input_paths
+                ),
+                list(input_paths),
+            )
+        ]
+
+    def count(self, hits: int, misses: int) -> None:
+        """
+        Adds the lookups of a munge to the statistics, which may be updated by several
+        munges at once
+        :param hits: The number of units found in the store
+        :param misses: The number of units which were not
+        :return: None
+        """
+        with self._lock:
+            self.stats.hits += hits
+            self.stats.misses += misses
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.directory / "objects" / key[:2] / key
+
+    def contains(self, key: str) -> bool:
+        """
+        Checks whether an entry is in the store, without marking it as recently used
+        :param key: The key of the entry
+        :return: True if it is
+        """
+        return self._entry_dir(key).is_dir()
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        Finds an entry and marks it as recently used
+        :param key: The key of the entry
+        :return: The directory holding the entry's files, or None on a miss
+        """
+        entry = self._entry_dir(key)
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        return entry
+
+    def restore(self, entry: Path, output_dir: Union[str, Path]) -> list[Path]:
+        """
+        Places the files of an entry into a munge directory, replacing any files of the
+        same names
+        :param entry: The entry directory returned by lookup()
+        :param output_dir: The munge directory
+        :return: The restored files
+        """
+        restored = []
+        os.makedirs(output_dir, exist_ok=True)
+        for item in os.scandir(entry):
+            dest = Path(output_dir) / item.name
+            temp = dest.with_name(f".{item.name}.{os.getpid()}.{get_ident()}.tmp")
+            try:
+                os.link(item.path, temp)
+            except OSError:
+                shutil.copyfile(item.path, temp)
+            os.replace(temp, dest)
+            restored.append(dest)
+            size = item.stat().st_size
+            with self._lock:
+                self.stats.restored_bytes += size
+        return restored
+
+    def store(self, key: str, outputs: list[Path]) -> None:
+        """
+        Adds the outputs of a unit to the store, unless another munge stored the same
+        unit first
+        :param key: The key of the unit
+        :param outputs: The files the unit produced
+        :return: None
+        """
+        entry = self._entry_dir(key)
+        if not outputs or entry.exists():
+            return
+        temp = self.directory / "tmp" / f"{key}.{os.getpid()}"
+        try:
+            temp.mkdir(parents=True, exist_ok=True)
+            size = 0
+            for output in outputs:
+                shutil.copyfile(output, temp / output.name)
+                os.chmod(temp / output.name, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                size += output.stat().st_size
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(temp, entry)
+        except OSError as err:
+            log.getLogger("main").debug(
+                "Could not store %s in the artifact cache: %s", key, err
+            )
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+
+        with self._lock:
+            self.stats.stored += 1
+            if self._size is not None:
+                self._size += size
+        if self._current_size() > self.max_size:
+            self.evict()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        """
+        Lists every entry with its last use time and size
+        """
+        entries = []
+        objects = self.directory / "objects"
+        if not objects.is_dir():
+            return entries
+        for prefix in os.scandir(objects):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, Path(entry.path)))
+                except OSError:
+                    continue
+        return entries
+
+    def _current_size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used entries until the store is below 90% of its size
+        limit
+        :return: None
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.stats.evicted += 1
+        with self._lock:
+            self._size = total
+
+    def report(self) -> str:
+        """
+        Describes the store and what it did during the current munge
+        :return: The report, for --cache-stats
+        """
+        if not self.enabled:
+            return "Artifact cache disabled"
+        entries = self._entries()
+        size = sum(size for _, size, _ in entries)
+        return (
+            f"Artifact cache {self.directory}: {len(entries)} entries, "
+            f"{size / (1024 * 1024):.1f} MiB of "
+            f"{self.max_size / (1024 * 1024):.0f} MiB; this munge: {self.stats}"
+        )
+
+
+artifact_cache = ArtifactCache()
@@ -0,0 +1,437 @@
+import hashlib
+import json
+import logging as log
+import os
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Optional, Union
+
+MANIFEST_NAME = ".xmunge_manifest.json"
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """
+    Computes the SHA-256 hash of a file's contents
+    :param path: The file to hash
+    :return: The hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_digests: dict[tuple, str] = {}
+_digests_lock = Lock()
+
+
+def stat_digest(path: Union[str, Path]) -> str:
+    """
+    Computes the SHA-256 hash of a file's contents like file_digest, but remembers the
+    hash of each file by its size and modification time, so that a file hashed more than
+    once in a process is only read once
+    :param path: The file to hash
+    :return: The hex digest
+    """
+    info = os.stat(path)
+    key = (str(path), info.st_size, info.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def _strip_quotes(pattern: str) -> str:
+    if len(pattern) > 1 and pattern[0] == pattern[-1] and pattern[0] in "'\"":
+        return pattern[1:-1]
+    return pattern
+
+
+def _compile_pattern(pattern: str) -> tuple[bool, list[str]]:
+    pattern = _strip_quotes(pattern)
+    recursive = pattern.startswith("$")
+    parts = pattern.lstrip("$").replace("\\", "/").lower().split("/")
+    return recursive, parts
+
+
+def _match_parts(recursive: bool, parts: list[str], file_parts: list[str]) -> bool:
+    if len(file_parts) < len(parts):
+        return False
+    if not recursive and len(file_parts) != len(parts):
+        return False
+    tail = file_parts[len(file_parts) - len(parts) :]
+    return all(fnmatchcase(f, p) for f, p in zip(tail, parts))
+
+
+def pattern_matches(pattern: str, path: Union[str, Path]) -> bool:
+    """
+    Checks whether a path, relative to the source directory, is matched by an -inputfile
+    pattern
+    :param pattern: The pattern, e.g. "$*.odf"
+    :param path: The relative path to check
+    :return: True if the pattern matches the path, False otherwise
+    """
+    recursive, parts = _compile_pattern(pattern)
+    file_parts = str(path).replace("\\", "/").lower().split("/")
+    return _match_parts(recursive, parts, file_parts)
+
+
+# The expansions of -inputfile patterns over source directories made during the current
+# build, see shared_scans()
+_scans: Optional[dict[tuple, list[Path]]] = None
+_scans_lock = Lock()
+
+
+@contextmanager
+def shared_scans():
+    """
+    Remembers the files find_inputs() matches in source directories for the duration of
+    the with-block, so that a build which munges the same sources more than once, e.g.
+    for several platforms, only walks them once. Directories under _BUILD, which the
+    munges themselves write to, are always walked again.
+    """
+    global _scans
+    with _scans_lock:
+        previous, _scans = _scans, {}
+    try:
+        yield
+    finally:
+        with _scans_lock:
+            _scans = previous
+
+
+def find_inputs(
+    patterns: Union[str, Iterable[str]], source_dir: Union[str, Path]
+) -> list[Path]:
+    """
+    Expands -inputfile patterns the way the munge tools do: case-insensitively, relative
+    to source_dir, and recursively through every subdirectory when the pattern starts
+    with $. Any <file>.option sidecar of a matched file is included as well since it
+    changes how the file is munged.
+    :param patterns: A pattern or list of patterns, e.g. "$*.odf" or ["$effects/*.fx",
+    "*.combo"]
+    :param source_dir: The directory the patterns are relative to
+    :return: A sorted list of matched file paths
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    key = None
+    if _scans is not None:
+        resolved, build_dir = Path(source_dir).resolve(), Path.cwd().resolve()
+        if resolved != build_dir and build_dir not in resolved.parents:
+            key = (tuple(patterns), str(source_dir))
+            with _scans_lock:
+                if _scans is not None and key in _scans:
+                    return list(_scans[key])
+
+    matched = _match_inputs(patterns, source_dir)
+    if key is not None:
+        with _scans_lock:
+            if _scans is not None:
+                _scans[key] = matched
+    return list(matched)
+
+
+def _match_inputs(patterns: Iterable[str], source_dir: Union[str, Path]) -> list[Path]:
+    matchers = [_compile_pattern(pattern) for pattern in patterns]
+
+    source_dir = Path(source_dir)
+    matched = set()
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        rel_parts = Path(root).relative_to(source_dir).parts
+        rel_parts = [part.lower() for part in rel_parts]
+        lower_files = {file.lower(): file for file in files}
+        for lower_name, name in lower_files.items():
+            file_parts = rel_parts + [lower_name]
+            for recursive, parts in matchers:
+                if _match_parts(recursive, parts, file_parts):
+                    matched.add(Path(root) / name)
+                    option = lower_files.get(f"{lower_name}.option")
+                    if option is not None:
+                        matched.add(Path(root) / option)
+                    break
+
+    return sorted(matched)
+
+
+def find_munge_outputs(
+    output_dir: Union[str, Path], inputs: Iterable[Path]
+) -> list[Path]:
+    """
+    Finds the files a munge produced from its inputs. Munge tools name their outputs
+    after their inputs, so foo.tga becomes foo.texture (and possibly foo.texture.req),
+    which lets outputs be matched on the part of the name before the first dot.
+    :param output_dir: The directory the munge wrote to
+    :param inputs: The input files of the munge
+    :return: A sorted list of output file paths
+    """
+    output_dir = Path(output_dir)
+    if not output_dir.exists():
+        return []
+    stems = {Path(i).name.split(".")[0].lower() for i in inputs}
+    return sorted(
+        output_dir / entry.name
+        for entry in os.scandir(output_dir)
+        if entry.is_file()
+        and entry.name != MANIFEST_NAME
+        and entry.name.split(".")[0].lower() in stems
+    )
+
+
+class Manifest:
+    """
+    Records, for every tool invocation whose outputs land in a munge directory, the
+    exact command line along with the content hashes of its inputs and outputs. An
+    invocation whose command, inputs and outputs are all unchanged since it last
+    succeeded does not need to run again. Each file's size and modification time are
+    stored next to its hash so that unchanged files need not be re-read; a file whose
+    timestamps changed (e.g. after a checkout) is re-hashed and still counts as
+    unchanged if its contents are.
+
+    Different tools can write files of the same name to a directory (e.g. s00.config
+    from both s00.combo and s00.snd), so each output belongs to the invocation which
+    last wrote it. Entries are kept in the order they were recorded, and an invocation
+    only verifies the outputs which no later invocation has written over.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.path = Path(directory) / MANIFEST_NAME
+        self.entries: dict[str, dict] = {}
+        # The command line of the invocation which last wrote each output
+        self._owners: dict[str, str] = {}
+        self._lock = Lock()
+        try:
+            with open(self.path, "r") as manifest_file:
+                self.entries = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as err:
+            log.getLogger("main").warning(
+                "Ignoring unreadable build manifest %s: %s", self.path, err
+            )
+        for command, entry in self.entries.items():
+            for output in entry["outputs"]:
+                self._owners[output] = command
+
+    @staticmethod
+    def _hash(path: Path, recorded: Optional[list]) -> Optional[list]:
+        """
+        Returns [size, mtime_ns, hash] for a file, reusing the recorded hash if size and
+        mtime are unchanged
+        :param path: The file to hash
+        :param recorded: The previously recorded [size, mtime_ns, hash] for the file, if
+        any
+        :return: The current [size, mtime_ns, hash], or None if the file does not exist
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        if recorded and recorded[0] == stat.st_size and recorded[1] == stat.st_mtime_ns:
+            return recorded
+        return [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+
+    def _snapshot(
+        self, files: Iterable[Path], recorded: Optional[dict] = None
+    ) -> dict[str, Optional[list]]:
+        recorded = recorded or {}
+        return {str(f): self._hash(Path(f), recorded.get(str(f))) for f in files}
+
+    def is_current(self, command: str, inputs: Iterable[Path]) -> bool:
+        """
+        Checks whether a tool invocation can be skipped
+        :param command: The exact command line of the invocation
+        :param inputs: Every input file of the invocation
+        :return: True if the invocation last succeeded with the same inputs and its
+        outputs are intact, False otherwise
+        """
+        with self._lock:
+            entry = self.entries.get(command)
+        if entry is None:
+            return False
+
+        input_names = sorted(str(i) for i in inputs)
+        if input_names != sorted(entry["inputs"]):
+            return False
+        if input_names and not entry["outputs"]:
+            # Nothing to verify against, so the outputs may well be missing
+            return False
+
+        with self._lock:
+            owned = [
+                Path(o) for o in entry["outputs"] if self._owners.get(o) == command
+            ]
+        current_inputs = self._snapshot(inputs, entry["inputs"])
+        current_outputs = self._snapshot(owned, entry["outputs"])
+        for current, recorded in [
+            (current_inputs, entry["inputs"]),
+            (current_outputs, entry["outputs"]),
+        ]:
+            for name, info in current.items():
+                if info is None or info[2] != recorded[name][2]:
+                    return False
+
+        if current_inputs != entry["inputs"] or any(
+            info != entry["outputs"][name] for name, info in current_outputs.items()
+        ):
+            # Same contents but new timestamps, remember them so the files are not
+            # re-hashed next time
+            with self._lock:
+                if self.entries.get(command) is entry:
+                    entry["inputs"] = current_inputs
+                    entry["outputs"].update(current_outputs)
+                    self._save()
+        return True
+
+    def written_by_others(self, command: str) -> set[str]:
+        """
+        :param command: The exact command line of an invocation
+        :return: The recorded outputs which another invocation wrote last
+        """
+        with self._lock:
+            return {o for o, owner in self._owners.items() if owner != command}
+
+    def recorded_outputs(self, command: str) -> Optional[list[str]]:
+        """
+        :param command: The exact command line of an invocation
+        :return: The outputs recorded for the invocation, or None if it has no record
+        """
+        with self._lock:
+            entry = self.entries.get(command)
+        return None if entry is None else list(entry["outputs"])
+
+    def record(
+        self,
+        command: str,
+        inputs: Iterable[Path],
+        outputs: Iterable[Path],
+        written: Optional[Iterable[Path]] = None,
+    ) -> None:
+        """
+        Records a successful tool invocation and saves the manifest
+        :param command: The exact command line of the invocation
+        :param inputs: Every input file of the invocation
+        :param outputs: Every file the invocation produced
+        :param written: (Optional) The outputs the invocation wrote this time, which
+        become its own; others stay with the invocation which wrote them last, if any.
+        By default, all of them.
+        :return: None
+        """
+        with self._lock:
+            previous = self.entries.pop(command, {})
+            input_info = self._snapshot(inputs, previous.get("inputs"))
+            output_info = self._snapshot(outputs, previous.get("outputs"))
+            # Re-added at the end, as the latest invocation to write its outputs
+            self.entries[command] = {
+                "inputs": {k: v for k, v in input_info.items() if v is not None},
+                "outputs": {k: v for k, v in output_info.items() if v is not None},
+            }
+            self._disown(
+                command,
+                set(previous.get("outputs", {}))
+                - set(self.entries[command]["outputs"]),
+            )
+            written = None if written is None else {str(w) for w in written}
+            for output in self.entries[command]["outputs"]:
+                if written is None or output in written or output not in self._owners:
+                    self._owners[output] = command
+            self._save()
+
+    def stale_outputs(self) -> dict[str, list[str]]:
+        """
+        Finds the recorded outputs which were made from source files that no longer
+        exist. Outputs are matched to sources on the part of their names before the
+        first dot, as the tools name them, so an output is stale if the sources it was
+        named after are all gone; the outputs of an invocation whose sources are all
+        gone are stale regardless of their names. Inputs which are themselves outputs of
+        another invocation in the manifest, like the munged files a LevelPack packs, are
+        not sources.
+        :return: A dict of the command line of each invocation with stale outputs to
+        those outputs
+        """
+        with self._lock:
+            entries = dict(self.entries)
+        produced = {o for entry in entries.values() for o in entry["outputs"]}
+        stale = {}
+        for command, entry in entries.items():
+            sources = [i for i in entry["inputs"] if i not in produced]
+            if not sources:
+                continue
+            present, missing = set(), set()
+            for name in sources:
+                (present if Path(name).exists() else missing).add(
+                    Path(name).name.split(".")[0].lower()
+                )
+            if not present:
+                found = list(entry["outputs"])
+            else:
+                found = [
+                    o
+                    for o in entry["outputs"]
+                    if Path(o).name.split(".")[0].lower() in missing - present
+                ]
+            if found:
+                stale[command] = found
+        return stale
+
+    def forget(self, command: str) -> None:
+        """
+        Drops the record of a tool invocation, e.g. because it failed, so that it will
+        run next time
+        :param command: The exact command line of the invocation
+        :return: None
+        """
+        with self._lock:
+            entry = self.entries.pop(command, None)
+            if entry is not None:
+                self._disown(command, entry["outputs"])
+                self._save()
+
+    def _disown(self, command: str, outputs: Iterable[str]) -> None:
+        """
+        Hands outputs which an invocation no longer records back to the latest other
+        invocation which recorded them, if any
+        """
+        for output in outputs:
+            if self._owners.get(output) != command:
+                continue
+            del self._owners[output]
+            for other, entry in self.entries.items():
+                if other != command and output in entry["outputs"]:
+                    self._owners[output] = other
+
+    def _save(self) -> None:
+        if not self.path.parent.exists():
+            return
+        temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1)
+        os.replace(temp_path, self.path)
+
+
+_manifests: dict[Path, Manifest] = {}
+_manifests_lock = Lock()
+
+
+def get_manifest(directory: Union[str, Path]) -> Manifest:
+    """
+    Returns the manifest for a munge directory, loading it the first time it is
+    requested
+    :param directory: The munge directory
+    :return: The Manifest for that directory
+    """
+    key = Path(directory).resolve()
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = Manifest(directory)
+        return _manifests[key]
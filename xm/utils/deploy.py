@@ -0,0 +1,307 @@
+import errno
+import json
+import logging as log
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Optional, Union
+
+from .cache import file_digest
+from .trace import tracer
+
+DEPLOY_MANIFEST_NAME = ".xmunge_deploy.json"
+
+# How each file is put in place at the destination. Hard links and reflinks need the
+# source and destination to be on the same filesystem and fall back to copying when they
+# are not.
+DEPLOY_MODES = ["copy", "hardlink", "reflink", "symlink"]
+
+# Files at least this large are copied on the thread pool, smaller ones inline
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+# From linux/fs.h, clones a whole file on filesystems which support it (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+class DeployStats:
+    def __init__(self):
+        self.copied = 0
+        self.linked = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.bytes = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.copied} copied ({self.bytes / (1024 * 1024):.1f} MiB), "
+            f"{self.linked} linked, "
+            f"{self.unchanged} unchanged, {self.removed} removed"
+        )
+
+
+def _stat_info(stat: os.stat_result) -> list:
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _reflink(source: Path, dest: Path) -> None:
+    """
+    Creates dest as a copy-on-write clone of source
+    :raises OSError: If the filesystem (or platform) does not support cloning
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only supported on Linux")
+    import fcntl
+
+    with open(source, "rb") as source_file, open(dest, "wb") as dest_file:
+        fcntl.ioctl(dest_file.fileno(), _FICLONE, source_file.fileno())
+    shutil.copystat(source, dest)
+
+
+class Deployment:
+    """
+    Mirrors a directory of build outputs into a destination directory incrementally. The
+    destination keeps a manifest of every file deployed to it, with the size,
+    modification time and content hash of its source along with the size and
+    modification time of the deployed file, so a file is only copied again when its
+    source changed or its deployed copy was touched. Files which were deployed before
+    but no longer exist in the source are removed.
+    """
+
+    def __init__(
+        self,
+        dest_dir: Union[str, Path],
+        mode: str = "copy",
+        jobs: int = 1,
+    ):
+        if mode not in DEPLOY_MODES:
+            raise ValueError(f"Unknown deploy mode {mode}")
+        self.dest_dir = Path(dest_dir)
+        self.mode = mode
+        self.jobs = max(1, jobs)
+        self.stats = DeployStats()
+        self._lock = Lock()
+        self.manifest_path = self.dest_dir / DEPLOY_MANIFEST_NAME
+        self.files: dict[str, dict] = {}
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            # Files deployed in another mode have to be redone, but are still known so
+            # they can be cleaned up
+            self.files = manifest["files"]
+            if manifest.get("mode") != mode:
+                for info in self.files.values():
+                    info["dest"] = None
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, OSError) as err:
+            log.getLogger("main").warning(
+                "Ignoring unreadable deploy manifest %s: %s", self.manifest_path, err
+            )
+
+    def _effective_mode(self, source_dir: Path) -> str:
+        """
+        Falls back to copying if the requested mode cannot link across the source and
+        destination filesystems
+        """
+        if self.mode not in ["hardlink", "reflink"]:
+            return self.mode
+        if os.stat(source_dir).st_dev == os.stat(self.dest_dir).st_dev:
+            return self.mode
+        log.getLogger("main").warning(
+            "%s and %s are on different filesystems, copying instead of using %s mode",
+            source_dir,
+            self.dest_dir,
+            self.mode,
+        )
+        return "copy"
+
+    def _is_deployed(self, info: Optional[dict], source_info: list, dest: Path) -> bool:
+        """
+        Checks, from file stats alone, whether a file is already deployed
+        """
+        if info is None or info.get("dest") is None:
+            return False
+        if info["source"][:2] != source_info:
+            return False
+        try:
+            return _stat_info(os.lstat(dest)) == info["dest"]
+        except FileNotFoundError:
+            return False
+
+    def _place(self, mode: str, source: Path, dest: Path) -> bool:
+        """
+        Puts source in place at dest using the given mode, replacing whatever is there
+        atomically
+        :return: True if the file was linked, False if it was copied
+        """
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        temp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+        linked = True
+        try:
+            if mode == "hardlink":
+                os.link(source, temp)
+            elif mode == "symlink":
+                os.symlink(source.resolve(), temp)
+            elif mode == "reflink":
+                try:
+                    _reflink(source, temp)
+                except OSError as err:
+                    log.getLogger("main").debug(
+                        "Could not reflink %s (%s), copying it instead", source, err
+                    )
+                    if os.path.lexists(temp):
+                        os.remove(temp)
+                    shutil.copy2(source, temp)
+                    linked = False
+            else:
+                shutil.copy2(source, temp)
+                linked = False
+            os.replace(temp, dest)
+            return linked
+        except BaseException:
+            if os.path.lexists(temp):
+                os.remove(temp)
+            raise
+
+    def _deploy_file(
+        self, mode: str, rel_name: str, source: Path, dest: Path, source_info: list
+    ) -> None:
+        info = self.files.get(rel_name)
+        if mode == "copy":
+            # Outputs are often rewritten with the same contents, which only needs the
+            # stats to be refreshed
+            digest = file_digest(source)
+            if (
+                info is not None
+                and info.get("dest") is not None
+                and info["source"][2] == digest
+            ):
+                try:
+                    if _stat_info(os.lstat(dest)) == info["dest"]:
+                        with self._lock:
+                            info["source"] = source_info + [digest]
+                            self.stats.unchanged += 1
+                        return
+                except FileNotFoundError:
+                    pass
+        else:
+            digest = None
+
+        linked = self._place(mode, source, dest)
+        with self._lock:
+            self.files[rel_name] = {
+                "source": source_info + [digest],
+                "dest": _stat_info(os.lstat(dest)),
+            }
+            if linked:
+                self.stats.linked += 1
+            else:
+                self.stats.copied += 1
+                self.stats.bytes += source_info[0]
+
+    def deploy_tree(
+        self, source_dir: Union[str, Path], exclude: Iterable[str] = ()
+    ) -> DeployStats:
+        """
+        Deploys every file under source_dir to the destination directory, keeping the
+        same relative paths
+        :param source_dir: The directory to deploy, e.g. _LVL_PC
+        :param exclude: (Optional) Relative paths of files in source_dir not to deploy
+        :return: The statistics of this deployment
+        """
+        source_dir = Path(source_dir)
+        exclude = {Path(e).as_posix() for e in exclude}
+        self.dest_dir.mkdir(parents=True, exist_ok=True)
+        mode = self._effective_mode(source_dir)
+
+        with tracer.span(
+            "deploy", "deploy", source=source_dir, dest=self.dest_dir, mode=mode
+        ):
+            present = set()
+            small, large = [], []
+            pending = [source_dir]
+            while pending:
+                directory = pending.pop()
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            pending.append(Path(entry.path))
+                            continue
+                        rel_name = Path(entry.path).relative_to(source_dir).as_posix()
+                        if rel_name in exclude or rel_name == DEPLOY_MANIFEST_NAME:
+                            continue
+                        present.add(rel_name)
+                        source_info = _stat_info(entry.stat())
+                        dest = self.dest_dir / rel_name
+                        if self._is_deployed(
+                            self.files.get(rel_name), source_info, dest
+                        ):
+                            self.stats.unchanged += 1
+                            continue
+                        work = (mode, rel_name, Path(entry.path), dest, source_info)
+                        (large if source_info[0] >= LARGE_FILE_SIZE else small).append(
+                            work
+                        )
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(self._deploy_file, *work) for work in large]
+                for work in small:
+                    self._deploy_file(*work)
+                for future in futures:
+                    future.result()
+
+            for rel_name in sorted(set(self.files) - present):
+                self._remove(rel_name)
+
+            self._save()
+
+        return self.stats
+
+    def _remove(self, rel_name: str) -> None:
+        dest = self.dest_dir / rel_name
+        if os.path.lexists(dest):
+            os.remove(dest)
+            self.stats.removed += 1
+        del self.files[rel_name]
+        # Tidy up directories left empty, but never the destination itself
+        parent = dest.parent
+        while parent != self.dest_dir and self.dest_dir in parent.parents:
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+            parent = parent.parent
+
+    def _save(self) -> None:
+        temp_path = self.manifest_path.with_name(
+            f"{self.manifest_path.name}.{os.getpid()}.tmp"
+        )
+        with open(temp_path, "w") as manifest_file:
+            json.dump({"mode": self.mode, "files": self.files}, manifest_file, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+
+def deploy_file(source: Union[str, Path], dest: Union[str, Path]) -> bool:
+    """
+    Copies a single file to dest unless an identical file is already there
+    :param source: The file to copy
+    :param dest: The path to copy it to
+    :return: True if the file was copied, False if it was unchanged or source does not
+    exist
+    """
+    source, dest = Path(source), Path(dest)
+    if not source.exists():
+        return False
+    if dest.exists():
+        source_stat, dest_stat = source.stat(), dest.stat()
+        if source_stat.st_size == dest_stat.st_size and (
+            source_stat.st_mtime_ns == dest_stat.st_mtime_ns
+            or file_digest(source) == file_digest(dest)
+        ):
+            return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, dest)
+    return True
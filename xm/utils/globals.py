@@ -1,40 +1,135 @@
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 
 class Settings:
 
-    platform = "PC"
+    # The platforms to build, in order, see BuildContext
+    platforms = ["PC"]
+
+    # The languages to build, see Language
+    languages = ["ENGLISH"]
 
     # Fixed paths
     root_dir = Path("../../..")
     bin_path = Path("../../ToolsFL/bin")
 
-    # Variable paths, will be set later as they depend on the platform or language
-    munge_dir = None
-    output_dir = None
-    override_path = None
+    wine_prefix = None
+
+    # Maximum number of munge tasks to run at once
+    jobs = 1
 
-    lang_version = "ENGLISH"
-    lang_dir = "ENG"
+    # Maximum number of processes of a tool to run at once, by lower-cased tool name
+    # (e.g. "levelpack"), within jobs
+    tool_jobs = {}
 
-    munge_args = None
-    shader_munge_args = None
+    # Memory the running tools may use between them, in MiB, or 0 for no limit
+    mem_budget = 0
 
-    wine_prefix = None
+    # Skip tool invocations whose inputs and outputs are unchanged since they last
+    # succeeded
+    use_cache = True
+
+    # How munged files are deployed to GameData: "copy", "hardlink", "reflink" or
+    # "symlink"
+    deploy_mode = "copy"
+
+    # Report what the shared artifact cache did after munging
+    cache_stats = False
+
+    # Addresses ("host:port") of remote munge workers to run tools on, and the number of
+    # workers to start on loopback
+    workers = []
+    local_workers = 0
 
-    @classmethod
-    def set_platform(cls, platform: str) -> None:
+    # Where to save the plan of the munge instead of munging (--plan), or the plan to
+    # run instead of walking the mungers (--execute-plan)
+    plan_file = None
+    execute_plan = None
+
+
+class BuildContext:
+    """
+    The platform-dependent settings of the build of one platform. Several platforms can
+    be built in the same run, each by tasks running under its own context (see
+    building()), so that anything depending on the platform is looked up through
+    current_build() rather than kept in Settings.
+    """
+
+    def __init__(self, platform: str):
         """
-        Class method for setting the platform and updating all other members that rely on the platform value.
         :param platform: A string, either "PC", "PS2", or "XBOX"
-        :return: None
         """
-        cls.platform = platform.upper()
+        self.platform = platform.upper()
 
-        cls.munge_dir = Path(f"MUNGED/{cls.platform}")
-        cls.output_dir = Path(f"../_LVL_{cls.platform}")
+        self.munge_dir = Path(f"MUNGED/{self.platform}")
+        self.output_dir = Path(f"../_LVL_{self.platform}")
 
-        cls.munge_args = f"-checkdate -continue -platform {cls.platform}"
-        cls.shader_munge_args = (
-            f"-continue -platform {cls.platform}"  # TODO why not checkdate?
+        self.munge_args = f"-checkdate -continue -platform {self.platform}"
+        self.shader_munge_args = (
+            f"-continue -platform {self.platform}"  # TODO why not checkdate?
         )
+
+    def __repr__(self):
+        return f"BuildContext({self.platform!r})"
+
+
+class Language:
+    """
+    One of the languages being built. English is the language of the regular build;
+    every other language has an override directory, <platform>_<lang_dir> (e.g.
+    PC_FRENCH or PC_UK_), which its own localization is munged to and its localized LVLs
+    are packed to, under Common/MUNGED and _LVL_<platform> respectively.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: A string such as "ENGLISH", "FRENCH" or "UK"
+        """
+        self.name = name.upper()
+        self.lang_dir = {"ENGLISH": "ENG", "UK": "UK_"}.get(self.name, self.name)
+
+    @property
+    def is_default(self) -> bool:
+        return self.name == "ENGLISH"
+
+    def override_path(self, platform: str) -> Path:
+        """
+        :param platform: The platform being built
+        :return: The name of the language's override directory for the platform, e.g.
+        PC_FRENCH
+        """
+        return Path(f"{platform.upper()}_{self.lang_dir}")
+
+    def __repr__(self):
+        return f"Language({self.name!r})"
+
+
+_current = threading.local()
+
+
+def current_build() -> BuildContext:
+    """
+    Finds the build the calling thread is working on
+    :return: The BuildContext set with building(), or that of the first platform in
+    Settings.platforms outside of any
+    """
+    build = getattr(_current, "build", None)
+    if build is None:
+        return BuildContext(Settings.platforms[0])
+    return build
+
+
+@contextmanager
+def building(build: BuildContext):
+    """
+    Makes the calling thread work on a build for the duration of the with-block
+    :param build: The BuildContext, as returned by current_build()
+    """
+    previous = getattr(_current, "build", None)
+    _current.build = build
+    try:
+        yield
+    finally:
+        _current.build = previous
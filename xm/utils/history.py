@@ -0,0 +1,254 @@
+import json
+import logging as log
+import os
+from collections import defaultdict
+from pathlib import Path
+from statistics import median
+from threading import Lock
+from time import time
+from typing import Optional, Union
+
+HISTORY_FILE = ".xmunge_history.jsonl"
+
+# The category of the records for whole scheduler tasks, as opposed to single tool
+# invocations
+TASK_CATEGORY = "task"
+
+# The number of most recent runs of an invocation its predicted duration is taken from
+_RECENT_RUNS = 5
+
+# The number of most recent invocations of a tool its peak memory use is taken from,
+# when an invocation has no runs of its own yet
+_RECENT_TOOL_RUNS = 50
+
+# The number of munges whose records are kept; older ones are dropped when a munge
+# starts
+MAX_BUILDS = 100
+
+
+def munger_of(task: str) -> str:
+    """
+    Finds the munger a scheduler task belongs to, e.g. Worlds/ABC for
+    Worlds/ABC:munge:odf
+    :param task: The task name
+    :return: The munger name
+    """
+    return task.split(":", 1)[0]
+
+
+class TimingHistory:
+    """
+    Remembers how long each tool invocation and each scheduler task took in earlier
+    munges, keyed by the munger it ran for, its category (the tool, or "task") and its
+    input patterns (or task name), in a JSON-lines file in _BUILD. Records are appended
+    as they happen and tagged with the munge they belong to, so that the durations of a
+    step can be followed across munges; only the last MAX_BUILDS munges are kept.
+    """
+
+    def __init__(self, path: Union[str, Path] = HISTORY_FILE):
+        self.path = Path(path)
+        self.build: Optional[float] = None
+        self._records: Optional[list[dict]] = None
+        self._lock = Lock()
+
+    def _load(self) -> list[dict]:
+        if self._records is None:
+            self._records = []
+            try:
+                with open(self.path, "r") as history_file:
+                    for line in history_file:
+                        try:
+                            self._records.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                pass
+        return self._records
+
+    def begin_build(self) -> None:
+        """
+        Starts tagging records with a new munge, dropping the records of munges beyond
+        the last MAX_BUILDS
+        :return: None
+        """
+        with self._lock:
+            self.build = round(time(), 3)
+            records = self._load()
+            builds = sorted({r.get("build") or 0 for r in records})
+            if len(builds) < MAX_BUILDS:
+                return
+            oldest = builds[-(MAX_BUILDS - 1)]
+            self._records = [r for r in records if (r.get("build") or 0) >= oldest]
+            temp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            try:
+                with open(temp, "w") as history_file:
+                    for entry in self._records:
+                        history_file.write(json.dumps(entry) + "\n")
+                os.replace(temp, self.path)
+            except OSError as err:
+                log.getLogger("main").debug("Could not write %s: %s", self.path, err)
+
+    def record(
+        self,
+        munger: str,
+        category: str,
+        pattern: str,
+        duration: float,
+        files: int = 1,
+        peak_rss_kb: Optional[int] = None,
+    ) -> None:
+        """
+        Adds the duration of a tool invocation which just ran
+        :param munger: The munger it ran for, see munger_of()
+        :param category: The tool, e.g. pc_TextureMunge or LevelPack
+        :param pattern: The input patterns of the invocation
+        :param duration: How long it took, in seconds
+        :param files: The number of input files it munged
+        :param peak_rss_kb: (Optional) The most memory its process used at once, in KiB,
+        if it ran locally
+        :return: None
+        """
+        entry = {
+            "time": round(time(), 3),
+            "build": self.build,
+            "munger": munger,
+            "category": category,
+            "pattern": pattern,
+            "duration": round(duration, 3),
+            "files": files,
+        }
+        if peak_rss_kb:
+            entry["rss_kb"] = peak_rss_kb
+        with self._lock:
+            self._load().append(entry)
+            try:
+                with open(self.path, "a") as history_file:
+                    history_file.write(json.dumps(entry) + "\n")
+            except OSError as err:
+                log.getLogger("main").debug("Could not write %s: %s", self.path, err)
+
+    def predict(
+        self, munger: str, category: str, pattern: str, files: int
+    ) -> Optional[float]:
+        """
+        Predicts how long a tool invocation will take: the median of its last few runs,
+        scaled by the number of input files, or failing that the average time per input
+        file of the same tool in other invocations
+        :param munger: The munger it runs for
+        :param category: The tool
+        :param pattern: The input patterns of the invocation
+        :param files: The number of input files it will munge
+        :return: The predicted duration in seconds, or None if the tool has never run
+        """
+        with self._lock:
+            records = list(self._load())
+        same = [
+            r
+            for r in records
+            if r["munger"] == munger
+            and r["category"] == category
+            and r["pattern"] == pattern
+        ][-_RECENT_RUNS:]
+        if same:
+            per_file = median(r["duration"] / max(1, r["files"]) for r in same)
+            return per_file * max(1, files)
+        tool = [r for r in records if r["category"] == category]
+        if tool:
+            per_file = sum(r["duration"] for r in tool) / max(
+                1, sum(r["files"] for r in tool)
+            )
+            return per_file * max(1, files)
+        return None
+
+    def predict_rss(self, munger: str, category: str, pattern: str) -> Optional[int]:
+        """
+        Predicts the most memory a tool invocation will use at once: the largest peak of
+        its last few runs, or failing that the largest peak of the same tool in its
+        recent invocations for any munger. Unlike durations, peaks are not scaled by the
+        number of input files, since the tools munge their inputs one after another.
+        :param munger: The munger it runs for
+        :param category: The tool
+        :param pattern: The input patterns of the invocation
+        :return: The predicted peak in KiB, or None if the tool has never run locally
+        """
+        with self._lock:
+            peaks = [
+                r for r in self._load() if r["category"] == category and r.get("rss_kb")
+            ]
+        same = [
+            r["rss_kb"]
+            for r in peaks
+            if r["munger"] == munger and r["pattern"] == pattern
+        ][-_RECENT_RUNS:]
+        if same:
+            return max(same)
+        recent = [r["rss_kb"] for r in peaks][-_RECENT_TOOL_RUNS:]
+        return max(recent) if recent else None
+
+    def task_duration(self, task: str) -> Optional[float]:
+        """
+        Predicts how long a scheduler task will take from its last few runs
+        :param task: The task name
+        :return: The predicted duration in seconds, or None if the task has never run
+        """
+        with self._lock:
+            durations = [
+                r["duration"]
+                for r in self._load()
+                if r["category"] == TASK_CATEGORY and r["pattern"] == task
+            ][-_RECENT_RUNS:]
+        return median(durations) if durations else None
+
+    def report(self, limit: int = 15, builds: int = 5) -> list[str]:
+        """
+        Describes the slowest tasks and tool invocations of the recorded munges and how
+        their durations changed
+        :param limit: (Optional) The number of tasks and of tool invocations to list
+        :param builds: (Optional) The number of most recent munges to show the durations
+        of
+        :return: The lines of the report, for --stats
+        """
+        with self._lock:
+            records = list(self._load())
+        if not records:
+            return [f"No munges recorded in {self.path}"]
+
+        # The total duration of each step in each munge, oldest munge first
+        per_build: dict[tuple, dict] = defaultdict(lambda: defaultdict(float))
+        peaks: dict[tuple, int] = {}
+        for r in records:
+            key = (r["category"], r["munger"], r["pattern"])
+            per_build[key][r.get("build") or 0] += r["duration"]
+            if r.get("rss_kb"):
+                peaks[key] = max(peaks.get(key, 0), r["rss_kb"])
+        all_builds = sorted({r.get("build") or 0 for r in records})
+
+        lines = [f"{len(all_builds)} munge(s) recorded in {self.path}"]
+        for title, is_task in [
+            ("Slowest tasks", True),
+            ("Slowest tool invocations", False),
+        ]:
+            steps = [
+                (median(durations.values()), key, durations)
+                for key, durations in per_build.items()
+                if (key[0] == TASK_CATEGORY) == is_task
+            ]
+            steps.sort(key=lambda step: step[0], reverse=True)
+            lines.append(
+                f"{title} (median, then the last {builds} munges which ran them, "
+                "oldest first):"
+            )
+            for typical, (category, munger, pattern), durations in steps[:limit]:
+                trend = [f"{durations[b]:.1f}" for b in all_builds if b in durations][
+                    -builds:
+                ]
+                name = pattern if is_task else f"[{munger}] {category} {pattern}"
+                line = f"{typical:8.1f}s  {name}  ({' -> '.join(trend)})"
+                peak = peaks.get((category, munger, pattern))
+                if peak:
+                    line += f", peak {peak / 1024:.0f} MiB"
+                lines.append(line)
+        return lines
+
+
+timing_history = TimingHistory()
@@ -1,10 +1,15 @@
 import logging as log
 
+# The logger the output of the tools is written to, which goes to the log file and the
+# console
+TOOL_LOGGER = "main.tools"
+
 
 def setup_logging(debug=False, platform="PC"):
     """
     Initializes the level, formatting, and file/console handlers for the main logger.
-    The main logger has a file handler with level INFO and a console handler with level DEBUG.
+    The main logger has a file handler with level INFO and a console handler with level
+    DEBUG. The tool output logger shares both.
     TODO Make the console handler log level configurable
     :return: None
     """
@@ -30,3 +35,9 @@ def setup_logging(debug=False, platform="PC"):
     console_handler.setLevel(log.DEBUG)
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
+
+    tool_logger = log.getLogger(TOOL_LOGGER)
+    tool_logger.setLevel(log.INFO)
+    tool_logger.propagate = False
+    tool_logger.addHandler(file_handler)
+    tool_logger.addHandler(console_handler)
@@ -0,0 +1,151 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from time import strftime
+from typing import Iterable, Union
+
+PLAN_VERSION = 2
+
+DEFAULT_PLAN_FILE = "munge-plan.json"
+
+
+def _dirty_key(path: Union[str, Path]) -> tuple[str, str]:
+    path = Path(path)
+    return (
+        os.path.normcase(os.path.normpath(path.parent)),
+        path.name.split(".")[0].lower(),
+    )
+
+
+class BuildPlan:
+    """
+    Collects the tool invocations a munge would run instead of running them (see
+    munge.py --plan). While planning, each invocation which is not up to date is
+    recorded along with everything needed to run it later without walking the mungers or
+    expanding any patterns again: its command, its input files and the build manifest
+    and artifact cache details. The files it would write are marked as changed, so that
+    invocations reading them later in the plan are planned as well even though their
+    inputs have not changed on disk yet.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.platforms: list[str] = []
+        self.tasks: dict[str, list[str]] = {}
+        self.calls: list[dict] = []
+        self.up_to_date = 0
+        self._dirty: set[tuple[str, str]] = set()
+        self._lock = Lock()
+
+    def start(self, platforms: list[str], tasks: dict[str, list[str]]) -> None:
+        """
+        Starts recording invocations instead of running them
+        :param platforms: The platforms being munged
+        :param tasks: The dependencies of every task of the build graph
+        :return: None
+        """
+        self.active = True
+        self.platforms = list(platforms)
+        self.tasks = tasks
+        self.calls = []
+        self.up_to_date = 0
+        self._dirty = set()
+
+    def stop(self) -> None:
+        self.active = False
+
+    def add(self, call: dict, writes: Iterable[Union[str, Path]]) -> None:
+        """
+        Records an invocation
+        :param call: The invocation, as understood by xm.utils.tools.run_planned_call()
+        :param writes: The files it writes, or files sharing their directory and the
+        part of their names before the first dot
+        :return: None
+        """
+        with self._lock:
+            self.calls.append(call)
+            self._dirty.update(_dirty_key(w) for w in writes)
+
+    def skip(self) -> None:
+        """
+        Counts an invocation which is up to date
+        """
+        with self._lock:
+            self.up_to_date += 1
+
+    def changes(self, paths: Iterable[Union[str, Path]]) -> bool:
+        """
+        Checks whether an invocation planned earlier writes any of the given files
+        :param paths: The input files of a later invocation
+        :return: True if any of them will have changed by the time it runs
+        """
+        with self._lock:
+            return any(_dirty_key(p) in self._dirty for p in paths)
+
+    def save(self, path: Union[str, Path]) -> None:
+        with open(path, "w") as plan_file:
+            json.dump(
+                {
+                    "version": PLAN_VERSION,
+                    "created": strftime("%Y-%m-%d %H:%M:%S"),
+                    "platforms": self.platforms,
+                    "tasks": self.tasks,
+                    "calls": self.calls,
+                },
+                plan_file,
+                indent=1,
+            )
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> dict:
+        """
+        Reads a plan saved by save()
+        :param path: The plan file
+        :raise RuntimeError: If the file is not a plan this version of xmunge can run
+        :return: The plan
+        """
+        with open(path, "r") as plan_file:
+            plan = json.load(plan_file)
+        if plan.get("version") != PLAN_VERSION:
+            raise RuntimeError(
+                f"{path} is not a munge plan this version of xmunge can run"
+            )
+        return plan
+
+    def report(self) -> list[str]:
+        """
+        Describes the plan, one line per invocation followed by a summary
+        :return: The lines of the report
+        """
+        lines = []
+        total, unknown = 0.0, 0
+        for call in self.calls:
+            predicted = call["predicted"]
+            if call["kind"] == "copy":
+                estimate = "copy"
+            elif call.get("cached"):
+                estimate = "cached"
+            elif predicted is None:
+                estimate = "?"
+                unknown += 1
+            else:
+                estimate = f"{predicted:.1f}s"
+                total += predicted
+            lines.append(
+                f"{estimate:>8}  [{call['task']}] {' '.join(call['run_command'])}"
+            )
+        runs = sum(1 for c in self.calls if c["kind"] != "copy" and not c.get("cached"))
+        cached = sum(1 for c in self.calls if c.get("cached"))
+        summary = (
+            f"{runs} tool invocation(s) to run, "
+            f"{cached} restored from the artifact cache, "
+            f"{self.up_to_date} up to date; about {total:.1f}s of tool time"
+        )
+        if unknown:
+            summary += f" plus {unknown} invocation(s) with no recorded history"
+        lines.append(summary)
+        return lines
+
+
+build_plan = BuildPlan()
@@ -0,0 +1,207 @@
+import logging
+import shutil
+import sys
+import threading
+from collections import Counter
+from statistics import median
+from time import monotonic
+from typing import Optional, TextIO
+
+# Seconds between redraws of the line while nothing happens, so that the elapsed time
+# and ETA keep moving
+_REFRESH_INTERVAL = 0.5
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class _ClearingStream:
+    """
+    Stands in for the terminal stream of a log handler, clearing the progress line
+    before anything is written over it; the line is drawn again on the next refresh
+    """
+
+    def __init__(self, progress: "ProgressLine", stream: TextIO):
+        self.progress = progress
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        with self.progress.lock:
+            self.progress.clear()
+            return self.stream.write(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class ProgressLine:
+    """
+    Keeps a status line at the bottom of the terminal while a munge runs, showing how
+    many of its tasks have finished, which tools are running and an ETA. The ETA comes
+    from the durations the timing history predicts for the remaining tasks, scaled by
+    how the finished tasks compared with their predictions; without a history every task
+    is assumed to take as long as the average finished one. Does nothing unless attach()
+    found a terminal to draw on.
+    """
+
+    def __init__(self):
+        self.stream: Optional[TextIO] = None
+        self.active = False
+        self.finished: set[str] = set()
+        self.failed = 0
+        self.tools: Counter = Counter()
+        self.tools_done = 0
+        self._weights: dict[str, float] = {}
+        self._jobs = 1
+        self._predicted = False
+        self._start = 0.0
+        self._shown = False
+        # Held while anything is written to the terminal, so that log records and the
+        # line do not interleave
+        self.lock = threading.RLock()
+        self._stop = threading.Event()
+
+    def attach(self, logger: logging.Logger, stream: TextIO = sys.stderr) -> None:
+        """
+        Enables the progress line if the stream is a terminal, and makes the logger's
+        console handlers clear the line before they write to it
+        :param logger: The logger whose console output shares the terminal with the line
+        :param stream: (Optional) The stream to draw the line on
+        :return: None
+        """
+        if not stream.isatty():
+            return
+        self.stream = stream
+        for handler in logger.handlers:
+            if (
+                isinstance(handler, logging.StreamHandler)
+                and getattr(handler, "stream", None) is stream
+            ):
+                handler.setStream(_ClearingStream(self, stream))
+
+    def begin(self, predicted: dict[str, Optional[float]], jobs: int) -> None:
+        """
+        Starts showing the progress of a munge
+        :param predicted: Every task of the munge, with its predicted duration in
+        seconds, or None if it is not known
+        :param jobs: The number of tasks which run at once
+        :return: None
+        """
+        if self.stream is None:
+            return
+        known = [p for p in predicted.values() if p is not None]
+        default = median(known) if known else 1.0
+        with self.lock:
+            self._weights = {
+                task: p if p is not None else default for task, p in predicted.items()
+            }
+            self._predicted = bool(known)
+            self._jobs = max(1, jobs)
+            self.finished = set()
+            self.failed = 0
+            self.tools = Counter()
+            self.tools_done = 0
+            self._start = monotonic()
+            self.active = True
+        self._stop.clear()
+        threading.Thread(
+            target=self._refresh, name="xmunge-progress", daemon=True
+        ).start()
+
+    def end(self) -> None:
+        """
+        Stops showing the progress line and removes it from the terminal
+        :return: None
+        """
+        if not self.active:
+            return
+        self._stop.set()
+        with self.lock:
+            self.active = False
+            self.clear()
+
+    def task_finished(
+        self, name: str, succeeded: bool, finished: int, total: int
+    ) -> None:
+        """
+        Notes that a task finished, see Scheduler
+        """
+        with self.lock:
+            self.finished.add(name)
+            if not succeeded:
+                self.failed += 1
+        self.draw()
+
+    def tool_started(self, category: str) -> None:
+        with self.lock:
+            self.tools[category] += 1
+        self.draw()
+
+    def tool_finished(self, category: str) -> None:
+        with self.lock:
+            self.tools[category] -= 1
+            if self.tools[category] <= 0:
+                del self.tools[category]
+            self.tools_done += 1
+        self.draw()
+
+    def eta(self) -> Optional[float]:
+        """
+        Predicts how long the rest of the munge will take
+        :return: The predicted seconds, or None if there is nothing to go on yet
+        """
+        with self.lock:
+            done = sum(w for task, w in self._weights.items() if task in self.finished)
+            left = sum(
+                w for task, w in self._weights.items() if task not in self.finished
+            )
+            if done > 0:
+                return (monotonic() - self._start) * left / done
+            if self._predicted:
+                return left / self._jobs
+            return None
+
+    def _text(self) -> str:
+        elapsed = monotonic() - self._start
+        text = f"[{len(self.finished)}/{len(self._weights)}] {_format_seconds(elapsed)}"
+        if self.failed:
+            text += f", {self.failed} failed"
+        eta = self.eta()
+        if eta is not None:
+            text += f", ETA {_format_seconds(eta)}"
+        text += f" | {self.tools_done} tool(s) done"
+        if self.tools:
+            running = ", ".join(
+                f"{category} x{count}" if count > 1 else category
+                for category, count in sorted(self.tools.items())
+            )
+            text += f", running {running}"
+        return text
+
+    def draw(self) -> None:
+        with self.lock:
+            if not self.active:
+                return
+            width = shutil.get_terminal_size().columns - 1
+            self.stream.write("\r\033[K" + self._text()[:width])
+            self.stream.flush()
+            self._shown = True
+
+    def clear(self) -> None:
+        with self.lock:
+            if self._shown:
+                self.stream.write("\r\033[K")
+                self.stream.flush()
+                self._shown = False
+
+    def _refresh(self) -> None:
+        while not self._stop.wait(_REFRESH_INTERVAL):
+            self.draw()
+
+
+progress_line = ProgressLine()
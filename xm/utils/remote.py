@@ -0,0 +1,324 @@
+import hashlib
+import hmac
+import json
+import logging as log
+import os
+import socket
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Lock
+from time import monotonic
+from typing import BinaryIO, Iterable, Optional, Union
+
+from .cache import stat_digest
+from .logs import TOOL_LOGGER
+
+PROTOCOL_VERSION = 2
+
+DEFAULT_WORKER_PORT = 7450
+
+# The environment variable holding the secret shared by munge clients and workers,
+# without which workers refuse jobs
+WORKER_SECRET_ENV = "XMUNGE_WORKER_SECRET"
+
+_CHUNK_SIZE = 1024 * 1024
+
+# The command-line options whose values are directories a tool writes into, and those
+# whose values are files it writes
+_OUTPUT_DIR_OPTIONS = ("-outputdir",)
+_OUTPUT_FILES_OPTIONS = ("-writefiles",)
+
+
+def send_message(
+    stream: BinaryIO, message: dict, payload: Optional[Path] = None
+) -> None:
+    """
+    Writes a message of the worker protocol: a line of JSON, followed by the contents of
+    a file if there is one, whose size is given by the message's "size"
+    :param stream: The socket's file object
+    :param message: The message
+    :param payload: (Optional) A file to send after the message
+    :return: None
+    """
+    if payload is not None:
+        message = dict(message, size=payload.stat().st_size)
+    stream.write((json.dumps(message) + "\n").encode())
+    if payload is not None:
+        with open(payload, "rb") as payload_file:
+            for chunk in iter(lambda: payload_file.read(_CHUNK_SIZE), b""):
+                stream.write(chunk)
+    stream.flush()
+
+
+def read_message(stream: BinaryIO) -> dict:
+    """
+    Reads a message of the worker protocol, but not its payload
+    :param stream: The socket's file object
+    :raise ConnectionError: If the other side went away
+    :return: The message
+    """
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    return json.loads(line)
+
+
+def read_payload(stream: BinaryIO, size: int, dest: Path) -> str:
+    """
+    Reads the payload of a message into a file
+    :param stream: The socket's file object
+    :param size: The size of the payload
+    :param dest: The file to write
+    :raise ConnectionError: If the other side went away before sending the whole payload
+    :return: The SHA-256 hex digest of the payload
+    """
+    digest = hashlib.sha256()
+    with open(dest, "wb") as dest_file:
+        remaining = size
+        while remaining:
+            chunk = stream.read(min(remaining, _CHUNK_SIZE))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-file")
+            digest.update(chunk)
+            dest_file.write(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def auth_digest(secret: str, nonce: str) -> str:
+    """
+    Answers a worker's challenge, proving knowledge of the shared secret without sending
+    it
+    :param secret: The shared secret
+    :param nonce: The nonce the worker sent in its hello
+    :return: The HMAC-SHA256 of the nonce, keyed by the secret, as hex
+    """
+    return hmac.new(secret.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.strip().rpartition(":")
+    if not host:
+        return port, DEFAULT_WORKER_PORT
+    return host, int(port)
+
+
+def _relative(path: Union[str, Path], build_dir: Path) -> Optional[str]:
+    """
+    Expresses a path relative to _BUILD the way tools see it, e.g.
+    ../Sides/ABC/odf/a.odf
+    :return: The relative path, or None if it lies outside the data_<ID> directory and
+    so cannot be shipped
+    """
+    rel = os.path.normpath(os.path.relpath(Path(path).resolve(), build_dir.resolve()))
+    parts = Path(rel).parts
+    if os.path.isabs(rel) or parts[:2] == ("..", ".."):
+        return None
+    return Path(rel).as_posix()
+
+
+class WorkerPool:
+    """
+    Hands tool invocations to munge workers (see xm.worker) over TCP, one invocation per
+    worker at a time. For each invocation the worker is sent the command and the content
+    hashes of the files it reads; only the files the worker has not seen before are
+    sent. A worker with several slots, as it says when a client connects, is given that
+    many invocations at once. The worker streams back the tool's output as it runs, then every file the tool
+    wrote and its log. Workers which cannot be reached are dropped, and their
+    invocations run locally instead.
+    """
+
+    def __init__(self):
+        self.addresses: list[tuple[str, int]] = []
+        self.secret = ""
+        self._free: Queue = Queue()
+        self._slots: dict[tuple[str, int], int] = {}
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.addresses)
+
+    def configure(self, addresses: Iterable[tuple[str, int]], secret: str = "") -> None:
+        """
+        Sets the workers to dispatch to, replacing any previous ones
+        :param addresses: The (host, port) of each worker
+        :param secret: (Optional) The secret shared with the workers
+        :return: None
+        """
+        with self._lock:
+            self.addresses = list(addresses)
+            self.secret = secret
+            self._free = Queue()
+            self._slots = {}
+            for address in self.addresses:
+                self._free.put(address)
+
+    def _add_slots(self, address: tuple[str, int], slots: int) -> None:
+        """
+        Makes a worker available as often as it has slots, the first time it says how
+        many it has; until then it is given one invocation at a time
+        """
+        with self._lock:
+            if address in self._slots or address not in self.addresses:
+                return
+            self._slots[address] = slots
+            for _ in range(slots - 1):
+                self._free.put(address)
+
+    def _drop(self, address: tuple[str, int]) -> None:
+        with self._lock:
+            if address in self.addresses:
+                self.addresses.remove(address)
+
+    def run(
+        self,
+        command: list[str],
+        log_name: Optional[str],
+        inputs: Iterable[Path],
+    ) -> Optional[tuple[int, list[str], str]]:
+        """
+        Runs a tool invocation on the next free worker
+        :param command: The tool and its arguments, with paths relative to _BUILD
+        :param log_name: (Optional) The name of the log file the tool writes to its
+        working directory
+        :param inputs: Every file the tool reads
+        :return: The tool's exit status, output lines and log, or None if the invocation
+        has to run locally
+        """
+        logger = log.getLogger("main")
+        build_dir = Path.cwd()
+        files = {}
+        for path in inputs:
+            rel = _relative(path, build_dir)
+            if rel is None:
+                logger.debug(
+                    "%s is outside the data directory, running %s locally",
+                    path,
+                    command[0],
+                )
+                return None
+            files[rel] = stat_digest(path)
+        dirs = []
+        for item in command:
+            option, _, value = item.partition(" ")
+            if option in _OUTPUT_DIR_OPTIONS:
+                dirs.append(value)
+            elif option in _OUTPUT_FILES_OPTIONS:
+                dirs += [
+                    os.path.dirname(v) for v in value.split() if os.path.dirname(v)
+                ]
+
+        while self.enabled:
+            try:
+                address = self._free.get(timeout=1.0)
+            except Empty:
+                continue
+            if address not in self.addresses:
+                continue
+            try:
+                return self._run_on(address, command, log_name, files, dirs, build_dir)
+            except (OSError, ValueError) as err:
+                logger.warning(
+                    "Worker %s:%d failed (%s), no longer using it", *address, err
+                )
+                self._drop(address)
+            finally:
+                if address in self.addresses:
+                    self._free.put(address)
+        return None
+
+    def _run_on(
+        self,
+        address: tuple[str, int],
+        command: list[str],
+        log_name: Optional[str],
+        files: dict[str, str],
+        dirs: list[str],
+        build_dir: Path,
+    ) -> tuple[int, list[str], str]:
+        logger = log.getLogger("main")
+        start_time = monotonic()
+        with socket.create_connection(address, timeout=30) as conn:
+            conn.settimeout(None)
+            stream = conn.makefile("rwb")
+            hello = read_message(stream)
+            if hello.get("type") == "error":
+                raise ValueError(hello["error"])
+            if hello.get("version") != PROTOCOL_VERSION:
+                raise ValueError(f"Unsupported protocol version {hello.get('version')}")
+            self._add_slots(address, max(1, int(hello.get("slots", 1))))
+            send_message(
+                stream,
+                {"type": "auth", "digest": auth_digest(self.secret, hello["nonce"])},
+            )
+            send_message(
+                stream,
+                {
+                    "type": "job",
+                    "version": PROTOCOL_VERSION,
+                    "command": command,
+                    "log_name": log_name,
+                    "files": files,
+                    "dirs": dirs,
+                },
+            )
+            need = read_message(stream)
+            if need.get("type") == "error":
+                raise ValueError(need["error"])
+            by_hash = {digest: rel for rel, digest in files.items()}
+            for digest in need["hashes"]:
+                send_message(
+                    stream,
+                    {"type": "blob", "hash": digest},
+                    build_dir / by_hash[digest],
+                )
+            logger.debug(
+                "%s: sent %d of %d files to %s:%d",
+                command[0],
+                len(need["hashes"]),
+                len(files),
+                *address,
+            )
+
+            output = []
+            while True:
+                message = read_message(stream)
+                kind = message["type"]
+                if kind == "line":
+                    output.append(message["line"])
+                    log.getLogger(TOOL_LOGGER).info(
+                        "%s@%s: %s", command[0], address[0], message["line"]
+                    )
+                elif kind == "file":
+                    self._receive_file(stream, message, build_dir)
+                elif kind == "done":
+                    logger.debug(
+                        "%s ran on %s:%d in %.2fs",
+                        command[0],
+                        *address,
+                        monotonic() - start_time,
+                    )
+                    return message["returncode"], output, message["log"]
+                elif kind == "error":
+                    raise ValueError(message["error"])
+
+    @staticmethod
+    def _receive_file(stream: BinaryIO, message: dict, build_dir: Path) -> None:
+        rel = os.path.normpath(message["path"])
+        if os.path.isabs(rel) or Path(rel).parts[:2] == ("..", ".."):
+            raise ValueError(
+                f"Worker sent a file outside the data directory: {message['path']}"
+            )
+        dest = build_dir / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        temp = dest.with_name(f".{dest.name}.{os.getpid()}.remote")
+        try:
+            read_payload(stream, message["size"], temp)
+            os.replace(temp, dest)
+        finally:
+            if temp.exists():
+                temp.unlink()
+
+
+remote_workers = WorkerPool()
@@ -0,0 +1,273 @@
+import json
+import logging as log
+import os
+from pathlib import Path
+from re import finditer
+from threading import Lock
+from typing import Iterable, Optional, Union
+
+from .cache import MANIFEST_NAME
+
+REQ_GRAPH_NAME = ".xmunge_reqs.json"
+
+REQ_EXTENSIONS = (".req", ".mrq")
+
+_TOKEN = r'"([^"]*)"|([{}])|([^\s{}"]+)'
+
+
+def _parse_sections(contents: str) -> list[tuple[str, list[str], Optional[str]]]:
+    """
+    Parses a request file for every platform, see parse_req()
+    :param contents: The text of the request file
+    :return: A list of (kind, names, platform) triples, one per REQN section, where
+    platform is the lower-cased platform the section is restricted to, or None
+    """
+    tokens = []
+    for line in contents.splitlines():
+        if line.strip().startswith("//"):
+            continue
+        for match in finditer(_TOKEN, line):
+            quoted, brace, word = match.groups()
+            tokens.append(
+                ("string", quoted) if quoted is not None else ("symbol", brace or word)
+            )
+
+    sections = []
+    i = 0
+    while i < len(tokens):
+        if (
+            tokens[i] == ("symbol", "REQN")
+            and i + 1 < len(tokens)
+            and tokens[i + 1] == ("symbol", "{")
+        ):
+            i += 2
+            strings = []
+            while i < len(tokens) and tokens[i] != ("symbol", "}"):
+                if tokens[i][0] == "string":
+                    strings.append(tokens[i][1])
+                i += 1
+            if strings:
+                kind, values = strings[0].lower(), strings[1:]
+                qualifiers = dict(v.lower().split("=", 1) for v in values if "=" in v)
+                names = [v for v in values if "=" not in v]
+                sections.append((kind, names, qualifiers.get("platform")))
+        i += 1
+    return sections
+
+
+def _for_platform(
+    sections: list[tuple[str, list[str], Optional[str]]], platform: Optional[str]
+) -> list[tuple[str, list[str]]]:
+    return [
+        (kind, names if not platform or only in (None, platform.lower()) else [])
+        for kind, names, only in sections
+    ]
+
+
+def parse_req(
+    contents: str, platform: Optional[str] = None
+) -> list[tuple[str, list[str]]]:
+    """
+    Parses the ucft/REQN format of .req and .mrq files, e.g.
+
+        ucft
+        {
+            REQN
+            {
+                "texture"
+                "platform=pc"
+                "rep_inf_trooper"
+            }
+        }
+
+    :param contents: The text of the request file
+    :param platform: (Optional) The platform being munged; sections restricted to other
+    platforms are left out
+    :return: A list of (kind, names) pairs, one per REQN section, e.g. ("texture",
+    ["rep_inf_trooper"])
+    """
+    return _for_platform(_parse_sections(contents), platform)
+
+
+# The sections of every request file parsed in this process, by path, size and
+# modification time, shared between the request graphs of the platforms being munged
+_parsed: dict[tuple, list[tuple[str, list[str], Optional[str]]]] = {}
+_parsed_lock = Lock()
+
+
+class _Index:
+    """
+    Case-insensitive lookup of files by the part of their name before the first dot,
+    which is how the munged chunks named in a request file are found in LevelPack's
+    input directories
+    """
+
+    def __init__(
+        self, directories: Iterable[Union[str, Path]], recursive: bool = False
+    ):
+        self.directories: list[dict[str, list[Path]]] = []
+        for directory in directories:
+            stems = {}
+            if directory is not None and Path(directory).is_dir():
+                for root, dirs, files in os.walk(directory):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name != MANIFEST_NAME and name != REQ_GRAPH_NAME:
+                            stems.setdefault(name.split(".")[0].lower(), []).append(
+                                Path(root) / name
+                            )
+                    if not recursive:
+                        break
+            self.directories.append(stems)
+
+    def find(self, name: str) -> list[Path]:
+        """
+        Finds the files for a name in the first directory which has any, as LevelPack
+        searches its input directories in order
+        """
+        for stems in self.directories:
+            if name.lower() in stems:
+                return stems[name.lower()]
+        return []
+
+
+class ReqGraph:
+    """
+    Maps each request file to everything LevelPack reads when it packs that file into an
+    LVL: the request file itself, the munged chunks it names (along with the .req files
+    the munge tools write next to chunks, which name further chunks), and any nested
+    LVLs it pulls in from the source directory. The parsed contents of every request
+    file are kept next to the build manifest, with the size and modification time they
+    were parsed at, so that between munges only request files which changed are parsed
+    again.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.path = Path(directory) / REQ_GRAPH_NAME
+        self.parsed: dict[str, dict] = {}
+        self._lock = Lock()
+        self._dirty = False
+        try:
+            with open(self.path, "r") as graph_file:
+                self.parsed = json.load(graph_file)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as err:
+            log.getLogger("main").warning(
+                "Ignoring unreadable request graph %s: %s", self.path, err
+            )
+
+    def sections(
+        self, req_file: Path, platform: Optional[str] = None
+    ) -> list[tuple[str, list[str]]]:
+        """
+        Returns the parsed contents of a request file, parsing it only if it changed
+        since it was last parsed, for this graph or for any other platform
+        :param req_file: The request file
+        :param platform: (Optional) The platform being munged
+        :return: The (kind, names) pairs of the file, or an empty list if it cannot be
+        read
+        """
+        try:
+            stat = req_file.stat()
+        except FileNotFoundError:
+            return []
+        key = str(req_file)
+        stamp = [stat.st_size, stat.st_mtime_ns, platform]
+        with self._lock:
+            entry = self.parsed.get(key)
+            if entry is not None and entry["stamp"] == stamp:
+                return [tuple(s) for s in entry["sections"]]
+
+        parsed_key = (key, stat.st_size, stat.st_mtime_ns)
+        with _parsed_lock:
+            parsed = _parsed.get(parsed_key)
+        if parsed is None:
+            try:
+                with open(req_file, "r", errors="replace") as file:
+                    parsed = _parse_sections(file.read())
+            except OSError:
+                return []
+            with _parsed_lock:
+                _parsed[parsed_key] = parsed
+        sections = _for_platform(parsed, platform)
+        with self._lock:
+            self.parsed[key] = {"stamp": stamp, "sections": sections}
+            self._dirty = True
+        return sections
+
+    def dependencies(
+        self,
+        req_files: Iterable[Path],
+        source_dir: Union[str, Path],
+        input_dirs: Iterable[Union[str, Path]],
+        platform: Optional[str] = None,
+    ) -> dict[Path, list[Path]]:
+        """
+        Resolves every file each request file depends on
+        :param req_files: The request files being packed
+        :param source_dir: The directory LevelPack finds request files in
+        :param input_dirs: The directories LevelPack loads munged chunks from, in search
+        order
+        :param platform: (Optional) The platform being munged
+        :return: A dict of request file to the sorted list of files it depends on,
+        including itself
+        """
+        chunks = _Index(input_dirs)
+        nested = _Index([source_dir], recursive=True)
+        resolved = {}
+        for req_file in req_files:
+            files = {req_file}
+            pending = [req_file]
+            while pending:
+                current = pending.pop()
+                for kind, names in self.sections(current, platform):
+                    for name in names:
+                        found = list(chunks.find(name))
+                        if kind == "lvl":
+                            found += [
+                                p
+                                for p in nested.find(name)
+                                if p.suffix.lower() in REQ_EXTENSIONS
+                            ]
+                        for path in found:
+                            if path in files:
+                                continue
+                            files.add(path)
+                            if path.suffix.lower() in REQ_EXTENSIONS:
+                                pending.append(path)
+            resolved[req_file] = sorted(files)
+        return resolved
+
+    def save(self) -> None:
+        """
+        Writes out the parsed request files if any were parsed since the graph was
+        loaded
+        :return: None
+        """
+        with self._lock:
+            if not self._dirty or not self.path.parent.exists():
+                return
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with open(temp_path, "w") as graph_file:
+                json.dump(self.parsed, graph_file)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+
+
+_graphs: dict[Path, ReqGraph] = {}
+_graphs_lock = Lock()
+
+
+def get_req_graph(directory: Union[str, Path]) -> ReqGraph:
+    """
+    Returns the request graph kept in a munge directory, loading it the first time it is
+    requested
+    :param directory: The munge directory
+    :return: The ReqGraph for that directory
+    """
+    key = Path(directory).resolve()
+    with _graphs_lock:
+        if key not in _graphs:
+            _graphs[key] = ReqGraph(directory)
+        return _graphs[key]
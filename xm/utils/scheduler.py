@@ -0,0 +1,231 @@
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from statistics import median
+from time import monotonic
+from typing import Callable, Iterable, Optional
+
+from .history import TASK_CATEGORY, TimingHistory, munger_of
+from .trace import tracer
+
+_current = threading.local()
+
+
+def current_task() -> str:
+    """
+    Finds the name of the task the calling thread is running work for, e.g. to attribute
+    a tool invocation to it
+    :return: The task name, or an empty string outside of any task
+    """
+    return getattr(_current, "task", "")
+
+
+@contextmanager
+def running_task(name: str):
+    """
+    Marks the calling thread as running work for a task for the duration of the
+    with-block, e.g. in a thread a task hands some of its work to
+    :param name: The task name, as returned by current_task()
+    """
+    previous = current_task()
+    _current.task = name
+    try:
+        yield
+    finally:
+        _current.task = previous
+
+
+class Task:
+    """
+    A single node in the build graph: a callable plus the names of the nodes that must
+    finish before it may start.
+    """
+
+    def __init__(self, name: str, func: Callable[[], None], deps: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = set(deps)
+
+    def __repr__(self):
+        return f"Task({self.name!r}, deps={sorted(self.deps)!r})"
+
+
+class Scheduler:
+    """
+    Runs a graph of named tasks on a pool of worker threads. A task is started as soon
+    as every task it depends on has finished successfully; tasks whose dependencies
+    failed are skipped. With a single job the tasks run one at a time in the order they
+    were added (dependencies permitting), which matches the old sequential munge order.
+
+    With several jobs and a timing history, the ready task on the longest remaining
+    chain of work (by the durations of earlier munges) is started first, so that long
+    chains are not left until the end.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        progress: Optional[Callable[[str, bool, int, int], None]] = None,
+        history: Optional[TimingHistory] = None,
+    ):
+        """
+        :param jobs: (Optional) The maximum number of tasks to run at once
+        :param progress: (Optional) Called as progress(name, succeeded, finished, total)
+        whenever a task finishes
+        :param history: (Optional) The timing history to order tasks by and to record
+        their durations in
+        """
+        self.jobs = max(1, jobs)
+        self.tasks: dict[str, Task] = {}
+        self.progress = progress
+        self.history = history
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tasks
+
+    def add(
+        self, name: str, func: Callable[[], None], deps: Iterable[str] = ()
+    ) -> Task:
+        """
+        Adds a task to the graph
+        :param name: A unique name for the task, used to refer to it in the deps of
+        other tasks
+        :param func: The callable to run, taking no arguments
+        :param deps: (Optional) The names of tasks that must complete before this one
+        starts
+        :raise RuntimeError: If a task with the same name has already been added
+        :return: The new Task
+        """
+        if name in self.tasks:
+            raise RuntimeError(f"Duplicate task {name}")
+        task = Task(name, func, deps)
+        self.tasks[name] = task
+        return task
+
+    def _check_graph(self) -> None:
+        """
+        Makes sure every dependency refers to a known task and that the graph has no
+        cycles
+        :raise RuntimeError: If the graph is malformed
+        :return: None
+        """
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise RuntimeError(
+                        f"Task {task.name} depends on unknown task {dep}"
+                    )
+
+        visiting, visited = set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise RuntimeError(f"Dependency cycle detected at task {name}")
+            visiting.add(name)
+            for dep in self.tasks[name].deps:
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.tasks:
+            visit(name)
+
+    def _run_task(self, task: Task) -> None:
+        start_time = monotonic()
+        with running_task(task.name), tracer.span(task.name, "munger"):
+            task.func()
+        if self.history is not None:
+            self.history.record(
+                munger_of(task.name), TASK_CATEGORY, task.name, monotonic() - start_time
+            )
+
+    def critical_paths(self) -> dict[str, float]:
+        """
+        Predicts, for every task, how long the longest chain of work starting with it
+        takes: its own predicted duration plus that of the longest chain among the tasks
+        which depend on it. Tasks with no recorded duration are assumed to take as long
+        as the median recorded task.
+        :return: A dict of task name to predicted seconds
+        """
+        durations = {name: self.history.task_duration(name) for name in self.tasks}
+        known = [d for d in durations.values() if d is not None]
+        default = median(known) if known else 0.0
+
+        dependents = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.name)
+
+        paths: dict[str, float] = {}
+
+        def path(name: str) -> float:
+            if name not in paths:
+                own = durations[name] if durations[name] is not None else default
+                paths[name] = own + max(
+                    (path(d) for d in dependents[name]), default=0.0
+                )
+            return paths[name]
+
+        for name in self.tasks:
+            path(name)
+        return paths
+
+    def run(self) -> None:
+        """
+        Executes every task in the graph, running up to self.jobs tasks at a time
+        :raise RuntimeError: If the graph is malformed or any task failed
+        :return: None
+        """
+        self._check_graph()
+        logger = logging.getLogger("main")
+
+        pending = dict(self.tasks)
+        if self.history is not None and self.jobs > 1:
+            paths = self.critical_paths()
+            pending = dict(sorted(pending.items(), key=lambda item: -paths[item[0]]))
+        done, failed = set(), set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for name, task in list(pending.items()):
+                    if task.deps & failed:
+                        logger.error(
+                            "Skipping %s because a task it depends on failed", name
+                        )
+                        failed.add(name)
+                        del pending[name]
+                        continue
+                    if len(running) >= self.jobs:
+                        continue
+                    if task.deps <= done:
+                        logger.debug("Starting task %s", name)
+                        running[pool.submit(self._run_task, task)] = name
+                        del pending[name]
+
+                if not running:
+                    # Everything left is blocked behind a failed task
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    err = future.exception()
+                    if err is not None:
+                        logger.error("Task %s failed: %s", name, err, exc_info=err)
+                        failed.add(name)
+                    else:
+                        logger.debug("Finished task %s", name)
+                        done.add(name)
+                    if self.progress is not None:
+                        self.progress(
+                            name, err is None, len(done) + len(failed), len(self.tasks)
+                        )
+
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} task(s) failed: {', '.join(sorted(failed))}"
+            )
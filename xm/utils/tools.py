@@ -1,62 +1,662 @@
+import asyncio
 import logging as log
+import os
+import stat
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from re import search
+from re import findall, search
+from shutil import copy
 import subprocess as sp
-from typing import Union
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from .artifacts import artifact_cache
+from .cache import (
+    find_inputs,
+    find_munge_outputs,
+    get_manifest,
+    pattern_matches,
+)
+from .globals import Settings, building, current_build
+from .history import munger_of, timing_history
+from .logs import TOOL_LOGGER
+from .plan import build_plan
+from .progress import progress_line
+from .remote import remote_workers
+from .reqs import get_req_graph
+from .scheduler import current_task, running_task
+from .trace import tracer
+from .wine import wine_argv, wine_env, wine_session
+from .workdir import work_dirs
+
+# The longest line of tool output read in one go
+_MAX_LINE = 1024 * 1024
+
+# Seconds between samples of the memory a running tool uses
+_SAMPLE_INTERVAL = 0.25
+
+
+class PathIndex:
+    """
+    A cache of directory listings used to resolve paths case-insensitively. Each
+    directory is listed once, with os.scandir, and its entries are indexed by their
+    case-folded names, so resolving a path costs no stat calls once its directories have
+    been seen. Listings are invalidated when xmunge creates directories itself (see
+    mkdir_p), and a part that cannot be found is looked up again in a fresh listing
+    before giving up on it.
+    """
 
-from .globals import Settings
+    def __init__(self):
+        self._listings: dict[str, Optional[dict[str, list[str]]]] = {}
+        self._lock = threading.Lock()
+
+    def _listing(
+        self, directory: Path, refresh: bool = False
+    ) -> Optional[dict[str, list[str]]]:
+        """
+        Returns the entries of a directory, indexed by case-folded name
+        :param directory: The directory to list
+        :param refresh: (Optional) Whether to list the directory again even if it has
+        been listed before
+        :return: A dict of case-folded name to the real names of matching entries, or
+        None if the directory does not exist
+        """
+        key = os.path.abspath(directory)
+        with self._lock:
+            if key in self._listings and not refresh:
+                return self._listings[key]
+
+        listing = None
+        try:
+            with os.scandir(directory) as entries:
+                listing = {}
+                for entry in entries:
+                    listing.setdefault(entry.name.casefold(), []).append(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+        with self._lock:
+            self._listings[key] = listing
+        return listing
+
+    def resolve(self, dir_path: Path) -> Path:
+        """
+        Resolves each part of a path against the real entries on disk, ignoring case.
+        Where several entries differ only by case, the upper case, lower case and
+        as-given spellings are preferred in that order.
+        :param dir_path: The path to resolve
+        :return: A path object with possibly case-modified parts
+        """
+        rebuilt_path = []
+        for part in dir_path.parts:
+            if part in (".", "..") or part == dir_path.anchor:
+                rebuilt_path.append(part)
+                continue
+            parent = Path(*rebuilt_path) if rebuilt_path else Path(".")
+            listing = self._listing(parent)
+            matches = listing.get(part.casefold(), []) if listing else []
+            if not matches:
+                # The tools create directories of their own, so a miss is checked
+                # against a fresh listing
+                listing = self._listing(parent, refresh=True)
+                matches = listing.get(part.casefold(), []) if listing else []
+            for candidate in [part.upper(), part.lower(), part] + sorted(matches):
+                if candidate in matches:
+                    part = candidate
+                    break
+            rebuilt_path.append(part)
+        return Path(*rebuilt_path) if rebuilt_path else Path(".")
+
+    def invalidate(self, path: Optional[Path] = None) -> None:
+        """
+        Forgets the listings of a directory and all of its ancestors, or of every
+        directory
+        :param path: (Optional) The directory whose contents changed, otherwise
+        everything is forgotten
+        :return: None
+        """
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+                return
+            current = Path(os.path.abspath(path))
+            for directory in [current, *current.parents]:
+                self._listings.pop(str(directory), None)
+
+
+path_index = PathIndex()
 
 
 def get_dir_no_case(dir_path: Path) -> Path:
     """
-    Checks if a directory exists in given case, upper case, or lower case. If it exists, append the appropriate case to
-    a new path and continue for each part of the path.
+    Checks if a directory exists in given case, upper case, lower case, or any other
+    case. If it exists, append the appropriate case to a new path and continue for each
+    part of the path.
     :param dir_path: The path to check
     :return: A path object with possibly case-modified parts
     """
-    rebuilt_path = []
-    for part in dir_path.parts:
-        partial_path = Path("/".join(rebuilt_path)) / part.upper()
-        if partial_path.exists():
-            rebuilt_path.append(part.upper())
-            continue
-        partial_path = Path("/".join(rebuilt_path)) / part.lower()
-        if partial_path.exists():
-            rebuilt_path.append(part.lower())
-            continue
-        rebuilt_path.append(part)
-    return Path("/".join(rebuilt_path))
+    return path_index.resolve(Path(dir_path))
 
 
 def mkdir_p(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
+    path_index.invalidate(path)
+
+
+class ToolResult:
+    """
+    The outcome of one tool invocation: its exit status, everything it printed, the
+    contents of the log file it wrote, and the number of errors and warnings it
+    reported.
+    """
+
+    def __init__(
+        self, command: list[str], skipped: bool = False, planned: bool = False
+    ):
+        self.command = command
+        self.skipped = skipped
+        self.planned = planned
+        self.returncode = 0
+        self.output: list[str] = []
+        self.log = ""
+        self.errors = 0
+        self.warnings = 0
+        self.duration = 0.0
+        # The resource usage of the tool's process, if it ran locally on a system with
+        # os.wait4
+        self.usage = None
+        # The most memory the tool's processes used at once, in KiB, if it ran locally
+        self.peak_rss_kb: Optional[int] = None
+        self.remote = False
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0 and self.errors == 0
+
+    def count_messages(self, lines: list[str]) -> None:
+        """
+        Takes the error and warning counts from the "N Errors M Warnings" summary the
+        tools end their logs with, or failing that counts the lines which start with
+        ERROR or WARNING. Called for both the tool's log and its output, which often
+        repeat the same messages, so the larger count of each is kept rather than their
+        sum.
+        :param lines: The lines of the tool's log or output
+        :return: None
+        """
+        errors, warnings, summary = 0, 0, False
+        for line in lines:
+            match = search(r"(\d+)\s+Errors\s+(\d+)\s+Warnings", line)
+            if match:
+                summary = True
+                self.errors = max(self.errors, int(match.group(1)))
+                self.warnings = max(self.warnings, int(match.group(2)))
+            elif search(r"^\s*ERROR", line):
+                errors += 1
+            elif search(r"^\s*WARNING", line):
+                warnings += 1
+        if not summary:
+            self.errors = max(self.errors, errors)
+            self.warnings = max(self.warnings, warnings)
+
+
+def _exec_remote(
+    command: list[str], log_name: Optional[str], inputs: list[Path], result: ToolResult
+) -> bool:
+    """
+    Runs a tool invocation on one of the remote munge workers, if any are configured
+    :param command: The list of strings for the executable and its arguments
+    :param log_name: (Optional) The name of the log file the executable writes to its
+    working directory
+    :param inputs: Every file the invocation reads
+    :param result: The ToolResult to fill in
+    :return: True if a worker ran the invocation, False if it has to run locally
+    """
+    remote = remote_workers.run(command, log_name, inputs)
+    if remote is None:
+        return False
+    result.returncode, result.output, result.log = remote
+    result.remote = True
+    result.count_messages(result.output)
+    if log_name:
+        result.count_messages(result.log.splitlines())
+    return True
+
+
+async def _reap(process: sp.Popen):
+    """
+    Waits for a tool process to exit without blocking the event loop, reaping it with
+    os.wait4 where available so that the resource usage of this process alone is known
+    even with other tools running
+    :return: The exit status of the process and its resource usage, or None if it is not
+    available
+    """
+    delay = 0.001
+    while True:
+        if hasattr(os, "wait4"):
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return process.returncode, usage
+        elif process.poll() is not None:
+            return process.returncode, None
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+def _tree_rss_kb(pid: int) -> int:
+    """
+    Measures the memory a process and its descendants (e.g. the Wine processes a tool
+    starts) are using right now
+    :param pid: The process
+    :return: Their total resident set size in KiB, or 0 where /proc is not available
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status", "r") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            with open(f"/proc/{current}/task/{current}/children", "r") as children:
+                pending += [int(child) for child in children.read().split()]
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _max_rss_kb(usage) -> int:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    if sys.platform == "darwin":
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+class _RunningTool:
+    """
+    A tool process holding a slot of the ToolRunner, with the memory it was predicted to
+    need and what it has been seen using
+    """
 
+    def __init__(self, category: str, predicted_kb: int):
+        self.category = category
+        self.predicted_kb = predicted_kb
+        self.live_kb = 0
+        self.peak_kb = 0
 
-def _setup_wine() -> str:
+    @property
+    def projected_kb(self) -> int:
+        return max(self.predicted_kb, self.live_kb)
+
+
+class ToolRunner:
     """
-    Configures the WINEPATH to include the BF2_ModTools/ToolsFL/bin directory and sets the WINEPREFIX if it exists in
-    Settings
-    :return: A string of the format: "[WINEPREFIX=<prefix-path> ]WINEPATH=<path-to-tools-bin> wine"
+    Runs tool processes on an asyncio event loop in a thread of its own, so that any
+    number of them can be waited on at once. Tools are started straight from their
+    argument lists with WINEPATH and WINEPREFIX set in their environment, rather than
+    through a shell, and their output is logged line by line as it arrives.
+
+    A process is only started once fewer than Settings.jobs tool processes are running
+    across the whole build, and fewer than the limit set for its tool in
+    Settings.tool_jobs, so that work which fans out inside a scheduled task cannot
+    multiply the number of Wine processes beyond what -j asked for. With a memory budget
+    (Settings.mem_budget), it must also fit in the budget alongside the running tools:
+    each counts for the larger of the peak memory use predicted from its earlier runs
+    and what it is seen using in /proc, so that cheap munges keep filling the free cores
+    while a big texture or model munge waits for memory. Tools waiting for memory are
+    admitted in the order they arrived: the memory of those ahead counts as taken, so a
+    stream of small munges cannot keep a big one waiting forever. Whatever is predicted,
+    a tool is always started when nothing else is running.
+
+    Threads hand invocations to the loop with call(); coroutines can await the *_async
+    variants of the tool helpers, which run the helper's bookkeeping (matching inputs,
+    checking manifests and the artifact cache) in a thread and its tool on this loop.
     """
-    current_dir = Path("")
-    tools_dir = current_dir / Settings.bin_path
-    wine_str = ""
-    if Settings.wine_prefix:
-        wine_str = f"WINEPREFIX={Settings.wine_prefix} "
-    wine_str = f"{wine_str}WINEPATH={tools_dir.resolve()} wine"
-    return wine_str
 
+    def __init__(self):
+        self.by_category: Counter = Counter()
+        self._running: set[_RunningTool] = set()
+        # The tools waiting for a slot, in the order they asked for one
+        self._waiting: list[_RunningTool] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._admission: Optional[asyncio.Condition] = None
+        self._lock = threading.Lock()
+        # The threads the *_async helpers run their bookkeeping in; kept apart from the
+        # loop's default executor, which runs remote invocations, so that helpers
+        # waiting on the loop can never starve it
+        self._helpers = ThreadPoolExecutor(
+            max_workers=32, thread_name_prefix="xmunge-helper"
+        )
 
-def _exec_wine(command: list[str]) -> None:
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="xmunge-tools", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def call(self, coroutine) -> Any:
+        """
+        Runs a coroutine on the runner's loop and waits for its result
+        :param coroutine: The coroutine, e.g. run()
+        :raise RuntimeError: If called from the loop itself, which would never finish
+        :return: The result of the coroutine
+        """
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError(
+                "ToolRunner.call() cannot be used from the runner's own loop"
+            )
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def offload(self, function: Callable, *args, **kwargs) -> Awaitable:
+        """
+        Runs a blocking tool helper in a helper thread, on behalf of the task and build
+        of the calling thread
+        :param function: The helper, e.g. munge
+        :return: An awaitable of the helper's result
+        """
+        task = current_task()
+        build = current_build()
+
+        def run() -> Any:
+            with running_task(task), building(build):
+                return function(*args, **kwargs)
+
+        async def wait() -> Any:
+            return await asyncio.get_running_loop().run_in_executor(self._helpers, run)
+
+        return wait()
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def _within_limits(self, category: str) -> bool:
+        limit = Settings.tool_jobs.get(category.lower())
+        if len(self._running) >= max(1, Settings.jobs):
+            return False
+        return limit is None or self.by_category[category] < limit
+
+    def _admits(self, tool: _RunningTool) -> bool:
+        if not self._within_limits(tool.category):
+            return False
+        if Settings.mem_budget and self._running:
+            # Tools which arrived earlier and are only waiting for memory keep their
+            # claim on it
+            reserved = 0
+            for waiting in self._waiting:
+                if waiting is tool:
+                    break
+                if self._within_limits(waiting.category):
+                    reserved += waiting.predicted_kb
+            projected = (
+                reserved
+                + tool.predicted_kb
+                + sum(t.projected_kb for t in self._running)
+            )
+            return projected <= Settings.mem_budget * 1024
+        return True
+
+    @asynccontextmanager
+    async def slot(self, category: str, memory_kb: int = 0):
+        """
+        Waits until a tool of the category may start, then holds its place for the
+        with-block
+        :param category: The tool, e.g. LevelPack
+        :param memory_kb: (Optional) The peak memory use predicted for the tool, in KiB
+        :return: The _RunningTool holding the slot
+        """
+        if self._admission is None:
+            self._admission = asyncio.Condition()
+        tool = _RunningTool(category, memory_kb)
+        async with self._admission:
+            self._waiting.append(tool)
+            try:
+                if not self._admits(tool) and Settings.mem_budget:
+                    log.getLogger("main").debug(
+                        "%s waiting for a slot (predicted peak %d MiB, "
+                        "%d MiB projected for running tools)",
+                        category,
+                        memory_kb // 1024,
+                        sum(t.projected_kb for t in self._running) // 1024,
+                    )
+                await self._admission.wait_for(lambda: self._admits(tool))
+            finally:
+                self._waiting.remove(tool)
+                # Those behind no longer have to leave room for this tool
+                self._admission.notify_all()
+            self._running.add(tool)
+            self.by_category[category] += 1
+        try:
+            yield tool
+        finally:
+            async with self._admission:
+                self._running.discard(tool)
+                self.by_category[category] -= 1
+                self._admission.notify_all()
+
+    async def run(
+        self,
+        command: list[str],
+        log_name: Optional[str] = None,
+        inputs: Optional[list[Path]] = None,
+        memory_kb: int = 0,
+    ) -> ToolResult:
+        """
+        Runs a tool invocation once a slot is free, on a remote munge worker if
+        possible, otherwise locally in a scratch working directory so that its log file
+        cannot collide with that of another tool running at the same time
+        :param command: The list of strings for the executable and its arguments
+        :param log_name: (Optional) The name of the log file the executable writes to
+        its working directory
+        :param inputs: (Optional) Every file the invocation reads, which allows it to
+        run on a remote munge worker
+        :param memory_kb: (Optional) The peak memory use predicted for the invocation,
+        in KiB
+        :return: The ToolResult of the invocation
+        """
+        result = ToolResult(command)
+        async with self.slot(command[0], memory_kb) as tool:
+            progress_line.tool_started(command[0])
+            start_time = monotonic()
+            try:
+                ran = False
+                if remote_workers.enabled and inputs is not None:
+                    ran = await asyncio.get_running_loop().run_in_executor(
+                        None, _exec_remote, command, log_name, inputs, result
+                    )
+                if not ran:
+                    await self._run_local(command, log_name, result, tool)
+            finally:
+                result.duration = monotonic() - start_time
+                progress_line.tool_finished(command[0])
+        return result
+
+    @staticmethod
+    async def _sample(pid: int, tool: _RunningTool) -> None:
+        """
+        Keeps track of the memory a running tool uses, until cancelled
+        """
+        while True:
+            tool.live_kb = _tree_rss_kb(pid)
+            tool.peak_kb = max(tool.peak_kb, tool.live_kb)
+            await asyncio.sleep(_SAMPLE_INTERVAL)
+
+    async def _run_local(
+        self,
+        command: list[str],
+        log_name: Optional[str],
+        result: ToolResult,
+        tool: _RunningTool,
+    ) -> None:
+        logger = log.getLogger("main")
+        tool_logger = log.getLogger(TOOL_LOGGER)
+        keep = [log_name] if log_name else []
+        with work_dirs.acquire(keep) as work_dir:
+            process = sp.Popen(
+                wine_argv(command),
+                cwd=work_dir,
+                env=wine_env(Settings.bin_path, Settings.wine_prefix),
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE,
+                stderr=sp.STDOUT,
+            )
+            loop = asyncio.get_running_loop()
+            sampler = loop.create_task(self._sample(process.pid, tool))
+            reader = asyncio.StreamReader(limit=_MAX_LINE)
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), process.stdout
+            )
+            try:
+                async for line in reader:
+                    line = line.decode(errors="replace").rstrip()
+                    result.output.append(line)
+                    tool_logger.info("%s: %s", command[0], line)
+            finally:
+                transport.close()
+                result.returncode, result.usage = await _reap(process)
+                sampler.cancel()
+            result.count_messages(result.output)
+            result.peak_rss_kb = tool.peak_kb
+            if result.usage is not None:
+                result.peak_rss_kb = max(result.peak_rss_kb, _max_rss_kb(result.usage))
+
+            if log_name:
+                try:
+                    with open(work_dir / log_name, "r", errors="replace") as tool_log:
+                        lines = [line.rstrip("\n") for line in tool_log]
+                    result.log = "\n".join(lines)
+                    result.count_messages(lines)
+                except FileNotFoundError as err:
+                    logger.warning("Log file %s not found, continuing...", err.filename)
+
+
+tool_runner = ToolRunner()
+
+
+def _exec_wine(
+    command: list[str],
+    log_name: Optional[str] = None,
+    inputs: Optional[list[Path]] = None,
+    pattern: Optional[str] = None,
+) -> ToolResult:
     """
-    Invokes Wine with the executable and parameters specified in the command list
-    :raise CalledProcessError: If the return status of the executable or Wine is non-zero
+    Invokes Wine with the executable and parameters specified in the command list on the
+    tool runner, and waits for it to finish
     :param command: The list of strings for the executable and its arguments
-    :return: None
+    :param log_name: (Optional) The name of the log file the executable writes to its
+    working directory
+    :param inputs: (Optional) Every file the invocation reads, which allows it to run on
+    a remote munge worker
+    :param pattern: (Optional) The input patterns the invocation is recorded under in
+    the timing history, to predict how much memory it needs
+    :return: The ToolResult of the invocation
+    """
+    logger = log.getLogger("main")
+    warm = wine_session.warm
+    memory_kb = 0
+    if (
+        Settings.mem_budget
+        and pattern is not None
+        and not (remote_workers.enabled and inputs is not None)
+    ):
+        memory_kb = (
+            timing_history.predict_rss(munger_of(current_task()), command[0], pattern)
+            or 0
+        )
+    with tracer.span(command[0], "wine", command=" ".join(command)) as span:
+        result = tool_runner.call(tool_runner.run(command, log_name, inputs, memory_kb))
+        if result.usage is not None:
+            tracer.add_child_usage(result.usage)
+        span.args.update(
+            status=result.returncode,
+            errors=result.errors,
+            warnings=result.warnings,
+            peak_rss_kb=result.peak_rss_kb,
+        )
+        if result.remote:
+            span.args["remote"] = True
+    logger.debug(
+        "%s finished in %.2fs (%s)",
+        command[0],
+        result.duration,
+        "remote" if result.remote else f"wineserver {'warm' if warm else 'cold'}",
+    )
+    return result
+
+
+def _level_pack_outputs(
+    req_files: list[Path],
+    output_dir: Union[str, Path, None],
+    write_paths: list[str],
+) -> list[Path]:
     """
-    args = [_setup_wine(), " ".join(command), f"2>>{Settings.platform}_MungeLog.txt"]
-    result = sp.run(" ".join(args), shell=True)
-    result.check_returncode()
+    Lists the files a LevelPack call produces: one .lvl per request file plus any
+    -writefiles lists
+    :param req_files: The request files being packed
+    :param output_dir: The directory the .lvl files are written to, or None if only
+    .files lists are written
+    :param write_paths: The paths of the .files lists to be written
+    :return: A list of output paths
+    """
+    outputs = [Path(w) for w in write_paths]
+    if output_dir:
+        existing = {}
+        if Path(output_dir).is_dir():
+            existing = {e.name.lower(): e.name for e in os.scandir(output_dir)}
+        for req in req_files:
+            lvl_name = f"{req.stem}.lvl"
+            outputs.append(Path(output_dir) / existing.get(lvl_name.lower(), lvl_name))
+    return outputs
+
+
+def _level_pack_units(
+    command: list[str],
+    req_files: list[Path],
+    dependencies: dict[Path, list[Path]],
+    output_dir: Union[str, Path, None],
+    common_paths: list[str],
+    write_paths: list[str],
+) -> list[tuple[str, list[Path], list[Path]]]:
+    """
+    Splits a LevelPack call into the units the build manifest tracks. Each LVL of a call
+    which only writes LVLs is tracked on its own, so that only the LVLs whose inputs
+    changed need to be packed again. A call which writes .files lists is tracked as a
+    whole, since the lists describe all of its request files together.
+    :param command: The LevelPack command line
+    :param req_files: The request files being packed
+    :param dependencies: The files each request file depends on, from the request graph
+    :param output_dir: The directory the .lvl files are written to, if any
+    :param common_paths: The paths of the -common .files lists, which every request file
+    depends on
+    :param write_paths: The paths of the .files lists to be written
+    :return: A list of (manifest key, request files, input paths) tuples
+    """
+    outputs = {str(o) for o in _level_pack_outputs(req_files, output_dir, write_paths)}
+    common_inputs = {Path(c) for c in common_paths}
+
+    def inputs_of(reqs: list[Path]) -> list[Path]:
+        inputs = set(common_inputs)
+        for req in reqs:
+            inputs.update(dependencies[req])
+        return sorted(i for i in inputs if str(i) not in outputs)
+
+    key = " ".join(command)
+    if output_dir and not write_paths and len(req_files) > 1:
+        return [(f"{key} [{req.name}]", [req], inputs_of([req])) for req in req_files]
+    return [(key, req_files, inputs_of(req_files))]
 
 
 def level_pack(
@@ -68,7 +668,7 @@ def level_pack(
     write_files: Union[list[str], list[Path]] = None,
     relative_write: bool = False,
     debug: bool = False,
-) -> None:
+) -> ToolResult:
     """
     Invokes LevelPack.exe in Wine with the specified parameters
     :param input_files: The list of files or glob patterns to pass as inputs
@@ -79,7 +679,8 @@ def level_pack(
     :param write_files: (Optional) A list of non-lvl artifact files to be written
     :param relative_write: (Optional) If True, does not prepend write_files entries with source_subdir/munge_dir/
     :param debug: (Optional) If True, starts LevelPack.exe with the -DEBUG flag
-    :return: None
+    :return: The ToolResult of the call, which is marked as skipped if its inputs and
+    outputs were unchanged
     """
     inputs = input_files
     if isinstance(input_files, list):
@@ -90,38 +691,38 @@ def level_pack(
         input_dirs = " ".join([str(d) for d in input_dir])
 
     source_subdir = source_dir.stem
+    build = current_build()
 
     command = [
         "LevelPack",
         f"-inputfile {inputs}",
         f"-inputdir {input_dirs}",
         f"-sourcedir {source_dir}",
-        Settings.munge_args,
+        build.munge_args,
     ]
 
+    common_paths = []
     if common:
-        common_str = "-common"
         for common_file in [f"{c}.files" for c in common]:
             if (
                 common_file.startswith(".")
                 or common_file.startswith("Common")
                 or common_file.startswith("Worlds")
             ):
-                common_str += f" {common_file}"
+                common_paths.append(common_file)
             else:
-                common_str += f" {source_subdir}/{Settings.munge_dir}/{common_file}"
+                common_paths.append(f"{source_subdir}/{build.munge_dir}/{common_file}")
 
-        command.append(common_str)
+        command.append(f"-common {' '.join(common_paths)}")
 
+    write_paths = []
     if write_files:
         to_write = [f"{w}.files" for w in write_files]
         if relative_write:
-            command.append(f"-writefiles {f' '.join(to_write)}")
+            write_paths = to_write
         else:
-            command.append(
-                f"-writefiles {source_subdir}/{Settings.munge_dir}/"
-                f"{f' {source_subdir}/{Settings.munge_dir}/'.join(to_write)}"
-            )
+            write_paths = [f"{source_subdir}/{build.munge_dir}/{w}" for w in to_write]
+        command.append(f"-writefiles {' '.join(write_paths)}")
 
     if output_dir:
         command.append(f"-outputdir {output_dir}")
@@ -131,33 +732,710 @@ def level_pack(
     if debug:
         command.append("-debug")
 
+    with tracer.span(
+        "LevelPack", "level_pack", inputs=inputs, source_dir=source_dir
+    ) as span:
+        cache_dir = input_dir[0] if isinstance(input_dir, list) else input_dir
+        pack = {
+            "command": command,
+            "inputs": inputs,
+            "source_dir": source_dir,
+            "manifest_dir": cache_dir or output_dir,
+            "input_dirs": input_dir if isinstance(input_dir, list) else [input_dir],
+            "req_files": find_inputs(input_files, source_dir)
+            if Settings.use_cache
+            else None,
+            "output_dir": output_dir,
+            "common_paths": common_paths,
+            "write_paths": write_paths,
+            "platform": build.platform,
+        }
+        result = _pack(pack, span)
+        span.args["status"] = "skipped" if result.skipped else result.succeeded
+        return result
+
+
+def _pack(pack: dict, span) -> ToolResult:
+    """
+    Runs a LevelPack command unless the build manifest shows that all of its units are
+    up to date, packing only the stale units if some are
+    :param pack: The command and its parameters: its -inputfile patterns, to label the
+    call ("inputs"), the directory LevelPack finds request files in ("source_dir") and
+    loads munged chunks from ("input_dirs"), the directory whose build manifest tracks
+    the call ("manifest_dir"), the request files being packed, or None to bypass the
+    build manifest ("req_files"), the platform whose sections of the request files count
+    ("platform"), and the "output_dir", "common_paths" and "write_paths" of the call
+    :param span: The trace span of the call
+    :return: The ToolResult of the call
+    """
     logger = log.getLogger("main")
-
-    try:
-        logger.debug(" ".join(command))
-        _exec_wine(command)
-    except sp.CalledProcessError as err:
+    command = pack["command"]
+    source_dir = pack["source_dir"]
+    output_dir = pack["output_dir"]
+    write_paths = pack["write_paths"]
+    run_command = command
+    manifest = None
+    stale = []
+    if pack["req_files"] is not None:
+        if not pack["req_files"]:
+            logger.debug("No inputs, skipping: %s", " ".join(command))
+            return ToolResult(command, skipped=True)
+        manifest = get_manifest(pack["manifest_dir"])
+        graph = get_req_graph(pack["manifest_dir"])
+        dependencies = graph.dependencies(
+            pack["req_files"], source_dir, pack["input_dirs"], pack["platform"]
+        )
+        graph.save()
+        units = _level_pack_units(
+            command,
+            pack["req_files"],
+            dependencies,
+            output_dir,
+            pack["common_paths"],
+            write_paths,
+        )
+        stale = [
+            u
+            for u in units
+            if not manifest.is_current(u[0], u[2])
+            or (build_plan.active and build_plan.changes(u[2]))
+        ]
+        if not stale:
+            logger.debug("Up to date, skipping: %s", " ".join(command))
+            if build_plan.active:
+                build_plan.skip()
+            return ToolResult(command, skipped=True)
+        if len(stale) < len(units):
+            # Pack only the LVLs whose inputs changed
+            stale_reqs = [r for u in stale for r in u[1]]
+            run_command = list(command)
+            run_command[1] = "-inputfile " + " ".join(
+                r.relative_to(source_dir).as_posix() for r in stale_reqs
+            )
+            span.args["repacked"] = [r.name for r in stale_reqs]
+
+    stale_reqs = [r for u in stale for r in u[1]]
+    # A munger may pack several source directories with the same patterns, so they are
+    # told apart in the history
+    history_pattern = f"{Path(source_dir).as_posix()}/{pack['inputs']}"
+    if build_plan.active:
+        build_plan.add(
+            {
+                "task": current_task(),
+                "kind": "level_pack",
+                "run_command": run_command,
+                "pack": _jsonable_paths(pack),
+                "predicted": timing_history.predict(
+                    munger_of(current_task()),
+                    "LevelPack",
+                    history_pattern,
+                    len(stale_reqs),
+                ),
+            },
+            _level_pack_outputs(stale_reqs, output_dir, write_paths),
+        )
+        return ToolResult(command, planned=True)
+
+    logger.debug(" ".join(run_command))
+    remote_inputs = None
+    if manifest is not None:
+        remote_inputs = sorted({i for u in stale for i in u[2]} | set(stale_reqs))
+    result = _exec_wine(run_command, "LevelPack.log", remote_inputs, history_pattern)
+    timing_history.record(
+        munger_of(current_task()),
+        "LevelPack",
+        history_pattern,
+        result.duration,
+        max(1, len(stale_reqs)),
+        result.peak_rss_kb,
+    )
+    if result.returncode != 0:
         logger.error(
             'LevelPack failed with args "%s"; Status %d.',
-            " ".join(command[1:]),
-            err.returncode,
+            " ".join(run_command[1:]),
+            result.returncode,
         )
+    if len(result.log) > 70:
+        logger.info(result.log)
+
+    if manifest is not None:
+        for key, reqs, input_paths in stale:
+            if result.succeeded:
+                outputs = _level_pack_outputs(reqs, output_dir, write_paths)
+                manifest.record(key, input_paths, outputs)
+            else:
+                manifest.forget(key)
+    return result
+
+
+def _attribute_log(
+    log_contents: str, patterns: list[str]
+) -> list[tuple[str, list[str]]]:
+    """
+    Assigns each error or warning line in the log of a batched munge to the input
+    pattern of the file it mentions
+    :param log_contents: The contents of the munge log
+    :param patterns: The input patterns the batched munge was given
+    :return: A list of (pattern, lines) pairs for the patterns that have messages, with
+    lines which do not mention a matching file listed under "unattributed"
+    """
+    attributed = {}
+    for line in log_contents.splitlines():
+        if not search(r"(?i)error|warning", line) or search(
+            r"\d+\s+(Errors|Warnings)", line
+        ):
+            continue
+        owner = "unattributed"
+        for token in findall(r"[^\s'\"\[\](){}<>,;]+\.\w+", line):
+            token = token.replace("\\", "/")
+            owner = next(
+                (p for p in patterns if pattern_matches(f"${p.lstrip('$')}", token)),
+                owner,
+            )
+            if owner != "unattributed":
+                break
+        attributed.setdefault(owner, []).append(line)
+    return list(attributed.items())
+
+
+class MungeBatch:
+    """
+    Collects munge() calls so that those sharing a category, source directory, output
+    directory and flags can run as a single invocation of the munge tool with all of
+    their input patterns, rather than one Wine process each.
+    """
+
+    def __init__(self):
+        self.groups: dict[tuple, dict] = {}
+
+    def add(
+        self,
+        category: str,
+        input_files: Union[str, list[str]],
+        source_dir: Union[str, Path],
+        output_dir: Union[str, Path],
+        **flags,
+    ) -> None:
+        patterns = [input_files] if isinstance(input_files, str) else input_files
+        key = (
+            category,
+            str(source_dir),
+            str(output_dir),
+            tuple(sorted((k, str(v)) for k, v in flags.items())),
+        )
+        group = self.groups.setdefault(
+            key,
+            {
+                "category": category,
+                "source_dir": source_dir,
+                "output_dir": output_dir,
+                "flags": flags,
+                "patterns": [],
+            },
+        )
+        for pattern in patterns:
+            if pattern not in group["patterns"]:
+                group["patterns"].append(pattern)
+
+    def flush(self, jobs: int = 1) -> list[ToolResult]:
+        """
+        Runs one munge for each group of queued calls, in the order the groups were
+        first queued
+        :param jobs: (Optional) The maximum number of groups to munge at once
+        :return: The ToolResult of each munge
+        """
+        groups, self.groups = self.groups, {}
+        if jobs <= 1 or len(groups) <= 1:
+            return [
+                munge(
+                    g["category"],
+                    g["patterns"],
+                    g["source_dir"],
+                    g["output_dir"],
+                    **g["flags"],
+                )
+                for g in groups.values()
+            ]
+        calls = [
+            munge_async(
+                g["category"],
+                g["patterns"],
+                g["source_dir"],
+                g["output_dir"],
+                **g["flags"],
+            )
+            for g in groups.values()
+        ]
+
+        async def run_all() -> list[ToolResult]:
+            limit = asyncio.Semaphore(jobs)
 
+            async def run(call: Awaitable) -> ToolResult:
+                async with limit:
+                    return await call
+
+            return list(await asyncio.gather(*(run(call) for call in calls)))
+
+        return tool_runner.call(run_all())
+
+
+_batches = threading.local()
+
+
+@contextmanager
+def munge_batch(jobs: int = 1):
+    """
+    Queues every munge() call made in the current thread inside the with-block, then
+    runs them merged by category, source directory, output directory and flags when the
+    block exits. Calls made inside the block therefore must not depend on each other's
+    outputs.
+    :param jobs: (Optional) The maximum number of merged munges to run at once
+    """
+    batch = MungeBatch()
+    previous = getattr(_batches, "current", None)
+    _batches.current = batch
     try:
-        with open("LevelPack.log", "r") as levelpack_log:
-            log_contents = str(levelpack_log.read())
-            if len(log_contents) > 70:
-                logger.info(log_contents)
-    except FileNotFoundError as err:
-        logger.warning("Log file %s not found, continuing...", err.filename)
+        yield batch
+    finally:
+        _batches.current = previous
+    batch.flush(jobs)
 
 
-def _prepare_munge():
-    pass
+def _output_stats(output_dir: Union[str, Path]) -> dict[str, tuple[int, int]]:
+    try:
+        return {
+            e.name: (e.stat().st_size, e.stat().st_mtime_ns)
+            for e in os.scandir(output_dir)
+            if e.is_file()
+        }
+    except FileNotFoundError:
+        return {}
 
 
-def _execute_munge():
-    pass
+def _stem(path: Path) -> str:
+    return path.name.split(".")[0].lower()
+
+
+def _attribute_outputs(
+    output_dir: Union[str, Path],
+    inputs: list[Path],
+    before: dict[str, tuple[int, int]],
+    previous: Optional[list[str]],
+) -> tuple[list[Path], set[Path]]:
+    """
+    Finds the outputs of a munge which just ran. Outputs are matched to inputs on the
+    part of their names before the first dot, which files written by other tools can
+    share (e.g. foo.class from foo.odf and foo.model from foo.msh), so for each input
+    only the files the munge just wrote are attributed to it, or, if it wrote nothing
+    for that input (e.g. because of -checkdate), the files it was recorded as producing
+    last time. Only the files it wrote are its own in the build manifest, see
+    Manifest.record().
+    :param output_dir: The directory the munge wrote to
+    :param inputs: The input files of the munge, or its single output file
+    :param before: The sizes and modification times of the files in output_dir before
+    the munge ran
+    :param previous: The outputs recorded in the build manifest for the munge, or None
+    if it has no record
+    :return: The outputs of the munge, and the subset of them it wrote
+    """
+    candidates = find_munge_outputs(output_dir, inputs)
+    after = _output_stats(output_dir)
+    written = {c for c in candidates if before.get(c.name) != after.get(c.name)}
+    written_stems = {_stem(w) for w in written}
+    outputs = set(written)
+    for candidate in candidates:
+        if _stem(candidate) not in written_stems and (
+            previous is None or str(candidate) in previous
+        ):
+            outputs.add(candidate)
+    return sorted(outputs), written
+
+
+def _unlink_restored(
+    output_dir: Union[str, Path], inputs: list[Path], others: set[str]
+) -> None:
+    """
+    Removes outputs which were restored from the artifact cache as hard links before
+    their inputs are munged again, since the tools write over existing outputs in place.
+    Restored files are read-only like the store's, and stay so after their store copy is
+    evicted, so read-only outputs are removed as well. Files which other munges wrote
+    last are left to them.
+    """
+    for output in find_munge_outputs(output_dir, inputs):
+        if str(output) in others:
+            continue
+        try:
+            info = output.stat()
+            if info.st_nlink > 1 or not info.st_mode & stat.S_IWUSR:
+                output.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _without_cached(
+    command: list[str], misses: list[list[Path]], source_dir: Union[str, Path]
+) -> list[str]:
+    """
+    Rewrites a munge command to munge only the inputs which were not in the artifact
+    cache
+    :param command: The munge executable and its arguments
+    :param misses: The input files of each unit which missed the cache
+    :param source_dir: The directory the input patterns are relative to
+    :return: The new command
+    """
+    run_command = list(command)
+    run_command[1] = "-inputfile " + " ".join(
+        f"'{files[0].relative_to(source_dir).as_posix()}'" for files in misses
+    )
+    return run_command
+
+
+def _plan_munge(
+    command: list[str],
+    log_name: str,
+    inputs: str,
+    input_paths: Optional[list[Path]],
+    output_dir: Union[str, Path],
+    output_file: Optional[Union[str, Path]],
+    patterns: Optional[list[str]],
+    span_category: str,
+    source_dir: Optional[Union[str, Path]],
+) -> ToolResult:
+    """
+    Adds a munge which is not up to date to the build plan instead of running it, noting
+    which of its inputs would be restored from the artifact cache
+    :return: A ToolResult marked as planned
+    """
+    run_command = command
+    files = len(input_paths or [None])
+    cached = False
+    if input_paths is not None and artifact_cache.enabled and source_dir is not None:
+        units = artifact_cache.units(
+            command, source_dir, _with_includes(command, input_paths), output_file
+        )
+        misses = [
+            unit_files
+            for unit_key, unit_files in units
+            if not artifact_cache.contains(unit_key)
+        ]
+        cached = not misses
+        if misses and len(misses) < len(units):
+            run_command = _without_cached(command, misses, source_dir)
+        files = len(misses)
+
+    if output_file:
+        writes = [Path(output_dir) / str(output_file)]
+    else:
+        writes = [Path(output_dir) / p.name for p in input_paths or []]
+    build_plan.add(
+        {
+            "task": current_task(),
+            "kind": "munge",
+            "command": command,
+            "run_command": run_command,
+            "log_name": log_name,
+            "inputs": inputs,
+            "input_paths": None
+            if input_paths is None
+            else [str(p) for p in input_paths],
+            "output_dir": str(output_dir),
+            "output_file": str(output_file) if output_file else None,
+            "patterns": patterns,
+            "span_category": span_category,
+            "source_dir": str(source_dir) if source_dir is not None else None,
+            "cached": cached,
+            "predicted": None
+            if cached
+            else timing_history.predict(
+                munger_of(current_task()), command[0], inputs, files
+            ),
+        },
+        writes,
+    )
+    return ToolResult(command, planned=True)
+
+
+def _jsonable_paths(values: dict) -> dict:
+    """
+    Converts the paths in a dict of call parameters to strings, so that the call can be
+    saved in a build plan
+    """
+
+    def convert(value):
+        if isinstance(value, Path):
+            return str(value)
+        if isinstance(value, list):
+            return [convert(v) for v in value]
+        return value
+
+    return {key: convert(value) for key, value in values.items()}
+
+
+def copy_munged(source: Union[str, Path], dest_dir: Union[str, Path]) -> None:
+    """
+    Copies a munged file into another directory, e.g. into _LVL_<platform>. While
+    planning, the copy is added to the build plan instead, since the file may not have
+    been munged yet.
+    :param source: The munged file
+    :param dest_dir: The directory to copy it into
+    :return: None
+    """
+    if build_plan.active:
+        build_plan.add(
+            {
+                "task": current_task(),
+                "kind": "copy",
+                "source": str(source),
+                "dest_dir": str(dest_dir),
+                "run_command": ["copy", str(source), str(dest_dir)],
+                "predicted": None,
+            },
+            [Path(dest_dir) / Path(source).name],
+        )
+        return
+    copy(source, dest_dir)
+
+
+def run_planned_call(call: dict) -> ToolResult:
+    """
+    Runs a tool invocation recorded in a build plan. Its build manifest and the artifact
+    cache are checked again, so that invocations which have become up to date since the
+    plan was made are still skipped.
+    :param call: The invocation, as recorded by BuildPlan.add()
+    :return: The ToolResult of the invocation
+    """
+    if call["kind"] == "copy":
+        copy(call["source"], call["dest_dir"])
+        return ToolResult(call["run_command"])
+    if call["kind"] == "level_pack":
+        pack = dict(call["pack"])
+        pack["source_dir"] = Path(pack["source_dir"])
+        if pack["req_files"] is not None:
+            pack["req_files"] = [Path(r) for r in pack["req_files"]]
+        with tracer.span(
+            "LevelPack",
+            "level_pack",
+            inputs=pack["inputs"],
+            source_dir=pack["source_dir"],
+        ) as span:
+            result = _pack(pack, span)
+            span.args["status"] = "skipped" if result.skipped else result.succeeded
+        return result
+
+    input_paths = call["input_paths"]
+    return _run_munge(
+        call["command"],
+        call["log_name"],
+        call["inputs"],
+        None if input_paths is None else [Path(p) for p in input_paths],
+        call["output_dir"],
+        call["output_file"],
+        call["patterns"],
+        call["span_category"],
+        call["source_dir"],
+    )
+
+
+def _with_includes(
+    command: list[str], input_paths: Optional[list[Path]]
+) -> Optional[list[Path]]:
+    """
+    Lists the files a munge reads: the files its input patterns match plus everything
+    under its -I include directories, which ShaderMunge reads while munging the matched
+    files
+    :return: The files, or None if they are not known
+    """
+    include_dirs = [item[3:].strip() for item in command if item.startswith("-I ")]
+    if not input_paths or not include_dirs:
+        return input_paths
+    files = set(input_paths)
+    for include_dir in include_dirs:
+        for root, _, names in os.walk(include_dir):
+            files.update(Path(root) / name for name in names)
+    return sorted(files)
+
+
+def _run_munge(
+    command: list[str],
+    log_name: str,
+    inputs: str,
+    input_paths: Optional[list[Path]],
+    output_dir: Union[str, Path],
+    output_file: Union[str, Path] = None,
+    patterns: list[str] = None,
+    span_category: str = "munge",
+    source_dir: Union[str, Path] = None,
+) -> ToolResult:
+    """
+    Runs a munge command unless the build manifest for output_dir shows that its inputs
+    and outputs are unchanged since it last succeeded, or its outputs can be restored
+    from the artifact cache, then reports the contents of the tool's log file
+    :param command: The munge executable and its arguments
+    :param log_name: The name of the log file the executable writes
+    :param inputs: The -inputfile patterns, used to label the log output
+    :param input_paths: Every file matched by the input patterns, or None to bypass the
+    build manifest
+    :param output_dir: The directory the munge writes to
+    :param output_file: (Optional) The name of the single file all inputs are munged
+    into, if any
+    :param patterns: (Optional) The input patterns of a batched munge, to attribute its
+    log messages to
+    :param span_category: (Optional) The category of the trace span recorded for the
+    call
+    :param source_dir: (Optional) The directory the input patterns are relative to,
+    needed for the artifact cache
+    :return: The ToolResult of the call
+    """
+    with tracer.span(
+        command[0], span_category, inputs=inputs, output_dir=output_dir
+    ) as span:
+        result = _run_munge_traced(
+            command,
+            log_name,
+            inputs,
+            input_paths,
+            output_dir,
+            output_file,
+            patterns,
+            span_category,
+            source_dir,
+        )
+        span.args["status"] = "skipped" if result.skipped else result.succeeded
+    return result
+
+
+def _run_munge_traced(
+    command: list[str],
+    log_name: str,
+    inputs: str,
+    input_paths: Optional[list[Path]],
+    output_dir: Union[str, Path],
+    output_file: Union[str, Path],
+    patterns: Optional[list[str]],
+    span_category: str,
+    source_dir: Optional[Union[str, Path]],
+) -> ToolResult:
+    logger = log.getLogger("main")
+    key = " ".join(command)
+
+    manifest = None
+    units, hits, restored = [], {}, []
+    run_command = command
+    # The matched files, as opposed to every file the munge reads, which is what outputs
+    # are named after
+    matched = set(input_paths or [])
+    tracked = input_paths
+    if input_paths is not None:
+        if not input_paths:
+            logger.debug("No inputs, skipping: %s", key)
+            return ToolResult(command, skipped=True)
+        tracked = _with_includes(command, input_paths)
+        manifest = get_manifest(output_dir)
+        if manifest.is_current(key, tracked) and not (
+            build_plan.active and build_plan.changes(tracked)
+        ):
+            logger.debug("Up to date, skipping: %s", key)
+            if build_plan.active:
+                build_plan.skip()
+            return ToolResult(command, skipped=True)
+
+    if build_plan.active:
+        return _plan_munge(
+            command,
+            log_name,
+            inputs,
+            input_paths,
+            output_dir,
+            output_file,
+            patterns,
+            span_category,
+            source_dir,
+        )
+
+    if input_paths is not None:
+        if artifact_cache.enabled and source_dir is not None:
+            units = artifact_cache.units(command, source_dir, tracked, output_file)
+            for unit_key, _ in units:
+                entry = artifact_cache.lookup(unit_key)
+                if entry is not None:
+                    hits[unit_key] = entry
+            artifact_cache.count(len(hits), len(units) - len(hits))
+            for entry in hits.values():
+                restored += artifact_cache.restore(entry, output_dir)
+            if len(hits) == len(units):
+                logger.debug("Restored from the artifact cache: %s", key)
+                manifest.record(key, tracked, restored)
+                return ToolResult(command, skipped=True)
+            misses = [files for unit_key, files in units if unit_key not in hits]
+            if hits:
+                run_command = _without_cached(command, misses, source_dir)
+            _unlink_restored(
+                output_dir,
+                [Path(output_file)]
+                if output_file
+                else [f for m in misses for f in m if f in matched],
+                manifest.written_by_others(key),
+            )
+
+    before = _output_stats(output_dir) if manifest is not None else {}
+    result = _exec_wine(run_command, log_name, tracked, inputs)
+    timing_history.record(
+        munger_of(current_task()),
+        command[0],
+        inputs,
+        result.duration,
+        len(units) - len(hits) if units else len(input_paths or [None]),
+        result.peak_rss_kb,
+    )
+    if result.returncode != 0:
+        logger.error(
+            '%s failed with args "%s"; Status %d.',
+            command[0],
+            " ".join(run_command[1:]),
+            result.returncode,
+        )
+
+    if result.errors or result.warnings:
+        logger.info(f"[{inputs}]\n" + result.log)
+        if patterns and len(patterns) > 1:
+            for pattern, lines in _attribute_log(result.log, patterns):
+                logger.info("[%s]\n%s", pattern, "\n".join(lines))
+
+    if manifest is not None:
+        if result.succeeded:
+            outputs, written = _attribute_outputs(
+                output_dir,
+                [Path(output_file)] if output_file else input_paths,
+                before,
+                manifest.recorded_outputs(key),
+            )
+            manifest.record(
+                key,
+                tracked,
+                sorted(set(outputs) | set(restored)),
+                written | set(restored),
+            )
+            for unit_key, files in units:
+                if unit_key in hits:
+                    continue
+                stems = (
+                    {_stem(Path(output_file))}
+                    if output_file
+                    else {
+                        _stem(f)
+                        for f in files
+                        if f.suffix.lower() != ".option" and f in matched
+                    }
+                )
+                # Only store units the tool actually munged, rather than skipped because
+                # of -checkdate
+                if stems <= {_stem(w) for w in written}:
+                    artifact_cache.store(
+                        unit_key, [o for o in outputs if _stem(o) in stems]
+                    )
+        else:
+            manifest.forget(key)
+    return result
 
 
 def munge(
@@ -169,7 +1447,7 @@ def munge(
     sprite: bool = False,
     debug: bool = False,
     **options,
-) -> None:
+) -> Optional[ToolResult]:
     """
     Invokes <category>Munge.exe in Wine with the specified parameters
     :param category: One of "Bin", "Config", "Font", etc
@@ -179,8 +1457,23 @@ def munge(
     :param hash_strings: (Optional) Flag determining whether strings in input files should be hashed during munge
     :param sprite: (Optional) If True, set the -8bit and -maps 1 flag values on the munge application
     :param debug: (Optional) If True, run the munge application with -DEBUG set
-    :return: None
+    :return: The ToolResult of the call, or None if the call was queued in a
+    munge_batch()
     """
+    batch = getattr(_batches, "current", None)
+    if batch is not None:
+        batch.add(
+            category,
+            input_files,
+            source_dir,
+            output_dir,
+            hash_strings=hash_strings,
+            sprite=sprite,
+            debug=debug,
+            **options,
+        )
+        return None
+
     inputs = input_files
     if isinstance(input_files, list):
         inputs = " ".join([f"'{file}'" for file in input_files])
@@ -188,20 +1481,21 @@ def munge(
         if not (input_files.startswith("'") and input_files.endswith("'")):
             inputs = f"'{input_files}'"
 
+    build = current_build()
     prefix = ""
     if category in ["Model", "Shader", "Texture"]:
-        prefix = Settings.platform.lower() + "_"
+        prefix = build.platform.lower() + "_"
 
     command = [
         f"{prefix}{category}Munge",
         f"-inputfile {inputs}",
         f"-sourcedir {source_dir}",
         f"-outputdir {output_dir}",
-        Settings.munge_args,
+        build.munge_args,
     ]
 
     if category == "Shader":
-        command.append(f"-I {source_dir}/shaders/{Settings.platform}/")
+        command.append(f"-I {source_dir}/shaders/{build.platform}/")
 
     if hash_strings:
         command.append("-hashstrings")
@@ -215,36 +1509,22 @@ def munge(
     if debug:
         command.append("-debug")
 
-    logger = log.getLogger("main")
-
-    try:
-        _exec_wine(command)
-    except sp.CalledProcessError as err:
-        logger.error(
-            '%s failed with args "%s"; Status %d.',
-            command[0],
-            " ".join(command[1:]),
-            err.returncode,
-        )
-
-    try:
-        with open(f"{prefix}{category}Munge.log", "r") as munge_log:
-            log_contents = str(munge_log.read())
-            if not (
-                search(r"0\s+Errors", log_contents)
-                and search(r"0\s+Warnings", log_contents)
-            ):
-                log_contents = f"[{inputs}]\n" + log_contents
-                logger.info(log_contents)
-    except FileNotFoundError as err:
-        logger.warning("Log file %s not found, continuing...", err.filename)
+    return _run_munge(
+        command,
+        f"{prefix}{category}Munge.log",
+        inputs,
+        find_inputs(input_files, source_dir) if Settings.use_cache else None,
+        output_dir,
+        patterns=input_files if isinstance(input_files, list) else None,
+        source_dir=source_dir,
+    )
 
 
 def localize_munge():
     pass
 
 
-def movie_munge(input_file: str, output_file: Path, debug: bool = False):
+def movie_munge(input_file: str, output_file: Path, debug: bool = False) -> ToolResult:
     command = [
         f"MovieMunge",
         f"-input {input_file}",
@@ -255,29 +1535,14 @@ def movie_munge(input_file: str, output_file: Path, debug: bool = False):
     if debug:
         command.append("-debug")
 
-    logger = log.getLogger("main")
-
-    try:
-        _exec_wine(command)
-    except sp.CalledProcessError as err:
-        logger.error(
-            '%s failed with args "%s"; Status %d.',
-            command[0],
-            " ".join(command[1:]),
-            err.returncode,
-        )
-
-    try:
-        with open(f"MovieMunge.log", "r") as munge_log:
-            log_contents = str(munge_log.read())
-            if not (
-                search(r"0\s+Errors", log_contents)
-                and search(r"0\s+Warnings", log_contents)
-            ):
-                log_contents = f"[{input_file}]\n" + log_contents
-                logger.info(log_contents)
-    except FileNotFoundError as err:
-        logger.warning("Log file %s not found, continuing...", err.filename)
+    return _run_munge(
+        command,
+        "MovieMunge.log",
+        input_file,
+        None,
+        output_file.parent,
+        span_category="movie_munge",
+    )
 
 
 def path_munge():
@@ -304,7 +1569,7 @@ def world_munge(
     chunk_id: str = None,
     ext: str = None,
     hash_strings: bool = False,
-) -> None:
+) -> ToolResult:
     inputs = input_files
     if isinstance(input_files, list):
         inputs = " ".join([f"'{file}'" for file in input_files])
@@ -317,7 +1582,7 @@ def world_munge(
         f"-inputfile {inputs}",
         f"-sourcedir {source_dir}",
         f"-outputdir {output_dir}",
-        Settings.munge_args,
+        current_build().munge_args,
     ]
 
     if output_file:
@@ -332,26 +1597,46 @@ def world_munge(
     if hash_strings:
         command.append("-hashstrings")
 
-    logger = log.getLogger("main")
+    return _run_munge(
+        command,
+        "ConfigMunge.log",
+        inputs,
+        find_inputs(input_files, source_dir) if Settings.use_cache else None,
+        output_dir,
+        output_file,
+        span_category="world_munge",
+        source_dir=source_dir,
+    )
 
-    try:
-        _exec_wine(command)
-    except sp.CalledProcessError as err:
-        logger.error(
-            '%s failed with args "%s"; Status %d.',
-            command[0],
-            " ".join(command[1:]),
-            err.returncode,
-        )
 
-    try:
-        with open(f"ConfigMunge.log", "r") as munge_log:
-            log_contents = str(munge_log.read())
-            if not (
-                search(r"0\s+Errors", log_contents)
-                and search(r"0\s+Warnings", log_contents)
-            ):
-                log_contents = f"[{inputs}]\n" + log_contents
-                logger.info(log_contents)
-    except FileNotFoundError as err:
-        logger.warning("Log file %s not found, continuing...", err.filename)
+def munge_async(*args, **kwargs) -> Awaitable[ToolResult]:
+    """
+    Awaitable variant of munge(), taking the same arguments. The call is never queued in
+    a munge_batch().
+    :return: An awaitable of the ToolResult of the call
+    """
+    return tool_runner.offload(munge, *args, **kwargs)
+
+
+def level_pack_async(*args, **kwargs) -> Awaitable[ToolResult]:
+    """
+    Awaitable variant of level_pack(), taking the same arguments
+    :return: An awaitable of the ToolResult of the call
+    """
+    return tool_runner.offload(level_pack, *args, **kwargs)
+
+
+def world_munge_async(*args, **kwargs) -> Awaitable[ToolResult]:
+    """
+    Awaitable variant of world_munge(), taking the same arguments
+    :return: An awaitable of the ToolResult of the call
+    """
+    return tool_runner.offload(world_munge, *args, **kwargs)
+
+
+def movie_munge_async(*args, **kwargs) -> Awaitable[ToolResult]:
+    """
+    Awaitable variant of movie_munge(), taking the same arguments
+    :return: An awaitable of the ToolResult of the call
+    """
+    return tool_runner.offload(movie_munge, *args, **kwargs)
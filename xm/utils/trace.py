@@ -0,0 +1,171 @@
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Optional, Union
+
+DEFAULT_TRACE_FILE = "munge-trace.json"
+
+
+class Span:
+    """
+    A single timed region of the build. Wine processes finished while the span is open
+    add their CPU time to it and raise its peak RSS, so a munger's span accounts for
+    every tool it ran in its thread.
+    """
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = perf_counter()
+        self.child_user_time = 0.0
+        self.child_system_time = 0.0
+        self.child_max_rss_kb = 0
+
+    def add_child_usage(self, usage) -> None:
+        """
+        Accumulates the resource usage of a finished child process
+        :param usage: A resource.struct_rusage, as returned by os.wait4
+        :return: None
+        """
+        self.child_user_time += usage.ru_utime
+        self.child_system_time += usage.ru_stime
+        # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+        max_rss = usage.ru_maxrss
+        if sys.platform == "darwin":
+            max_rss //= 1024
+        self.child_max_rss_kb = max(self.child_max_rss_kb, max_rss)
+
+
+class Tracer:
+    """
+    Records spans for munger runs, tool helper calls and Wine processes, and writes them
+    out as Chrome trace events which can be loaded into Perfetto or chrome://tracing.
+    Does nothing until start() is called.
+    """
+
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self.events: list[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = perf_counter()
+        self._thread_ids: dict[int, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def start(self, path: Union[str, Path]) -> None:
+        """
+        Starts recording spans
+        :param path: The file to write the trace to when save() is called
+        :return: None
+        """
+        self.path = Path(path)
+        self.events = []
+        self._origin = perf_counter()
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _thread_id(self) -> int:
+        """
+        Maps the current thread to a small integer so that the trace viewer shows one
+        compact row per worker
+        :return: The trace thread id
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._thread_ids:
+                self._thread_ids[ident] = len(self._thread_ids)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": self._thread_ids[ident],
+                        "args": {"name": threading.current_thread().name},
+                    }
+                )
+            return self._thread_ids[ident]
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """
+        Records the with-block as a span. The yielded Span's args may be updated inside
+        the block, e.g. with an exit status.
+        :param name: The name shown for the span, e.g. the tool name
+        :param category: The kind of span, e.g. "munger", "munge" or "wine"
+        :param args: Extra details to attach to the span
+        """
+        span = Span(name, category, args)
+        if not self.enabled:
+            yield span
+            return
+
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            end = perf_counter()
+            span.args.update(
+                child_user_time=round(span.child_user_time, 3),
+                child_system_time=round(span.child_system_time, 3),
+                child_max_rss_kb=span.child_max_rss_kb,
+            )
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((span.start - self._origin) * 1e6),
+                "dur": round((end - span.start) * 1e6),
+                "pid": os.getpid(),
+                "tid": self._thread_id(),
+                "args": {k: _jsonable(v) for k, v in span.args.items()},
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def add_child_usage(self, usage) -> None:
+        """
+        Attributes the resource usage of a finished child process to every span open in
+        the current thread
+        :param usage: A resource.struct_rusage
+        :return: None
+        """
+        if not self.enabled:
+            return
+        for span in self._stack():
+            span.add_child_usage(usage)
+
+    def save(self) -> None:
+        """
+        Writes the recorded spans to the trace file in Chrome trace-event format
+        :return: None
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            events = list(self.events)
+        with open(self.path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return str(value)
+
+
+tracer = Tracer()
@@ -1,3 +1,8 @@
+import os
+
+from .remote import WORKER_SECRET_ENV
+
+
 class ArgumentValidator:
     """
     A utility class for validating command-line argument values.
@@ -14,7 +19,8 @@ class ArgumentValidator:
         "FRENCH",
         "GERMAN",
         "ITALIAN",
-        "JAPANESE" "SPANISH",
+        "JAPANESE",
+        "SPANISH",
         "UK",
     ]
 
@@ -23,20 +29,42 @@ class ArgumentValidator:
 
     def _validate_platform(self):
         """
-        Determines whether the platform supplied in the args is valid.
-        :return: True if the platform is None or in the list of valid platform strings, False otherwise
+        Determines whether the platforms supplied in the args are valid.
+        :return: True if every platform is in the list of valid platform strings, False
+        otherwise
         """
-        return (
-            self.args.platform is None or self.args.platform.upper() in self.platforms
-        )
+        return all(platform in self.platforms for platform in self.args.platforms)
 
     def _validate_language(self):
         """
-        Determines whether the language supplied in the args is valid.
-        :return: True if the language is None or in the list of valid language strings, False otherwise
+        Determines whether the languages supplied in the args are valid.
+        :return: True if every language is in the list of valid language strings, False
+        otherwise
+        """
+        return all(language in self.languages for language in self.args.languages)
+
+    def _validate_plan(self):
+        """
+        Determines whether the plan options supplied in the args can be used together.
+        :return: True if at most one of --plan, --execute-plan and --watch was given,
+        False otherwise
+        """
+        given = [
+            getattr(self.args, "plan_file", None),
+            getattr(self.args, "execute_plan", None),
+            getattr(self.args, "watch", False),
+        ]
+        return sum(1 for option in given if option) <= 1
+
+    def _validate_workers(self):
+        """
+        Determines whether the remote workers supplied in the args can be authenticated
+        with.
+        :return: True if no workers were given or the shared secret is set, False
+        otherwise
         """
-        return (
-            self.args.language is None or self.args.language.upper() in self.languages
+        return not getattr(self.args, "workers", None) or bool(
+            os.environ.get(WORKER_SECRET_ENV)
         )
 
     def validate_args(self):
@@ -47,7 +75,21 @@ class ArgumentValidator:
         :return: None
         """
         if not self._validate_platform():
-            raise RuntimeError(f"Invalid platform {self.args.platform}")
+            invalid = [p for p in self.args.platforms if p not in self.platforms]
+            raise RuntimeError(f"Invalid platform {', '.join(invalid)}")
 
         if not self._validate_language():
-            raise RuntimeError(f"Invalid language {self.args.language}")
+            invalid = [
+                lang for lang in self.args.languages if lang not in self.languages
+            ]
+            raise RuntimeError(f"Invalid language {', '.join(invalid)}")
+
+        if not self._validate_plan():
+            raise RuntimeError(
+                "--plan, --execute-plan and --watch cannot be used together"
+            )
+
+        if not self._validate_workers():
+            raise RuntimeError(
+                f"--workers needs the workers' secret in {WORKER_SECRET_ENV}"
+            )
@@ -0,0 +1,348 @@
+import ctypes
+import ctypes.util
+import logging as log
+import os
+import select
+import struct
+import sys
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Callable, Iterable, Optional
+
+from .cache import file_digest
+from .globals import Settings
+from .tools import path_index
+
+# The directories next to _BUILD which hold sources, as named by the modtools
+WATCHED_DIRS = ["Common", "Shell", "Load", "Sides", "Worlds", "addme", "Sound"]
+
+# Directories the mungers themselves write to inside the source tree (Load/__TEMP__,
+# addme/munged and the sprite textures in Sides/<side>/MUNGED), which must not trigger
+# another munge. This also covers pre-munged files, which are rarely edited by hand.
+IGNORED_PARTS = ["__temp__", "munged"]
+
+# Temporary files written by editors while saving
+IGNORED_SUFFIXES = (".swp", ".swx", ".tmp", "~")
+
+# Flags from sys/inotify.h
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+)
+_EVENT = struct.Struct("iIII")
+
+
+def is_ignored(path: Path, data_dir: Path) -> bool:
+    """
+    Checks whether a change to a path should be ignored, because it is an editor's
+    temporary file or something the mungers wrote themselves
+    :param path: The changed path
+    :param data_dir: The data_<ID> directory
+    :return: True if the change should not trigger a munge, False otherwise
+    """
+    if path.name.lower().endswith(IGNORED_SUFFIXES) or path.name.startswith(".#"):
+        return True
+    try:
+        parts = [p.lower() for p in path.relative_to(data_dir).parts]
+    except ValueError:
+        return True
+    return any(p in IGNORED_PARTS for p in parts)
+
+
+class PollingWatcher:
+    """
+    Detects changes by comparing the size and modification time of every file under the
+    watched directories against the previous scan
+    """
+
+    def __init__(self, roots: Iterable[Path], interval: float = 1.0):
+        self.roots = list(roots)
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for root in self.roots:
+            for directory, dirs, files in os.walk(root):
+                for name in files:
+                    path = Path(directory) / name
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout: float) -> set[Path]:
+        """
+        Waits up to timeout seconds for changes
+        :param timeout: The longest time to wait, in seconds
+        :return: The paths which were created, modified or deleted
+        """
+        sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {
+            path
+            for path in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(path) != self.snapshot.get(path)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changes through Linux's inotify, watching every directory under the watched
+    directories and any created later
+    """
+
+    def __init__(self, roots: Iterable[Path]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = list(roots)
+        self.watches: dict[int, Path] = {}
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _add_tree(self, root: Path) -> set[Path]:
+        """
+        Watches a directory and all of its subdirectories
+        :return: The files already in them, which may have been written before the
+        watches were in place
+        """
+        found = set()
+        for directory, dirs, files in os.walk(root):
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd < 0:
+                log.getLogger("main").warning(
+                    "Cannot watch %s: %s", directory, os.strerror(ctypes.get_errno())
+                )
+                continue
+            self.watches[wd] = Path(directory)
+            found.update(Path(directory) / name for name in files)
+        return found
+
+    def poll(self, timeout: float) -> set[Path]:
+        """
+        Waits up to timeout seconds for changes
+        :param timeout: The longest time to wait, in seconds
+        :return: The paths which were created, modified or deleted
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size : offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost, so everything has to be treated as changed
+                changed.update(self.roots)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = directory / os.fsdecode(name.rstrip(b"\0"))
+            changed.add(path)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                changed.update(self._add_tree(path))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_watcher(roots: Iterable[Path]):
+    """
+    Creates an InotifyWatcher where inotify is available, otherwise a PollingWatcher
+    :param roots: The directories to watch, recursively
+    :return: The watcher
+    """
+    roots = [r for r in roots if r.exists()]
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as err:
+            log.getLogger("main").debug(
+                "inotify is unavailable (%s), polling for changes instead", err
+            )
+    return PollingWatcher(roots)
+
+
+def wait_for_changes(watcher, debounce: float) -> set[Path]:
+    """
+    Blocks until something changes, then keeps collecting changes until none have
+    arrived for debounce seconds, so that a burst of saves results in one munge
+    :param watcher: The watcher to read changes from
+    :param debounce: The quiet period, in seconds
+    :return: Every path that changed
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.poll(1.0)
+    last_change = monotonic()
+    while monotonic() - last_change < debounce:
+        more = watcher.poll(debounce - (monotonic() - last_change))
+        if more:
+            changed.update(more)
+            last_change = monotonic()
+    return changed
+
+
+def actions_for_changes(changed: Iterable[Path], data_dir: Path) -> Optional[dict]:
+    """
+    Maps changed files to the mungers which consume them, in the form of the actions
+    list built from the command-line arguments. Within each munger only the munge and
+    LevelPack calls whose inputs actually changed will run, since the rest are skipped
+    by the build manifest.
+    :param changed: The changed paths
+    :param data_dir: The data_<ID> directory
+    :return: An actions list for schedule_mungers, or None if nothing needs munging
+    """
+    actions = {
+        "worlds": [],
+        "sides": [],
+        "load": False,
+        "common": False,
+        "shell": False,
+        "movies": False,
+        "localize": False,
+        "sound": False,
+        "addme": False,
+        "all": False,
+    }
+    for path in changed:
+        if is_ignored(path, data_dir):
+            continue
+        parts = path.relative_to(data_dir).parts
+        top = parts[0].lower()
+        if top == "common":
+            actions["common"] = True
+        elif top == "shell":
+            actions["shell"] = True
+            actions["movies"] = actions["movies"] or (
+                len(parts) == 1 or parts[1].lower() == "movies"
+            )
+        elif top == "load":
+            actions["load"] = True
+        elif top == "addme":
+            actions["addme"] = True
+        elif top == "sound":
+            actions["sound"] = True
+        elif top in ["sides", "worlds"] and len(parts) != 2:
+            if len(parts) == 1 or parts[1].lower() == "common":
+                # Everything on that side of the tree packs against Sides/Common or
+                # Worlds/Common, and the whole of Sides or Worlds is reported as changed
+                # when the watcher lost events
+                actions[top] = "EVERYTHING"
+            elif actions[top] != "EVERYTHING" and parts[1] not in actions[top]:
+                actions[top].append(parts[1])
+
+    if not any(actions.values()):
+        return None
+    return actions
+
+
+def _common_files_digests(platform: str) -> dict[str, Optional[str]]:
+    munge_dir = Path("Common") / "MUNGED" / platform
+    digests = {}
+    for name in ["core", "common", "ingame"]:
+        path = munge_dir / f"{name}.files"
+        digests[name] = file_digest(path) if path.exists() else None
+    return digests
+
+
+def watch(
+    build: Callable[[dict], None],
+    data_dir: Path,
+    debounce: float = 0.3,
+) -> None:
+    """
+    Munges whatever changes under the source directories until interrupted. Each batch
+    of changes is mapped to the mungers that consume it and passed to build, in the same
+    process, so path lookups, manifests and the Wine session stay warm between munges.
+    :param build: Munges and deploys an actions list; exceptions it raises are logged
+    and watching continues
+    :param data_dir: The data_<ID> directory
+    :param debounce: (Optional) How long to wait for further changes before munging, in
+    seconds
+    :return: None
+    """
+    logger = log.getLogger("main")
+    roots = [path_index.resolve(data_dir / d) for d in WATCHED_DIRS]
+    watcher = create_watcher(roots)
+    logger.info(
+        "Watching %s for changes (%s), press Ctrl+C to stop",
+        data_dir,
+        "inotify" if isinstance(watcher, InotifyWatcher) else "polling",
+    )
+    try:
+        while True:
+            changed = wait_for_changes(watcher, debounce)
+            for path in changed:
+                path_index.invalidate(path.parent)
+            actions = actions_for_changes(changed, data_dir)
+            if actions is None:
+                continue
+
+            start_time = monotonic()
+            logger.info(
+                "Changed: %s",
+                ", ".join(sorted(str(p.relative_to(data_dir)) for p in changed)),
+            )
+            try:
+                if actions["common"]:
+                    before = [_common_files_digests(p) for p in Settings.platforms]
+                    build(actions)
+                    if [_common_files_digests(p) for p in Settings.platforms] != before:
+                        # The .files lists everything else packs against changed
+                        logger.info("Common's contents changed, repacking the rest")
+                        actions = dict(
+                            actions,
+                            common=False,
+                            addme=False,
+                            shell=True,
+                            load=True,
+                            sides="EVERYTHING",
+                            worlds="EVERYTHING",
+                        )
+                        build(actions)
+                else:
+                    build(actions)
+                logger.info("Munged and deployed in %.2fs", monotonic() - start_time)
+            except Exception as err:
+                logger.error("Munge failed: %s", err)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        watcher.close()
@@ -0,0 +1,159 @@
+import atexit
+import logging as log
+import os
+import shlex
+import signal
+import subprocess as sp
+from pathlib import Path
+from shutil import which
+from threading import Lock
+from time import monotonic
+from typing import Optional, Union
+
+
+def wine_env(tools_dir: Union[str, Path], prefix: Optional[str] = None) -> dict:
+    """
+    Builds the environment the tools run in: that of this process, with WINEPATH set to
+    the modtools' ToolsFL/bin directory so that Wine finds the tools by name, and
+    WINEPREFIX if a prefix is given
+    :param tools_dir: The modtools' ToolsFL/bin directory
+    :param prefix: (Optional) The WINEPREFIX to use, otherwise Wine's default
+    :return: The environment
+    """
+    env = dict(os.environ)
+    env["WINEPATH"] = str(Path(tools_dir).resolve())
+    if prefix:
+        # Tools run in a scratch directory, so a relative prefix has to be resolved here
+        env["WINEPREFIX"] = str(Path(prefix).expanduser().resolve())
+    return env
+
+
+def wine_argv(command: list[str]) -> list[str]:
+    """
+    Turns a tool command, whose items are options along with their values (e.g.
+    "-inputfile '$*.tga' '$*.pic'"), into the arguments to start it with through Wine.
+    Items are split and unquoted as a shell would, but nothing is expanded, so patterns
+    such as $*.req reach the tool as written.
+    :param command: The tool and its arguments
+    :return: The argument list
+    """
+    return ["wine"] + [arg for item in command for arg in shlex.split(item)]
+
+
+class WineSession:
+    """
+    Owns a persistent wineserver for the duration of a munge. Without one, every Wine
+    invocation that finds no server running has to start (and later tear down) its own,
+    which is most of Wine's startup cost. If a server is already running for the prefix
+    it is reused as-is and left running afterwards.
+    """
+
+    def __init__(self):
+        self.prefix: Optional[Path] = None
+        self.owned = False
+        self.started = False
+        self._lock = Lock()
+        self._previous_handlers = {}
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        if self.prefix:
+            env["WINEPREFIX"] = str(self.prefix)
+        return env
+
+    def _server_socket(self) -> Optional[Path]:
+        """
+        Locates the socket a wineserver for this prefix would listen on, i.e.
+        /tmp/.wine-<uid>/server-<dev>-<inode>/socket where dev and inode are those of
+        the prefix directory
+        :return: The socket path, or None if the prefix does not exist (yet)
+        """
+        prefix = self.prefix or Path(
+            os.environ.get("WINEPREFIX", Path.home() / ".wine")
+        )
+        try:
+            stat = prefix.expanduser().stat()
+        except FileNotFoundError:
+            return None
+        server_dir = f"server-{stat.st_dev:x}-{stat.st_ino:x}"
+        return Path(f"/tmp/.wine-{os.getuid()}") / server_dir / "socket"
+
+    def is_running(self) -> bool:
+        socket = self._server_socket()
+        return socket is not None and socket.exists()
+
+    def start(self, prefix: Optional[str] = None) -> None:
+        """
+        Starts a persistent wineserver for the prefix unless one is already running, and
+        arranges for it to be shut down at exit or on SIGINT/SIGTERM
+        :param prefix: (Optional) The WINEPREFIX to use, otherwise Wine's default
+        :return: None
+        """
+        logger = log.getLogger("main")
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            self.prefix = Path(prefix).expanduser().resolve() if prefix else None
+
+            if os.name == "nt" or which("wineserver") is None:
+                logger.debug("wineserver not found, Wine sessions will not be reused")
+                return
+
+            if self.is_running():
+                logger.debug("Reusing the running wineserver for %s", self.prefix)
+                return
+
+            start_time = monotonic()
+            # wineserver forks into the background once it is ready to accept clients
+            result = sp.run(["wineserver", "--persistent"], env=self._env())
+            if result.returncode != 0:
+                logger.warning(
+                    "Could not start a persistent wineserver (status %d), "
+                    "continuing without one",
+                    result.returncode,
+                )
+                return
+            self.owned = True
+            logger.debug(
+                "Started persistent wineserver in %.2fs", monotonic() - start_time
+            )
+
+        atexit.register(self.stop)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._previous_handlers[signum] = signal.signal(
+                    signum, self._handle_signal
+                )
+            except ValueError:
+                # Not on the main thread, rely on atexit alone
+                pass
+
+    def stop(self) -> None:
+        """
+        Shuts down the wineserver if this session started it
+        :return: None
+        """
+        with self._lock:
+            if not self.owned:
+                return
+            self.owned = False
+            logger = log.getLogger("main")
+            logger.debug("Shutting down wineserver")
+            sp.run(["wineserver", "--kill"], env=self._env())
+
+    def _handle_signal(self, signum, frame) -> None:
+        self.stop()
+        previous = self._previous_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    @property
+    def warm(self) -> bool:
+        return self.owned or (self.started and self.is_running())
+
+
+wine_session = WineSession()
@@ -0,0 +1,137 @@
+import atexit
+import logging as log
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+WORK_DIR_PREFIX = ".xmunge-work-"
+
+
+class WorkDirPool:
+    """
+    Hands out scratch working directories for tool invocations. The tools write their
+    logs to fixed names in their working directory, so two of them running in _BUILD at
+    once would overwrite each other's logs. Each scratch directory sits next to _BUILD
+    and holds a symlink to every directory in _BUILD, so the relative paths the tools
+    are given (../Common, Common/MUNGED/PC, ...) resolve exactly as they would from
+    _BUILD while the logs stay separate.
+
+    Where symlinks cannot be made (e.g. on Windows without developer mode) every tool
+    runs in _BUILD itself, one at a time.
+    """
+
+    def __init__(self):
+        self.build_dir: Optional[Path] = None
+        self._free: list[Path] = []
+        self._count = 0
+        self._lock = Lock()
+        self._shared_lock = Lock()
+        self._isolated = os.name != "nt"
+
+    def _new_dir(self) -> Path:
+        with self._lock:
+            if self.build_dir is None:
+                self.build_dir = Path.cwd()
+                atexit.register(self.cleanup)
+            self._count += 1
+            work_dir = (
+                self.build_dir.parent / f"{WORK_DIR_PREFIX}{os.getpid()}-{self._count}"
+            )
+        work_dir.mkdir(exist_ok=True)
+        return work_dir
+
+    def _sync(self, work_dir: Path) -> None:
+        """
+        Links every directory in _BUILD into work_dir and drops links to directories
+        which no longer exist
+        """
+        wanted = {e.name for e in os.scandir(self.build_dir) if e.is_dir()}
+        present = set()
+        for entry in os.scandir(work_dir):
+            if entry.is_symlink():
+                if entry.name in wanted:
+                    present.add(entry.name)
+                else:
+                    os.remove(entry.path)
+        for name in wanted - present:
+            os.symlink(Path("..") / self.build_dir.name / name, work_dir / name)
+
+    def _collect(self, work_dir: Path, keep: list[str]) -> None:
+        """
+        Moves anything a tool created at the top level of work_dir (other than the files
+        named in keep) into _BUILD, where it would have been created without the scratch
+        directory
+        """
+        for entry in os.scandir(work_dir):
+            if entry.is_symlink() or entry.name in keep:
+                continue
+            dest = self.build_dir / entry.name
+            if entry.is_dir() and dest.is_dir():
+                shutil.copytree(entry.path, dest, dirs_exist_ok=True)
+                shutil.rmtree(entry.path)
+            else:
+                os.replace(entry.path, dest)
+
+    @contextmanager
+    def acquire(self, keep: list[str] = ()):
+        """
+        Provides a working directory for one tool invocation. When the with-block exits,
+        files named in keep are deleted and everything else the tool created is moved
+        into _BUILD.
+        :param keep: Names of files the caller reads from the working directory itself,
+        e.g. the tool's log
+        :return: The path of the working directory
+        """
+        if not self._isolated:
+            with self._shared_lock:
+                yield Path(".")
+            return
+
+        with self._lock:
+            work_dir = self._free.pop() if self._free else None
+        if work_dir is None:
+            work_dir = self._new_dir()
+        try:
+            self._sync(work_dir)
+        except OSError as err:
+            log.getLogger("main").warning(
+                "Could not set up scratch directory %s (%s), "
+                "running tools one at a time in _BUILD",
+                work_dir,
+                err,
+            )
+            self._isolated = False
+            shutil.rmtree(work_dir, ignore_errors=True)
+            with self._shared_lock:
+                yield Path(".")
+            return
+
+        try:
+            yield work_dir
+        finally:
+            for name in keep:
+                if os.path.lexists(work_dir / name):
+                    os.remove(work_dir / name)
+            self._collect(work_dir, list(keep))
+            with self._lock:
+                self._free.append(work_dir)
+
+    def cleanup(self) -> None:
+        """
+        Removes every scratch directory this process created
+        :return: None
+        """
+        if self.build_dir is None:
+            return
+        for work_dir in self.build_dir.parent.glob(f"{WORK_DIR_PREFIX}{os.getpid()}-*"):
+            for entry in os.scandir(work_dir):
+                if entry.is_symlink() or not entry.is_dir():
+                    os.remove(entry.path)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self._free = []
+
+
+work_dirs = WorkDirPool()
@@ -0,0 +1,326 @@
+import atexit
+import hmac
+import logging
+import os
+import posixpath
+import re
+import secrets
+import shlex
+import shutil
+import socket
+import stat
+import subprocess as sp
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from xm.utils.remote import (
+    PROTOCOL_VERSION,
+    WORKER_SECRET_ENV,
+    auth_digest,
+    read_message,
+    read_payload,
+    send_message,
+)
+from xm.utils.wine import wine_argv, wine_env
+
+# Name of the directory standing in for data_<ID> in each job, so that the relative
+# paths in commands (../Common, Common/MUNGED/PC, ...) resolve from the _BUILD directory
+# inside it
+_JOB_DATA = "data"
+
+# The executables in the tools directory which clients may run
+_TOOL_PATTERN = re.compile(r"[A-Za-z0-9_]*Munge|LevelPack", re.IGNORECASE)
+
+
+def _inside_job(path: str) -> bool:
+    """
+    Checks that a path given by a client, relative to the _BUILD directory of a job,
+    stays inside the job's data directory
+    :param path: The path, with either kind of slash
+    :return: True if the path is relative and does not climb out of the data directory,
+    False otherwise
+    """
+    path = path.replace("\\", "/")
+    if posixpath.isabs(path) or re.match(r"[A-Za-z]:", path):
+        return False
+    rel = posixpath.normpath(posixpath.join("_BUILD", path))
+    return rel != ".." and not rel.startswith("../")
+
+
+class MungeWorker:
+    """
+    Runs tool invocations sent by munge clients (see WorkerPool in xm.utils.remote) with
+    the modtools and Wine on this machine. Every file a client sends is kept in a store
+    keyed by its content hash, so files which do not change between invocations are only
+    sent once. Each invocation runs in a fresh copy of the relevant part of the client's
+    data directory, linked from the store; everything the tool writes there is sent
+    back. Up to slots invocations run at once, each in its own job directory; clients
+    learn the number of slots when they connect and send that many jobs at a time.
+
+    Clients have to prove they know the worker's secret before sending a job, and only
+    the munge tools and LevelPack in the tools directory may be run, with paths inside
+    the job's data directory.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        tools_dir: Path,
+        secret: str,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        wine_prefix: Optional[str] = None,
+        slots: int = 1,
+    ):
+        if not secret:
+            raise ValueError(
+                "A munge worker needs a secret to authenticate clients with"
+            )
+        self.root = root
+        self.blobs = root / "blobs"
+        self.jobs = root / "jobs"
+        self.tools_dir = tools_dir
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.wine_prefix = wine_prefix
+        self.slots = max(1, slots)
+        self._job_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.slots)
+        self._count = 0
+
+    def _receive_blobs(self, stream, hashes: list[str]) -> None:
+        for _ in hashes:
+            message = read_message(stream)
+            digest = message["hash"]
+            temp = self.blobs / f".{digest}.{threading.get_ident()}.tmp"
+            if read_payload(stream, message["size"], temp) != digest:
+                temp.unlink()
+                raise ValueError(f"Received file does not match its hash {digest}")
+            os.chmod(temp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(temp, self.blobs / digest)
+
+    def _check_job(self, job: dict) -> None:
+        """
+        Makes sure a job only runs one of the modtools' executables, and only refers to
+        paths inside its data directory
+        :param job: The job sent by the client
+        :raise ValueError: If the job is not allowed
+        :return: None
+        """
+        tool = job["command"][0]
+        tools = {
+            entry.name[: -len(".exe")].lower()
+            for entry in os.scandir(self.tools_dir)
+            if entry.name.lower().endswith(".exe")
+        }
+        if not _TOOL_PATTERN.fullmatch(tool) or tool.lower() not in tools:
+            raise ValueError(f"Refusing to run {tool}, which is not a munge tool")
+        for arg in [arg for item in job["command"][1:] for arg in shlex.split(item)]:
+            if not arg.startswith("-") and not _inside_job(arg):
+                raise ValueError(f"Refusing a path outside the job directory: {arg}")
+        for rel in list(job["files"]) + list(job["dirs"]):
+            if not _inside_job(rel):
+                raise ValueError(f"Refusing a path outside the job directory: {rel}")
+        if job.get("log_name") and not _inside_job(job["log_name"]):
+            raise ValueError(
+                f"Refusing a path outside the job directory: {job['log_name']}"
+            )
+
+    @staticmethod
+    def _snapshot(directory: Path) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = Path(root) / name
+                info = path.stat()
+                snapshot[path] = (info.st_size, info.st_mtime_ns)
+        return snapshot
+
+    def _run_job(self, stream, job: dict) -> None:
+        logger = logging.getLogger("main")
+        with self._job_lock:
+            self._count += 1
+            job_dir = self.jobs / f"{os.getpid()}-{self._count}"
+        data_dir = job_dir / _JOB_DATA
+        build_dir = data_dir / "_BUILD"
+        try:
+            build_dir.mkdir(parents=True)
+            for rel, digest in job["files"].items():
+                dest = Path(os.path.normpath(build_dir / rel))
+                if data_dir not in dest.parents:
+                    raise ValueError(
+                        f"Refusing to write outside the job directory: {rel}"
+                    )
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(self.blobs / digest, dest)
+                except OSError:
+                    shutil.copyfile(self.blobs / digest, dest)
+            for rel in job["dirs"]:
+                dest = Path(os.path.normpath(build_dir / rel))
+                if data_dir in dest.parents:
+                    dest.mkdir(parents=True, exist_ok=True)
+
+            before = self._snapshot(data_dir)
+            logger.debug("Running %s", " ".join(job["command"]))
+            process = sp.Popen(
+                wine_argv(job["command"]),
+                cwd=build_dir,
+                env=wine_env(self.tools_dir, self.wine_prefix),
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE,
+                stderr=sp.STDOUT,
+                text=True,
+                errors="replace",
+            )
+            for line in process.stdout:
+                send_message(stream, {"type": "line", "line": line.rstrip()})
+            process.stdout.close()
+            returncode = process.wait()
+
+            log_text = ""
+            log_path = build_dir / job["log_name"] if job.get("log_name") else None
+            if log_path is not None and log_path.exists():
+                with open(log_path, "r", errors="replace") as tool_log:
+                    log_text = "\n".join(line.rstrip("\n") for line in tool_log)
+                log_path.unlink()
+
+            for path, info in sorted(self._snapshot(data_dir).items()):
+                if before.get(path) != info:
+                    rel = Path(os.path.relpath(path, build_dir)).as_posix()
+                    send_message(stream, {"type": "file", "path": rel}, path)
+            send_message(
+                stream, {"type": "done", "returncode": returncode, "log": log_text}
+            )
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _handle_client(self, conn: socket.socket) -> None:
+        logger = logging.getLogger("main")
+        with conn:
+            stream = conn.makefile("rwb")
+            try:
+                nonce = secrets.token_hex(16)
+                send_message(
+                    stream,
+                    {
+                        "type": "hello",
+                        "version": PROTOCOL_VERSION,
+                        "nonce": nonce,
+                        "slots": self.slots,
+                    },
+                )
+                auth = read_message(stream)
+                if not hmac.compare_digest(
+                    str(auth.get("digest", "")), auth_digest(self.secret, nonce)
+                ):
+                    logger.warning("Rejected a client which did not know the secret")
+                    send_message(
+                        stream, {"type": "error", "error": "Authentication failed"}
+                    )
+                    return
+                job = read_message(stream)
+                self._check_job(job)
+                missing = sorted(
+                    {d for d in job["files"].values() if not (self.blobs / d).exists()}
+                )
+                send_message(stream, {"type": "need", "hashes": missing})
+                self._receive_blobs(stream, missing)
+                with self._slots:
+                    self._run_job(stream, job)
+            except (OSError, ValueError, KeyError, IndexError, TypeError) as err:
+                logger.warning("Job failed: %s", err)
+                try:
+                    send_message(stream, {"type": "error", "error": str(err)})
+                except OSError:
+                    pass
+
+    def serve_forever(self, ready: Optional[callable] = None) -> None:
+        """
+        Accepts clients until interrupted
+        :param ready: (Optional) Called with the port once the worker is listening
+        :return: None
+        """
+        logger = logging.getLogger("main")
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.jobs.mkdir(parents=True, exist_ok=True)
+        with socket.create_server((self.host, self.port)) as server:
+            self.port = server.getsockname()[1]
+            logger.info("Munge worker listening on %s:%d", self.host, self.port)
+            if ready is not None:
+                ready(self.port)
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(
+                    target=self._handle_client, args=(conn,), daemon=True
+                ).start()
+
+
+def start_local_workers(
+    count: int, tools_dir: Path, secret: str, wine_prefix: Optional[str] = None
+) -> list[tuple[str, int]]:
+    """
+    Starts munge workers on loopback ports as child processes, sharing one file store,
+    e.g. to try out distributed munging on a single machine. They are stopped when this
+    process exits.
+    :param count: The number of workers
+    :param tools_dir: The modtools' ToolsFL/bin directory
+    :param secret: The secret the workers authenticate clients with
+    :param wine_prefix: (Optional) The WINEPREFIX the workers should use
+    :return: The (host, port) of each worker
+    """
+    root = Path(tempfile.mkdtemp(prefix="xmunge-workers-"))
+    processes = []
+    addresses = []
+    for _ in range(count):
+        command = [
+            sys.executable,
+            "-m",
+            "xm",
+            "worker",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            "0",
+            "--root",
+            str(root),
+            "--tools-dir",
+            str(tools_dir.resolve()),
+            "--slots",
+            "1",
+        ]
+        if wine_prefix:
+            command += ["--wine-prefix", wine_prefix]
+        process = sp.Popen(
+            command,
+            stdout=sp.PIPE,
+            text=True,
+            env=dict(
+                os.environ,
+                PYTHONPATH=str(Path(__file__).resolve().parent.parent),
+                **{WORKER_SECRET_ENV: secret},
+            ),
+        )
+        processes.append(process)
+        # The worker prints its port on the first line of its output once it is
+        # listening
+        port = process.stdout.readline().strip()
+        if not port.isdigit():
+            raise RuntimeError(
+                f"Local munge worker exited with status {process.wait()}"
+            )
+        addresses.append(("127.0.0.1", int(port)))
+
+    def stop() -> None:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+    atexit.register(stop)
+    return addresses